@@ -0,0 +1,190 @@
+# ============================================================
+#   CACHÉ DE RESPUESTAS IA
+#   Clave = pregunta normalizada + versión del prompt/contenido
+#   + coalescencia de preguntas idénticas en vuelo (single-flight)
+# ============================================================
+
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import logging
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from database import SessionLocal, AiAnswer
+
+log = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_question(text: str) -> str:
+    """
+    "¿Cuánto cuesta el curso?" → "cuanto cuesta el curso"
+    Minúsculas, sin tildes, sin signos, espacios colapsados.
+    """
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    return _NON_WORD.sub(" ", t).strip()
+
+
+class AnswerCache:
+    """
+    LRU en memoria con TTL y, opcional, una capa persistente en la
+    tabla ai_answers (sobrevive reinicios). get() y set() son async:
+    la memoria se mira en el loop y la tabla en un hilo. invalidate() y
+    prune() son bloqueantes (hilos del mantenimiento / de FastAPI, o
+    asyncio.to_thread); el lock protege la memoria entre esos hilos.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 86400,
+                 persist: bool = False, session_factory=SessionLocal):
+        self.max_size        = max_size
+        self.ttl             = ttl
+        self.persist         = persist
+        self.session_factory = session_factory
+        self._items          = OrderedDict()   # key -> (answer, ts)
+        self._lock           = threading.Lock()
+        self.hits            = 0
+        self.misses          = 0
+
+    @staticmethod
+    def key(text: str, version: str) -> str:
+        return hashlib.sha1(f"{version}\0{normalize_question(text)}".encode("utf-8")).hexdigest()
+
+    async def get(self, text: str, version: str):
+        k = self.key(text, version)
+        with self._lock:
+            item = self._items.get(k)
+            if item is not None:
+                if time.time() - item[1] <= self.ttl:
+                    self._items.move_to_end(k)
+                    self.hits += 1
+                    return item[0]
+                del self._items[k]
+
+        if self.persist:
+            answer, ts = await asyncio.to_thread(self._db_get, k)
+            if answer is not None:
+                with self._lock:
+                    self._put(k, answer, ts)
+                    self.hits += 1
+                return answer
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, version: str, answer: str):
+        k = self.key(text, version)
+        with self._lock:
+            self._put(k, answer, time.time())
+        if self.persist:
+            await asyncio.to_thread(self._db_set, k, version, answer)
+
+    def invalidate(self, keep_version: str = None, memory_only: bool = False):
+        """
+        Vacía la memoria y borra de la BD lo que no sea keep_version.
+        memory_only: solo la memoria (sin I/O, seguro en el event loop);
+        la BD ya la limpió el worker que publicó el contenido.
+        """
+        with self._lock:
+            self._items.clear()
+        if self.persist and not memory_only:
+            db = self.session_factory()
+            try:
+                q = db.query(AiAnswer)
+                if keep_version:
+                    q = q.filter(AiAnswer.version != keep_version)
+                q.delete(synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+
+    def prune(self) -> int:
+        """
+        Borra de ai_answers las respuestas vencidas por TTL.
+        """
+        if not self.persist:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        db = self.session_factory()
+        try:
+            n = (db.query(AiAnswer)
+                   .filter(AiAnswer.created_at < cutoff)
+                   .delete(synchronize_session=False))
+            db.commit()
+            return n
+        finally:
+            db.close()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _put(self, k, answer, ts):
+        self._items[k] = (answer, ts)
+        self._items.move_to_end(k)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def _db_get(self, k):
+        db = self.session_factory()
+        try:
+            row = db.get(AiAnswer, k)
+            if row is None:
+                return None, None
+            if row.created_at and row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+                db.delete(row); db.commit()
+                return None, None
+            age = (datetime.utcnow() - row.created_at).total_seconds() if row.created_at else 0
+            return row.answer, time.time() - age
+        finally:
+            db.close()
+
+    def _db_set(self, k, version, answer):
+        db = self.session_factory()
+        try:
+            db.merge(AiAnswer(key=k, version=version, answer=answer, created_at=datetime.utcnow()))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            log.warning("No se pudo guardar respuesta IA en caché: %s", e)
+        finally:
+            db.close()
+
+
+class SingleFlight:
+    """
+    Llamadas concurrentes con la misma clave comparten una sola
+    ejecución: la primera lanza fn() como task y las demás esperan
+    ese mismo resultado (o excepción).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders   = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # shield: si se cancela quien esperaba, la llamada sigue para los demás
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # marcar como leída aunque nadie la espere
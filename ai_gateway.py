@@ -0,0 +1,152 @@
+# ============================================================
+#   GATEWAY ASÍNCRONO A OPENAI
+#   Límite de concurrencia, deadline por pedido, reintentos con
+#   jitter y circuit breaker
+# ============================================================
+
+import asyncio
+import logging
+import random
+import time
+
+import openai
+
+log = logging.getLogger(__name__)
+
+# Errores transitorios: vale la pena reintentar
+RETRYABLE = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpen(Exception):
+    """El backend de IA está marcado como caído; no se intenta la llamada."""
+
+
+class CircuitBreaker:
+    """
+    closed → (threshold fallos seguidos) → open → (cooldown) → half_open
+    En half_open pasa un solo pedido de prueba: si sale bien se cierra,
+    si falla vuelve a open.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold  = threshold
+        self.cooldown   = cooldown
+        self.failures   = 0
+        self.opened_at  = None
+        self._probing   = False
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def record_success(self):
+        self.failures  = 0
+        self.opened_at = None
+        self._probing  = False
+
+    def end_probe(self):
+        # Prueba cancelada sin resultado: la próxima llamada puede probar
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing  = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            log.warning("IA: circuito abierto por %.0fs (%d fallos seguidos)", self.cooldown, self.failures)
+
+
+class AIGateway:
+    """
+    complete() devuelve el texto de la respuesta o lanza una excepción
+    (CircuitOpen, asyncio.TimeoutError o el error de OpenAI).
+    El deadline cubre la espera por un cupo, los reintentos y las pausas.
+    """
+
+    def __init__(self, client, model: str = "gpt-3.5-turbo", temperature: float = 0.3,
+                 max_concurrency: int = 8, deadline: float = 8.0, retries: int = 2,
+                 backoff_base: float = 0.25, breaker: CircuitBreaker = None):
+        self.client       = client
+        self.model        = model
+        self.temperature  = temperature
+        self.deadline     = deadline
+        self.retries      = retries
+        self.backoff_base = backoff_base
+        self.breaker      = breaker or CircuitBreaker()
+        self.max_concurrency = max_concurrency
+        self._sem         = None
+        self.in_flight    = 0
+
+    @property
+    def sem(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    async def complete(self, system_prompt: str, user_text: str) -> str:
+        probe = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            raise CircuitOpen()
+        try:
+            answer = await asyncio.wait_for(
+                self._complete_with_retries(system_prompt, user_text), timeout=self.deadline
+            )
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            # Cancelación u otra BaseException: sin esto el half_open
+            # quedaría "probando" para siempre y rechazaría todo
+            if probe:
+                self.breaker.end_probe()
+        self.breaker.record_success()
+        return answer
+
+    async def _complete_with_retries(self, system_prompt: str, user_text: str) -> str:
+        attempt = 0
+        while True:
+            try:
+                async with self.sem:
+                    self.in_flight += 1
+                    try:
+                        response = await self.client.chat.completions.create(
+                            model=self.model,
+                            temperature=self.temperature,
+                            messages=[
+                                {"role":"system","content":system_prompt},
+                                {"role":"user","content":user_text}
+                            ],
+                            timeout=self.deadline,
+                        )
+                    finally:
+                        self.in_flight -= 1
+                return response.choices[0].message.content.strip()
+            except RETRYABLE as e:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                # Backoff exponencial con "full jitter"
+                delay = random.uniform(0, self.backoff_base * (2 ** attempt))
+                log.info("IA: reintento %d/%d en %.2fs (%s)", attempt, self.retries, delay, type(e).__name__)
+                await asyncio.sleep(delay)
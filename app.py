@@ -6,15 +6,35 @@
 
 from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
-import os, json, re, requests, csv
+import os, json, re, csv, asyncio, zlib, logging, time, multiprocessing
 from io import StringIO
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, func, Boolean
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import Query
 from datetime import datetime, timedelta
 from typing import List, Tuple
-from openai import OpenAI
-import traceback
+from openai import AsyncOpenAI
+
+from database import SessionLocal, Lead, Enrollment, Campaign
+from lead_writer import LeadWriter
+from ai_cache import AnswerCache, SingleFlight
+from ai_gateway import AIGateway, CircuitBreaker, CircuitOpen
+from content_snapshot import ContentSnapshot, content_version, freeze
+from content_watch import ContentError, FileWatcher, read_content
+from dedupe import MessageDeduper
+from session_store import SessionStore
+from stats import StatsAggregator, date_range
+from shared_state import SharedContent, SessionLocks
+from dispatcher import LaneDispatcher
+from graph_client import GraphClient
+from outbound import OutboundScheduler, PRIORITY_LIVE
+from campaigns import CampaignRunner, create_campaign
+from maintenance import MaintenanceScheduler, expire_sessions, incremental_vacuum, rollup_leads
+from media_store import MediaPipeline, MediaStore, ci_image_value, media_marker
+from reply_plan import ReplyPlan, text_payload, buttons_payload, list_payload, location_payload
+from intent_matcher import compile_intent_matcher
+from work_queue import WorkQueue
+from structured_log import setup_logging, should_sample, kv
+from metrics import Registry
 
 # ============================================================
 #                 1) INICIALIZACIÓN FASTAPI
@@ -43,6 +63,8 @@ ADDRESS         = os.getenv("ADDRESS", "FINAL Calle Taperas, 2do. Anillo detrás
 GOOGLE_MAPS_LINK= os.getenv("GOOGLE_MAPS_LINK", "https://maps.app.goo.gl/TRStYJHnt6U5urkr6")
 CONTACT_PHONE   = os.getenv("CONTACT_PHONE", "+59178024823")
 CONTACT_EMAIL   = os.getenv("CONTACT_EMAIL", "idiomas.scz@emi.edu.bo")
+ORG_LAT         = float(os.getenv("ORG_LAT", "-17.776126747602"))
+ORG_LNG         = float(os.getenv("ORG_LNG", "-63.167443644971414"))
 
 OPENING_HOURS   = os.getenv("OPENING_HOURS", "Lun–Vie 08:00–17:00")
 COURSES         = [c.strip() for c in os.getenv("COURSES", "Inglés,Chino,Francés,Portugués").split(",")]
@@ -54,105 +76,520 @@ ADMIN_TOKEN     = os.getenv("ADMIN_TOKEN", "super-seguro-123")
 ADMIN_WHATSAPP  = os.getenv("ADMIN_WHATSAPP", "")
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
 
+# Recarga en caliente de content.json (inotify o revisión de mtime cada N s)
+CONTENT_WATCH          = os.getenv("CONTENT_WATCH", "1").lower() in {"1", "true", "yes", "si"}
+CONTENT_WATCH_INTERVAL = float(os.getenv("CONTENT_WATCH_INTERVAL", "2"))
+
+# Intenciones sin tildes y con errores de tipeo ("presio", "ubicasion") antes
+# de caer en la IA; score = 1 - ediciones / largo de la palabra
+INTENT_FUZZY           = os.getenv("INTENT_FUZZY", "1").lower() in {"1", "true", "yes", "si"}
+INTENT_FUZZY_MIN_SCORE = float(os.getenv("INTENT_FUZZY_MIN_SCORE", "0.8"))
+INTENT_FUZZY_MIN_LEN   = int(os.getenv("INTENT_FUZZY_MIN_LEN", "5"))
+INTENT_FUZZY_MAX_EDITS = int(os.getenv("INTENT_FUZZY_MAX_EDITS", "2"))
+
+# Modo "ack-first": el webhook solo encola y responde 200 de inmediato
+WEBHOOK_ACK_FIRST       = os.getenv("WEBHOOK_ACK_FIRST", "0").lower() in {"1", "true", "yes", "si"}
+WEBHOOK_QUEUE_SIZE      = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS         = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "0.5"))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32"))
+WEBHOOK_DRAIN_TIMEOUT   = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+# De-duplicación de reintentos de Meta por msg["id"]
+DEDUPE_TTL_SECONDS = int(os.getenv("DEDUPE_TTL_SECONDS", str(3 * 24 * 3600)))
+DEDUPE_MEMORY_SIZE = int(os.getenv("DEDUPE_MEMORY_SIZE", "50000"))
+
+# Caché de sesiones; FLUSH_INTERVAL > 0 agrupa commits de varios mensajes
+SESSION_CACHE_TTL      = int(os.getenv("SESSION_CACHE_TTL", "1800"))
+SESSION_CACHE_SIZE     = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "0"))
+
+# Leads: un INSERT por lote de LEAD_BATCH_SIZE filas o cada LEAD_FLUSH_MS
+LEAD_BATCH_SIZE = int(os.getenv("LEAD_BATCH_SIZE", "100"))
+LEAD_FLUSH_MS   = int(os.getenv("LEAD_FLUSH_MS", "200"))
+
+# Caché de respuestas IA (AI_CACHE_PERSIST=1 → también en SQLite)
+AI_CACHE_SIZE    = int(os.getenv("AI_CACHE_SIZE", "2000"))
+AI_CACHE_TTL     = int(os.getenv("AI_CACHE_TTL", str(24 * 3600)))
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "0").lower() in {"1", "true", "yes", "si"}
+
+# Gateway de IA: cupos simultáneos, deadline (s), reintentos y circuit breaker
+AI_MODEL             = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+AI_MAX_CONCURRENCY   = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_DEADLINE          = float(os.getenv("AI_DEADLINE", "8"))
+AI_RETRIES           = int(os.getenv("AI_RETRIES", "2"))
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_COOLDOWN  = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+
+# Envíos salientes: mensajes/segundo permitidos por PHONE_NUMBER_ID
+GRAPH_MSGS_PER_SEC     = float(os.getenv("GRAPH_MSGS_PER_SEC", "80"))
+GRAPH_SEND_CONCURRENCY = int(os.getenv("GRAPH_SEND_CONCURRENCY", "16"))
+GRAPH_MAX_RETRIES      = int(os.getenv("GRAPH_MAX_RETRIES", "6"))
+# Webhook síncrono: tope de segundos (intentos + esperas) por respuesta en vivo
+GRAPH_LIVE_RETRY_BUDGET = float(os.getenv("GRAPH_LIVE_RETRY_BUDGET", "5"))
+
+# Campañas masivas: tope propio por debajo de GRAPH_MSGS_PER_SEC
+CAMPAIGN_MSGS_PER_SEC = float(os.getenv("CAMPAIGN_MSGS_PER_SEC", str(GRAPH_MSGS_PER_SEC / 4)))
+CAMPAIGN_WORKERS      = int(os.getenv("CAMPAIGN_WORKERS", "8"))
+
+# Fotos del CI: descarga en segundo plano, archivos por SHA-256 en MEDIA_DIR
+MEDIA_DIR       = os.getenv("MEDIA_DIR", "media")
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(10 * 1024 * 1024)))
+MEDIA_WORKERS   = int(os.getenv("MEDIA_WORKERS", "2"))
+MEDIA_TIMEOUT   = float(os.getenv("MEDIA_TIMEOUT", "60"))
+MEDIA_RETRIES   = int(os.getenv("MEDIA_RETRIES", "3"))
+
+# Mantenimiento de la base (cada MAINTENANCE_INTERVAL s): sesiones inactivas,
+# leads viejos → lead_daily_stats (+ lead_contacts para campañas), filas vencidas
+# y VACUUM incremental
+MAINTENANCE_ENABLED  = os.getenv("MAINTENANCE_ENABLED", "1").lower() in {"1", "true", "yes", "si"}
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+SESSION_IDLE_DAYS    = float(os.getenv("SESSION_IDLE_DAYS", "30"))
+LEAD_RETENTION_DAYS  = int(os.getenv("LEAD_RETENTION_DAYS", "90"))
+VACUUM_MAX_PAGES     = int(os.getenv("VACUUM_MAX_PAGES", "5000"))
+
+# Agregados de /admin/stats: en memoria, a SQLite cada STATS_FLUSH_INTERVAL s
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "10"))
+
+# Varios procesos: contenido y sesiones coordinados en SQLite. Sin MULTI_WORKER
+# se detecta: uvicorn --workers N lanza cada worker como proceso hijo
+# (multiprocessing) y no exporta WEB_CONCURRENCY; gunicorn sí se anuncia
+def _detect_multi_worker() -> bool:
+    if os.getenv("MULTI_WORKER", "").strip():
+        return os.getenv("MULTI_WORKER").lower() in {"1", "true", "yes", "si"}
+    return (os.getenv("WEB_CONCURRENCY", "1").strip() not in {"", "1"}
+            or multiprocessing.parent_process() is not None
+            or "gunicorn" in os.getenv("SERVER_SOFTWARE", ""))
+
+MULTI_WORKER = _detect_multi_worker()
+# La revisión compartida del contenido se compara siempre, a lo sumo cada N s
+CONTENT_SYNC_INTERVAL = float(os.getenv("CONTENT_SYNC_INTERVAL", "1"))
+# El lease se renueva cada lease/3 mientras se procesa el mensaje
+SESSION_LOCK_LEASE = float(os.getenv("SESSION_LOCK_LEASE", "30"))
+
+# Logs JSON en segundo plano; los payloads completos solo se muestrean
+LOG_LEVEL            = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE       = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.01"))
+
+log_handler = setup_logging(LOG_LEVEL, queue_size=LOG_QUEUE_SIZE)
+log = logging.getLogger("app")
+
+# Métricas por etapa, intención y resultado (GET /metrics)
+metrics         = Registry()
+STAGE_SECONDS   = metrics.histogram("bot_stage_seconds", "Latencia por etapa", ("stage",))
+MESSAGE_SECONDS = metrics.histogram("bot_message_seconds", "Latencia total por mensaje", ("intent",))
+MESSAGES        = metrics.counter("bot_messages_total", "Mensajes procesados", ("intent", "outcome"))
+EVENTS          = metrics.counter("bot_events_total",
+                                  "Duplicados, fallback de IA, fallos de envío, intenciones sin tildes/fuzzy",
+                                  ("event",))
+
 if not (WHATSAPP_TOKEN and PHONE_NUMBER_ID and VERIFY_TOKEN):
     raise RuntimeError("❌ ERROR: faltan variables .env necesarias")
 
 # ============================================================
 #                 3) CARGA content.json
 # ============================================================
-CONTENT = {}
+# Reglas automáticas (se evalúan después de las de content.json)
+REGLAS_AUTO = {
+    "horarios": ["horario", "hora", "atención", "atienden"],
+    "cursos": ["curso", "idioma", "clases", "nivel"],
+    "precios": ["precio", "cuesta", "mensualidad", "inscripción"],
+    "inscripciones": ["inscribir", "requisito", "matrícula"],
+    "ubicacion": ["ubicación", "dónde", "direccion", "mapa"],
+    "contacto": ["contacto", "teléfono", "email", "correo"],
+    "pagos": ["pago", "transferencia", "qr", "efectivo", "cuenta"],
+}
+
+# Atajos numéricos del menú
+SHORTCUTS = {"1":"horarios","2":"cursos","3":"precios","4":"inscripciones","5":"ubicacion","6":"contacto","7":"pagos"}
+
+# Textos armados una sola vez por versión de contenido.
+# Los handlers solo hacen lookups sobre SNAPSHOT, que se reemplaza
+# entero (asignación atómica) y nunca se modifica.
+def _render_menu_principal():
+    return (
+        "📌 *MENÚ PRINCIPAL*\n"
+        "1️⃣ Horarios y atención\n"
+        "2️⃣ Cursos y niveles\n"
+        "3️⃣ Precios y promociones\n"
+        "4️⃣ Inscripciones\n"
+        "5️⃣ Ubicación\n"
+        "6️⃣ Contacto\n"
+        "7️⃣ Medios de pago\n"
+        "—\n"
+        f"📚 {', '.join(COURSES)}\n"
+        f"🎯 {', '.join(LEVELS)}"
+    )
+
+def _render_bienvenida(content, menu):
+    promo = content.get("org", {}).get("PROMOTION", "")
+    line_promo = f"\n🎖️ *Promoción:* {promo}" if promo else ""
+
+    return (
+        "👋 *¡Bienvenido/a a la Escuela de Idiomas del Ejército – Filial SCZ!*\n\n"
+        "Para ayudarte más rápido:\n"
+        "• Escribe *3* para ver precios\n"
+        "• Escribe *4* para inscribirte\n"
+        "• O selecciona una opción del menú\n\n"
+        f"📍 Dirección: {ADDRESS}\n"
+        f"🕐 Horarios: {OPENING_HOURS}\n"
+        f"{line_promo}\n"
+        "👇 Menú:\n" + menu
+    )
+
+def _render_intent_answers(content):
+    promo = content.get("org", {}).get("PROMOTION", "")
+    line = f"\n🎖️ *Promoción:* {promo}" if promo else ""
+
+    pasos = content.get("catalog", {}).get("ENROLL_STEPS", [
+        "Enviar foto de CI",
+        "Llenar formulario",
+        "Realizar pago",
+        "Confirmación de aula"
+    ])
+    pasos_txt = "\n".join([f"- {p}" for p in pasos])
+
+    answers = {
+        "horarios": f"🕘 *Horarios:* {OPENING_HOURS}",
+        "cursos": f"📚 *Cursos:* {', '.join(COURSES)}\n🎯 *Niveles:* {', '.join(LEVELS)}",
+        "precios": f"💵 *Precios:* {PRICES}{line}",
+        "inscripciones": f"📝 *Inscripciones:*\n{pasos_txt}\n\n¿Deseas inscribirte ahora mismo? (sí/no)",
+        "ubicacion": f"📍 Dirección: {ADDRESS}\n📌 Mapa: {GOOGLE_MAPS_LINK}",
+        "contacto": f"☎️ Teléfonos: {CONTACT_PHONE}\n✉️ Email: {CONTACT_EMAIL}",
+        "pagos": f"💳 *Medios de pago:* {PAYMENT_METHODS}",
+    }
+
+    # Las FAQ de content.json tienen prioridad
+    for intent, txt in content.get("faq", {}).items():
+        if txt:
+            answers[intent] = txt
+    return answers
+
+def _render_system_prompt():
+    return (
+        f"Eres asistente de *{ORG_NAME}*.\n"
+        f"Dirección: {ADDRESS}\n"
+        f"Mapa: {GOOGLE_MAPS_LINK}\n"
+        f"Horarios: {OPENING_HOURS}\n"
+        f"Cursos: {', '.join(COURSES)}\n"
+        f"Niveles: {', '.join(LEVELS)}\n"
+        f"Precios: {PRICES}\n"
+        f"Medios de pago: {PAYMENT_METHODS}\n"
+        "Responde corto, amable, ≤6 líneas."
+    )
+
+def build_content_snapshot(content: dict) -> ContentSnapshot:
+    # Sin sort_keys: el orden de "rules" define la prioridad de intenciones
+    raw_json = json.dumps(content, ensure_ascii=False)
+    content = json.loads(raw_json)  # copia propia, nadie más la toca
+    menu = _render_menu_principal()
+    system_prompt = _render_system_prompt()
+    return ContentSnapshot(
+        version=content_version(system_prompt, raw_json),
+        content=freeze(content),
+        raw_json=raw_json,
+        matcher=compile_intent_matcher(
+            content.get("rules", {}), REGLAS_AUTO,
+            fuzzy=INTENT_FUZZY,
+            min_score=INTENT_FUZZY_MIN_SCORE,
+            min_len=INTENT_FUZZY_MIN_LEN,
+            max_edits=INTENT_FUZZY_MAX_EDITS,
+        ),
+        menu=menu,
+        welcome=_render_bienvenida(content, menu),
+        intent_answers=_render_intent_answers(content),
+        system_prompt=system_prompt,
+    )
+
+SNAPSHOT = build_content_snapshot({})
+
+# Contenido compartido entre workers: content_state guarda el publicado
+# y una revisión; cada worker sabe qué revisión refleja su SNAPSHOT
+shared_content   = SharedContent()
+CONTENT_REVISION = 0
+CONTENT_SOURCE   = ""   # versión del content.json del que sale el contenido
+CONTENT_ERROR    = None # último error de content.json (sigue publicado el anterior)
 
-def load_content():
-    global CONTENT
+def publish_content(content: dict, share: bool = True) -> ContentSnapshot:
+    """
+    Arma el snapshot completo y recién ahí lo publica.
+    Con share=True también queda en content_state para los otros workers.
+    """
+    global SNAPSHOT, CONTENT_REVISION
+    snap = build_content_snapshot(content)
+    SNAPSHOT = snap
+    if share:
+        try:
+            CONTENT_REVISION = shared_content.publish(snap.raw_json, CONTENT_SOURCE)
+        except Exception as e:
+            log.error("No se pudo compartir el contenido: %s", e)
+    return snap
+
+def sync_content(source: str = None) -> bool:
+    """
+    Adopta lo publicado en content_state (si viene de `source`, cuando se pasa).
+    Devuelve True si el SNAPSHOT local quedó igual al compartido.
+    """
+    global CONTENT_REVISION
+    row = shared_content.read()
+    if row is None:
+        return False
+    revision, raw_json, row_source = row
+    if source is not None and row_source != source:
+        return False
+    if revision != CONTENT_REVISION:
+        publish_content(json.loads(raw_json), share=False)
+        CONTENT_REVISION = revision
+    return True
+
+def load_content(prefer_shared: bool = False) -> bool:
+    """
+    Publica content.json si es válido. Si no lo es, sigue publicada la
+    última versión buena, el error queda en CONTENT_ERROR y devuelve False.
+    Con prefer_shared (al iniciar un worker) se adopta lo ya compartido
+    si salió del mismo archivo: un worker nuevo no pisa un
+    /admin/override hecho en otro.
+    """
+    global CONTENT_SOURCE, CONTENT_ERROR
     try:
-        with open(CONTENT_PATH, "r", encoding="utf-8") as f:
-            CONTENT = json.load(f)
-        print("✅ content.json cargado correctamente")
-    except:
-        print("ℹ️ No existe content.json o está vacío")
-        CONTENT = {}
+        content, raw = read_content(CONTENT_PATH)
+    except ContentError as e:
+        CONTENT_ERROR = {"error": str(e), "at": datetime.utcnow().isoformat(timespec="seconds")}
+        if CONTENT_SOURCE:
+            log.error("content.json inválido, se mantiene la versión anterior: %s", e)
+            return False
+        # Al iniciar no hay versión anterior: la compartida o vacío
+        log.warning("content.json no disponible: %s", e)
+        try:
+            if prefer_shared and sync_content():
+                CONTENT_SOURCE = content_version("")
+                return False
+        except Exception as e:
+            log.warning("No se pudo leer content_state: %s", e)
+        raw, content = "", {}
+    else:
+        CONTENT_ERROR = None
+        log.info("content.json cargado correctamente")
+    CONTENT_SOURCE = content_version(raw)
+
+    if prefer_shared:
+        try:
+            if sync_content(source=CONTENT_SOURCE):
+                return CONTENT_ERROR is None
+        except Exception as e:
+            log.warning("No se pudo leer content_state: %s", e)
+    publish_content(content)
+    return CONTENT_ERROR is None
+
+_content_checked = 0.0
+
+def refresh_content():
+    """
+    Antes de procesar un webhook, comparar la revisión compartida (un
+    SELECT por clave primaria, a lo sumo cada CONTENT_SYNC_INTERVAL s)
+    y adoptar la nueva si cambió. No depende de MULTI_WORKER: si la
+    detección falla, un /admin/override igual llega a todos los workers.
+    """
+    global _content_checked
+    now = time.monotonic()
+    if now - _content_checked < CONTENT_SYNC_INTERVAL:
+        return
+    _content_checked = now
+    try:
+        if shared_content.revision() != CONTENT_REVISION and sync_content():
+            # Corre en el event loop: la tabla ai_answers la limpió quien publicó
+            ai_cache.invalidate(SNAPSHOT.version, memory_only=True)
+            log.info("Contenido actualizado por otro worker", extra=kv(revision=CONTENT_REVISION))
+    except Exception as e:
+        log.warning("No se pudo consultar content_state: %s", e)
 
-load_content()
+load_content(prefer_shared=True)
+
+async def _reload_content_file():
+    # Lectura, validación y compilación en un hilo: el event loop no se frena
+    if await asyncio.to_thread(load_content, MULTI_WORKER):
+        await asyncio.to_thread(ai_cache.invalidate, SNAPSHOT.version)
+        log.info("content.json recargado", extra=kv(version=SNAPSHOT.version, revision=CONTENT_REVISION))
+
+content_watcher = FileWatcher(CONTENT_PATH, _reload_content_file, interval=CONTENT_WATCH_INTERVAL)
+
+@app.on_event("startup")
+async def _start_content_watcher():
+    if CONTENT_WATCH:
+        content_watcher.start()
 
 # ============================================================
 #                      4) BASE DE DATOS
 # ============================================================
-DATABASE_URL = "sqlite:///./db.sqlite3"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
-Base = declarative_base()
-
-class Lead(Base):
-    __tablename__ = "leads"
-    id           = Column(Integer, primary_key=True)
-    wa_from      = Column(String(32))
-    name         = Column(String(128))
-    intent       = Column(String(64))
-    last_message = Column(Text)
-
-class SessionState(Base):
-    __tablename__ = "sessions"
-    wa_from = Column(String(32), primary_key=True)
-    state   = Column(String(64))
-    data    = Column(Text)
-
-class Enrollment(Base):
-    __tablename__ = "enrollments"
-    id            = Column(Integer, primary_key=True)
-    wa_from       = Column(String(32))
-    name          = Column(String(128))
-    ci            = Column(String(32))
-    course        = Column(String(64))
-    level         = Column(String(16))
-    schedule_pref = Column(String(64))
-    ci_image_url  = Column(Text)
-    confirmed     = Column(Boolean, default=False)
-    created_at    = Column(DateTime, server_default=func.now())
-
-Base.metadata.create_all(bind=engine)
+# Sesiones en memoria (write-back): SQLite solo para cargar/persistir
+session_store = SessionStore(ttl=SESSION_CACHE_TTL, max_size=SESSION_CACHE_SIZE)
+
+# Con varios workers, un solo dueño por conversación a la vez
+session_locks = SessionLocks(lease=SESSION_LOCK_LEASE) if MULTI_WORKER else None
 
 # Helpers de sesión
 def _get_session(db, phone):
-    s = db.query(SessionState).get(phone)
-    if not s:
-        s = SessionState(wa_from=phone, state="idle", data="{}")
-        db.add(s); db.commit()
-    try:
-        return s, json.loads(s.data or "{}")
-    except:
-        return s, {}
+    with STAGE_SECONDS.time("session_read"):
+        s = session_store.get(phone, db)
+    return s, s.data
 
 def _save_session(db, phone, state, payload):
-    s = db.query(SessionState).get(phone)
-    if not s:
-        s = SessionState(wa_from=phone)
-        db.add(s)
-    s.state = state
-    s.data  = json.dumps(payload)
-    db.commit()
+    previous = session_store.save(phone, state, payload)
+    if state != previous:
+        stats.step(state)
 
 def _clear_session(db, phone):
     _save_session(db, phone, "idle", {})
 
+def _commit_message(db, phone):
+    """
+    Una sola transacción por mensaje: la sesión modificada
+    más lo que se haya agregado a `db` (los leads van por lead_writer).
+    Con SESSION_FLUSH_INTERVAL > 0 las sesiones van en el lote periódico
+    (salvo con varios workers: la sesión se escribe antes de soltarla).
+    """
+    with STAGE_SECONDS.time("session_write"):
+        if SESSION_FLUSH_INTERVAL > 0 and not MULTI_WORKER:
+            db.commit()
+        else:
+            session_store.flush(db, [phone])
+
+async def _session_flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        try:
+            session_store.flush()
+            session_store.sweep()
+        except Exception as e:
+            log.error("Error guardando sesiones: %s", e)
+
+@app.on_event("startup")
+async def _start_session_flusher():
+    if SESSION_FLUSH_INTERVAL > 0:
+        app.state.session_flusher = asyncio.create_task(_session_flush_loop())
+
+# Contadores por día para /admin/stats (intención, embudo, IA)
+stats = StatsAggregator(flush_interval=STATS_FLUSH_INTERVAL)
+
+@app.on_event("startup")
+async def _start_stats():
+    await stats.start()
+
+# Leads en lote (group commit)
+lead_writer = LeadWriter(batch_size=LEAD_BATCH_SIZE, flush_ms=LEAD_FLUSH_MS)
+
+@app.on_event("startup")
+async def _start_lead_writer():
+    await lead_writer.start()
+
+# Ids de mensajes ya procesados (memoria + tabla processed_messages)
+deduper = MessageDeduper(ttl=DEDUPE_TTL_SECONDS, max_size=DEDUPE_MEMORY_SIZE)
+
+@app.on_event("startup")
+def _prune_processed_messages():
+    deduper.prune()
+
+# Jobs de mantenimiento (idempotentes: da igual si corren en varios workers)
+maintenance = MaintenanceScheduler()
+maintenance.add("sessions", lambda: expire_sessions(SESSION_IDLE_DAYS * 86400), MAINTENANCE_INTERVAL)
+maintenance.add("leads", lambda: rollup_leads(LEAD_RETENTION_DAYS), MAINTENANCE_INTERVAL)
+maintenance.add("prune", lambda: {"processed_messages": deduper.prune(), "ai_answers": ai_cache.prune()},
+                MAINTENANCE_INTERVAL)
+maintenance.add("vacuum", lambda: incremental_vacuum(VACUUM_MAX_PAGES), MAINTENANCE_INTERVAL)
+
+@app.on_event("startup")
+async def _start_maintenance():
+    if MAINTENANCE_ENABLED:
+        maintenance.start()
+
 # ============================================================
 #             5) HELPERS WHATSAPP GRAPH API
 # ============================================================
-def send_whatsapp_text(to, message):
-    url = f"https://graph.facebook.com/v20.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}", "Content-Type":"application/json"}
-    data = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "text",
-        "text": {"body": message}
-    }
+graph = GraphClient(WHATSAPP_TOKEN, PHONE_NUMBER_ID)
+
+# Todos los envíos pasan por el planificador (límite de Meta, reintentos, orden)
+outbound = OutboundScheduler(
+    graph,
+    rate=GRAPH_MSGS_PER_SEC,
+    concurrency=GRAPH_SEND_CONCURRENCY,
+    max_retries=GRAPH_MAX_RETRIES,
+    # En modo ack-first Meta ya tiene su 200: los reintentos pueden seguir
+    live_retry_budget=None if WEBHOOK_ACK_FIRST else GRAPH_LIVE_RETRY_BUDGET or None,
+)
+
+# Campañas: prioridad "masivo" en el planificador, las respuestas en vivo van primero
+campaigns = CampaignRunner(outbound, rate=CAMPAIGN_MSGS_PER_SEC, workers=CAMPAIGN_WORKERS)
+
+# Descargas de fotos: fuera del camino del webhook
+media = MediaPipeline(
+    graph,
+    MediaStore(MEDIA_DIR, max_bytes=MEDIA_MAX_BYTES),
+    workers=MEDIA_WORKERS,
+    max_retries=MEDIA_RETRIES,
+    timeout=MEDIA_TIMEOUT,
+)
+
+@app.on_event("startup")
+async def _resume_campaigns():
+    await campaigns.resume_all()
+
+@app.on_event("startup")
+async def _start_media():
+    await media.start()
+
+async def _send(kind, to, data, priority=PRIORITY_LIVE):
+    """
+    outbound.send medido por tipo de mensaje.
+    """
+    try:
+        with STAGE_SECONDS.time("send_" + kind):
+            result = await outbound.send(to, data, priority)
+    except Exception:
+        EVENTS.inc("send_failure")
+        raise
+    if isinstance(result, dict) and "error" in result:
+        EVENTS.inc("send_failure")
+    return result
+
+async def send_whatsapp_text(to, message, priority=PRIORITY_LIVE):
     try:
-        r = requests.post(url, headers=headers, json=data)
-        if not r.ok:
-            print("⚠️ Error al enviar mensaje:", r.text)
-        return r.json()
+        return await _send("text", to, text_payload(to, message), priority)
     except Exception as e:
-        print("❌ Error enviando mensaje:", e)
+        log.error("Error enviando mensaje: %s", e, extra=kv(to=to))
+
+async def send_reply_plan(to, plan: ReplyPlan, priority=PRIORITY_LIVE):
+    """
+    Encola todas las etapas del plan de una vez: el planificador respeta
+    el orden entre etapas y manda en paralelo las partes de una misma
+    etapa, sin esperar al handler entre mensaje y mensaje.
+    Devuelve un resultado (o la excepción) por parte.
+    """
+    parts, futures = [], []
+    for stage in plan.stages():
+        parts.extend(stage)
+        futures.extend(outbound.submit(to, [p.payload(to) for p in stage], priority))
+
+    with STAGE_SECONDS.time("send_plan"):
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+    for part, r in zip(parts, results):
+        if isinstance(r, Exception):
+            log.error("Error enviando %s: %s", part.kind, r, extra=kv(to=to))
+        if isinstance(r, Exception) or (isinstance(r, dict) and "error" in r):
+            EVENTS.inc("send_failure")
+    return results
+
+async def deliver_reply_plan(to, plan: ReplyPlan, priority=PRIORITY_LIVE):
+    """
+    send_reply_plan que falla si Graph no aceptó ninguna parte
+    (todas excepción o {"error": ...}): el mensaje no quedó respondido.
+    """
+    results = await send_reply_plan(to, plan, priority)
+    if not any(not isinstance(r, Exception) and not (isinstance(r, dict) and "error" in r)
+               for r in results):
+        raise RuntimeError(f"Graph no aceptó ninguna de las {len(results)} partes de la respuesta")
+    return results
 
 # ============================================================
 #                 6) WEBHOOK - VERIFICACIÓN
@@ -176,318 +613,296 @@ async def verify_webhook(request: Request):
 
 
 # ============================================================
-#     FUNCIÓN AUXILIAR – Enviar mensaje por WhatsApp API
+# 6.2) WEBHOOK - RECEPCIÓN DE MENSAJES (POST)
 # ============================================================
 
-def send_whatsapp_message(to: str, message: str):
+async def procesar_webhook(data: dict):
     """
-    Envía un mensaje simple de texto por WhatsApp Cloud API.
+    Reparte todos los mensajes del payload en lanes por remitente.
     """
-    url = f"https://graph.facebook.com/v20.0/{PHONE_NUMBER_ID}/messages"
-
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
+    refresh_content()
+    return await dispatcher.dispatch(data, procesar_mensaje)
 
-    data = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "text",
-        "text": {"body": message}
-    }
 
-    response = requests.post(url, headers=headers, json=data)
-    print("➡️ Respuesta de envío:", response.text)
+# Mensajes de un mismo wa_from en orden; distintos wa_from en paralelo
+dispatcher = LaneDispatcher(max_concurrency=WEBHOOK_MAX_CONCURRENCY)
 
+webhook_queue = WorkQueue(
+    procesar_webhook,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    workers=WEBHOOK_WORKERS,
+    put_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+)
 
-# ============================================================
-#     FUNCIÓN AUXILIAR – Responder según intención detectada
-# ============================================================
+@app.on_event("startup")
+async def _start_webhook_queue():
+    if WEBHOOK_ACK_FIRST:
+        await webhook_queue.start()
 
-def handle_intention(intent: str, text: str, phone: str):
+@app.on_event("shutdown")
+async def _shutdown():
     """
-    Procesa la intención y devuelve una respuesta lista para enviar.
+    Único cierre, en orden de dependencias: primero la entrada (lo ya
+    respondido con 200 se termina de procesar con todo funcionando),
+    después lo que genera envíos, los envíos y al final lo que persiste.
     """
-    intent = intent.lower().strip()
-
-    if intent == "horarios":
-        return f"🕘 Horarios de atención: {OPENING_HOURS}"
-    if intent == "cursos":
-        return f"📚 Idiomas disponibles: {', '.join(COURSES)}"
-    if intent == "precios":
-        return f"💵 Precios: {PRICES}"
-    if intent == "inscripciones":
-        return "📝 Para iniciar tu inscripción, por favor envía tu *CI*."
-    if intent == "ubicacion":
-        return f"📍 Dirección: {ADDRESS}\nMapa: {GOOGLE_MAPS_LINK}"
-    if intent == "contacto":
-        return f"☎️ Teléfonos: {CONTACT_PHONE}\n✉️ Email: {CONTACT_EMAIL}"
-    if intent == "pagos":
-        return f"💳 Métodos de pago: {PAYMENT_METHODS}"
-
-    # Default → usar IA
-    return generate_ai_answer(text)
+    await webhook_queue.stop(drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+    await content_watcher.stop()
+    await maintenance.stop()
+    await campaigns.stop()
+    await media.stop()
+    await outbound.stop()
+    await graph.aclose()
+
+    task = getattr(app.state, "session_flusher", None)
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    session_store.flush()
+    await lead_writer.stop()
+    await stats.stop()
 
 
-# ============================================================
-# 6.2) WEBHOOK - RECEPCIÓN DE MENSAJES (POST)
-# ============================================================
-
 @app.post("/webhook")
 async def receive_webhook(request: Request):
     """
     Recibe mensajes enviados desde la API de WhatsApp.
     Procesa texto, botones, lista y envía respuesta.
+    En modo WEBHOOK_ACK_FIRST solo valida y encola.
     """
-    data = await request.json()
-    print("📥 BODY RECIBIDO:", json.dumps(data, indent=2, ensure_ascii=False))
+    with STAGE_SECONDS.time("parse"):
+        data = await request.json()
+    if should_sample(LOG_BODY_SAMPLE_RATE):
+        log.info("Body recibido", extra=kv(body=data))
 
     # Validar estructura básica
     if "entry" not in data:
         return {"status": "ignored"}
 
-    try:
-        for entry in data["entry"]:
-            for change in entry.get("changes", []):
-                value = change.get("value", {})
-                messages = value.get("messages", [])
-
-                for msg in messages:
-
-                    # Número del usuario
-                    phone = msg["from"]
-
-                    # Texto
-                    text = msg.get("text", {}).get("body", "").strip()
-
-                    print(f"📩 Mensaje de {phone}: {text}")
-
-                    # Detectar intención
-                    intent = detect_intent_rules(text)
-
-                    # Generar respuesta
-                    reply = handle_intention(intent, text, phone)
+    if WEBHOOK_ACK_FIRST:
+        if not await webhook_queue.submit(data):
+            # Cola llena → 503 para que Meta reintente más tarde
+            return JSONResponse({"status": "busy"}, status_code=503)
+        return {"status": "queued"}
 
-                    # Enviar respuesta
-                    send_whatsapp_message(phone, reply)
+    try:
+        results = await procesar_webhook(data)
+        if not results:
+            return {"status": "no_message"}
 
-        return {"status": "processed"}
+        errors = [str(r) for r in results if isinstance(r, Exception)]
+        if errors and len(errors) == len(results):
+            return JSONResponse({"error": errors[0]}, status_code=500)
+        return {"status": "processed", "processed": len(results) - len(errors), "errors": errors}
 
     except Exception as e:
-        print("❌ Error procesando webhook:", e)
-        return {"status": "error", "detail": str(e)}
+        log.exception("Error procesando webhook: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
 
 # ============================================================
 #              7) IA – OpenAI ChatGPT
 # ============================================================
 openai_client = None
+ai_gateway = None
 if OPENAI_API_KEY:
     try:
-        openai_client = OpenAI(api_key=OPENAI_API_KEY)
-        print("✅ OpenAI inicializado")
+        # Los reintentos los maneja el gateway (con jitter y deadline)
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        ai_gateway = AIGateway(
+            openai_client,
+            model=AI_MODEL,
+            max_concurrency=AI_MAX_CONCURRENCY,
+            deadline=AI_DEADLINE,
+            retries=AI_RETRIES,
+            breaker=CircuitBreaker(threshold=AI_BREAKER_THRESHOLD, cooldown=AI_BREAKER_COOLDOWN),
+        )
+        log.info("OpenAI inicializado")
     except Exception as e:
-        print("⚠️ No se pudo iniciar OpenAI:", e)
+        log.warning("No se pudo iniciar OpenAI: %s", e)
+
+ai_cache = AnswerCache(max_size=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, persist=AI_CACHE_PERSIST)
+
+ai_flights = SingleFlight()
 
-def generate_ai_answer(user_text: str) -> str:
+async def _ask_ai(user_text: str, version: str, system_prompt: str) -> str:
+    answer = await ai_gateway.complete(system_prompt, user_text)
+    await ai_cache.set(user_text, version, answer)
+    return answer
+
+async def generate_ai_answer(user_text: str) -> str:
     """
     Si la IA está configurada, responde con GPT.
-    Caso contrario, devuelve menú principal.
+    Caso contrario (o si la IA falla / el circuito está abierto),
+    devuelve menú principal.
     """
-    if not openai_client:
+    if not ai_gateway:
+        EVENTS.inc("ai_fallback")
+        stats.ai("fallback")
         return menu_principal()
 
+    # Pregunta repetida con el mismo contenido → sin llamar a OpenAI
+    snap = SNAPSHOT
+    version, system_prompt = snap.version, snap.system_prompt
+    cached = await ai_cache.get(user_text, version)
+    if cached is not None:
+        EVENTS.inc("ai_cache_hit")
+        stats.ai("cache_hit")
+        return cached
+
+    # Misma pregunta ya en vuelo → esperar esa misma respuesta
     try:
-        system_prompt = (
-            f"Eres asistente de *{ORG_NAME}*.\n"
-            f"Dirección: {ADDRESS}\n"
-            f"Mapa: {GOOGLE_MAPS_LINK}\n"
-            f"Horarios: {OPENING_HOURS}\n"
-            f"Cursos: {', '.join(COURSES)}\n"
-            f"Niveles: {', '.join(LEVELS)}\n"
-            f"Precios: {PRICES}\n"
-            f"Medios de pago: {PAYMENT_METHODS}\n"
-            "Responde corto, amable, ≤6 líneas."
-        )
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            temperature=0.3,
-            messages=[
-                {"role":"system","content":system_prompt},
-                {"role":"user","content":user_text}
-            ]
-        )
-        return response.choices[0].message.content.strip()
+        with STAGE_SECONDS.time("ai"):
+            answer = await ai_flights.do(
+                ai_cache.key(user_text, version),
+                lambda: _ask_ai(user_text, version, system_prompt),
+            )
+        stats.ai("answered")
+        return answer
+
+    except CircuitOpen:
+        EVENTS.inc("ai_fallback")
+        stats.ai("fallback")
+        return menu_principal()
 
     except Exception as e:
-        print("❌ Error IA:", e)
+        EVENTS.inc("ai_fallback")
+        stats.ai("fallback")
+        log.error("Error IA: %r", e)
         return menu_principal()
 
 # ============================================================
 #                 8) INTENCIONES + MENÚS
 # ============================================================
 def menu_principal():
-    return (
-        "📌 *MENÚ PRINCIPAL*\n"
-        "1️⃣ Horarios y atención\n"
-        "2️⃣ Cursos y niveles\n"
-        "3️⃣ Precios y promociones\n"
-        "4️⃣ Inscripciones\n"
-        "5️⃣ Ubicación\n"
-        "6️⃣ Contacto\n"
-        "7️⃣ Medios de pago\n"
-        "—\n"
-        f"📚 {', '.join(COURSES)}\n"
-        f"🎯 {', '.join(LEVELS)}"
-    )
+    return SNAPSHOT.menu
 
 def mensaje_bienvenida():
-    promo = CONTENT.get("org", {}).get("PROMOTION", "")
-    line_promo = f"\n🎖️ *Promoción:* {promo}" if promo else ""
-
-    return (
-        "👋 *¡Bienvenido/a a la Escuela de Idiomas del Ejército – Filial SCZ!*\n\n"
-        "Para ayudarte más rápido:\n"
-        "• Escribe *3* para ver precios\n"
-        "• Escribe *4* para inscribirte\n"
-        "• O selecciona una opción del menú\n\n"
-        f"📍 Dirección: {ADDRESS}\n"
-        f"🕐 Horarios: {OPENING_HOURS}\n"
-        f"{line_promo}\n"
-        "👇 Menú:\n" + menu_principal()
-    )
+    return SNAPSHOT.welcome
 
 def detect_intent_rules(text: str) -> str:
+    with STAGE_SECONDS.time("intent"):
+        return _detect_intent(text)
+
+def _detect_intent(text: str) -> str:
     if not text:
         return "general"
 
     t = text.lower()
 
-    # Reglas personalizables desde content.json
-    rules = CONTENT.get("rules", {})
-    for intent, palabras in rules.items():
-        if any(p in t for p in palabras):
-            return intent
-
-    # Reglas automáticas
-    reglas_auto = {
-        "horarios": ["horario", "hora", "atención", "atienden"],
-        "cursos": ["curso", "idioma", "clases", "nivel"],
-        "precios": ["precio", "cuesta", "mensualidad", "inscripción"],
-        "inscripciones": ["inscribir", "requisito", "matrícula"],
-        "ubicacion": ["ubicación", "dónde", "direccion", "mapa"],
-        "contacto": ["contacto", "teléfono", "email", "correo"],
-        "pagos": ["pago", "transferencia", "qr", "efectivo", "cuenta"],
-    }
-
-    for intent, palabras in reglas_auto.items():
-        if any(p in t for p in palabras):
-            return intent
+    # Reglas de content.json + automáticas: exactas, sin tildes y fuzzy
+    intent, stage, _ = SNAPSHOT.matcher.classify(t)
+    if intent:
+        if stage != "exact":
+            EVENTS.inc("intent_" + stage)
+        return intent
 
     # Atajos
-    shortcuts = {"1":"horarios","2":"cursos","3":"precios","4":"inscripciones","5":"ubicacion","6":"contacto","7":"pagos"}
-    return shortcuts.get(t, "general")
+    return SHORTCUTS.get(t, "general")
 
 # ============================================================
 #                9) RESPUESTAS POR INTENCIÓN
 # ============================================================
 def answer_for_intent(intent: str, payload: dict):
-    intent = (intent or "").lower()
-
-    custom_faq = CONTENT.get("faq", {})
-    if custom_faq.get(intent):
-        return custom_faq[intent]
-
-    if intent == "horarios":
-        return f"🕘 *Horarios:* {OPENING_HOURS}"
-
-    if intent == "cursos":
-        return f"📚 *Cursos:* {', '.join(COURSES)}\n🎯 *Niveles:* {', '.join(LEVELS)}"
-
-    if intent == "precios":
-        promo = CONTENT.get("org", {}).get("PROMOTION", "")
-        line = f"\n🎖️ *Promoción:* {promo}" if promo else ""
-        return f"💵 *Precios:* {PRICES}{line}"
-
-    if intent == "inscripciones":
-        pasos = CONTENT.get("catalog", {}).get("ENROLL_STEPS", [
-            "Enviar foto de CI",
-            "Llenar formulario",
-            "Realizar pago",
-            "Confirmación de aula"
-        ])
-        pasos_txt = "\n".join([f"- {p}" for p in pasos])
-        return f"📝 *Inscripciones:*\n{pasos_txt}\n\n¿Deseas inscribirte ahora mismo? (sí/no)"
+    snap = SNAPSHOT
+    return snap.intent_answers.get((intent or "").lower(), snap.menu)
 
+def plan_for_intent(intent: str, payload: dict) -> ReplyPlan:
+    plan = ReplyPlan().text(answer_for_intent(intent, payload))
     if intent == "ubicacion":
-        return f"📍 Dirección: {ADDRESS}\n📌 Mapa: {GOOGLE_MAPS_LINK}"
-
-    if intent == "contacto":
-        return f"☎️ Teléfonos: {CONTACT_PHONE}\n✉️ Email: {CONTACT_EMAIL}"
-
-    if intent == "pagos":
-        return f"💳 *Medios de pago:* {PAYMENT_METHODS}"
-
-    return menu_principal()
+        # El pin acompaña a la dirección: su orden relativo no importa
+        plan.location(ORG_LAT, ORG_LNG, ORG_NAME, ADDRESS, with_previous=True)
+    return plan
 
 # ============================================================
 #           10) WEBHOOK — RECEPCIÓN DE MENSAJES
 # ============================================================
-@app.post("/webhook")
-async def webhook_receiver(request: Request):
+def _contact_name(value: dict, wa_from: str) -> str:
+    contacts = value.get("contacts", []) or [{}]
+    contact = next((c for c in contacts if c.get("wa_id") == wa_from), contacts[0])
+    return contact.get("profile", {}).get("name", "")
+
+
+async def procesar_mensaje(value: dict, msg: dict):
     """
-    Procesa mensajes entrantes de WhatsApp Cloud API
+    Procesa un mensaje entrante: sesión, saludo, intención, respuesta y lead.
     """
-    body = await request.json()
-
-    try:
-        print("\n=== WEBHOOK ===")
-        print(json.dumps(body, indent=2, ensure_ascii=False))
-    except:
-        pass
+    if not await deduper.claim(msg.get("id")):
+        EVENTS.inc("duplicate")
+        return {"status":"duplicate"}
+
+    start   = time.perf_counter()
+    intent  = "saludo"
+    outcome = "error"
+    replied = False
+    from_wa = msg.get("from")
+    name    = _contact_name(value, from_wa)
+    mtype   = msg.get("type")
+
+    # --------------------------
+    # EXTRAER TEXTO / BOTONES
+    # --------------------------
+    text = ""
+    if mtype == "text":
+        text = msg["text"]["body"].strip()
+    elif mtype == "interactive":
+        inter = msg.get("interactive", {})
+        if "button_reply" in inter:
+            text = inter["button_reply"]["title"]
+        elif "list_reply" in inter:
+            text = inter["list_reply"]["title"]
+
+    tnorm = text.lower().strip() if text else ""
+
+    # --------------------------
+    # SESIÓN
+    # --------------------------
+    # Otro worker puede estar atendiendo esta conversación: esperar el turno
+    renewer = None
+    if session_locks:
+        if await session_locks.acquire(from_wa):
+            session_store.forget(from_wa)
+        # IA + reintentos de envío pueden pasar el lease: se renueva mientras dure
+        renewer = asyncio.create_task(session_locks.keep_alive(from_wa))
 
+    db = SessionLocal()
     try:
-        entry   = body.get("entry", [])[0]
-        changes = entry.get("changes", [])[0]
-        value   = changes.get("value", {})
-        messages = value.get("messages", [])
-        if not messages:
-            return {"status":"no_message"}
-
-        msg     = messages[0]
-        from_wa = msg.get("from")
-        name    = value.get("contacts", [{}])[0].get("profile", {}).get("name", "")
-        mtype   = msg.get("type")
-
-        # --------------------------
-        # EXTRAER TEXTO / BOTONES
-        # --------------------------
-        text = ""
-        if mtype == "text":
-            text = msg["text"]["body"].strip()
-        elif mtype == "interactive":
-            inter = msg.get("interactive", {})
-            if "button_reply" in inter:
-                text = inter["button_reply"]["title"]
-            elif "list_reply" in inter:
-                text = inter["list_reply"]["title"]
-
-        tnorm = text.lower().strip() if text else ""
-
-        # --------------------------
-        # SESIÓN
-        # --------------------------
-        db = SessionLocal()
         sess, payload = _get_session(db, from_wa)
         payload["last_text"] = text
         _save_session(db, from_wa, sess.state, payload)
 
+        # --------------------------
+        # FLUJO DE INSCRIPCIÓN
+        # --------------------------
+        if sess.state.startswith("insc_"):
+            intent = "inscripciones"
+            if tnorm in ESCAPE_WORDS:
+                _clear_session(db, from_wa)
+                await deliver_reply_plan(from_wa, ReplyPlan().text(menu_principal()))
+                replied = True
+                outcome = "ok"
+                return {"status":"ok","flow":"insc_cancelado"}
+            # Cada paso ya guardó la sesión: aunque su envío falle, el paso
+            # avanzó y reprocesar el reintento de Meta lo repetiría
+            if await continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, payload):
+                replied = True
+                outcome = "ok"
+                return {"status":"ok","flow":sess.state}
+
+        # "¿Deseas inscribirte ahora mismo? (sí/no)" → sí
+        if tnorm in AFFIRM and payload.get("last_intent") == "inscripciones":
+            intent = "inscripciones"
+            await iniciar_inscripcion(db, from_wa, payload)
+            replied = True
+            outcome = "ok"
+            return {"status":"ok","flow":"insc_pide_ci"}
+
         # --------------------------
         # SALUDO
         # --------------------------
         if tnorm in {"hola","buenas","buenos días","buenas tardes","buenas noches"}:
-            send_whatsapp_text(from_wa, mensaje_bienvenida())
-            db.close()
+            await deliver_reply_plan(from_wa, ReplyPlan().text(mensaje_bienvenida()))
+            replied = True
+            outcome = "ok"
             return {"status":"ok","flow":"saludo"}
 
         # --------------------------
@@ -501,34 +916,38 @@ async def webhook_receiver(request: Request):
         # RESPUESTA CON REGLAS
         # --------------------------
         if intent != "general":
-            response = answer_for_intent(intent, payload)
-            send_whatsapp_text(from_wa, response)
-            
-            # Ubicación con pin
-            if intent == "ubicacion":
-                try:
-                    send_whatsapp_location(from_wa, -17.776126747602, -63.167443644971414, ORG_NAME, ADDRESS)
-                except:
-                    pass
-
+            plan = plan_for_intent(intent, payload)
         else:
             # IA SOLO SI ES GENERAL
-            response = generate_ai_answer(text)
-            send_whatsapp_text(from_wa, response)
+            plan = ReplyPlan().text(await generate_ai_answer(text))
+        await deliver_reply_plan(from_wa, plan)
+        replied = True
 
         # --------------------------
         # REGISTRAR LEAD
         # --------------------------
-        lead = Lead(wa_from=from_wa, name=name, intent=intent, last_message=text)
-        db.add(lead); db.commit()
+        lead_writer.add(from_wa, name, intent, text)
 
-        db.close()
+        outcome = "ok"
         return {"status":"ok"}
+    except Exception:
+        # Falló antes de responder: que el reintento de Meta se procese
+        if not replied:
+            await deduper.release(msg.get("id"))
+        raise
+    finally:
+        try:
+            _commit_message(db, from_wa)
+        finally:
+            db.close()
+            if renewer:
+                renewer.cancel()
+                await session_locks.release(from_wa)
+            MESSAGES.inc(intent, outcome)
+            stats.intent(intent)
+            MESSAGE_SECONDS.observe(time.perf_counter() - start, intent)
+
 
-    except Exception as e:
-        print("❌ ERROR EN WEBHOOK:", e)
-        print(traceback.format_exc())
-        return JSONResponse({"error": str(e)}, status_code=500)
 # ============================================================
 #                11) VALIDACIONES Y UTILIDADES
 # ============================================================
@@ -609,23 +1028,23 @@ def is_greeting(text: str) -> bool:
 def start_reserva_test():
     return {"msg":"Este endpoint solo es para pruebas manuales."}
 
-def start_reserva(db, phone, payload):
+async def start_reserva(db, phone, payload):
     _save_session(db, phone, "reserva_pide_nombre", payload)
-    send_whatsapp_text(phone, "Perfecto. ¿Cuál es tu *nombre completo*?")
+    await send_whatsapp_text(phone, "Perfecto. ¿Cuál es tu *nombre completo*?")
     return
 
 # ============================================================
 #                13) FLUJO DE INSCRIPCIONES
 # ============================================================
 
-def iniciar_inscripcion(db, phone, payload):
-    payload["insc"] = {}
+async def iniciar_inscripcion(db, phone, payload):
+    payload["insc"] = {"started_at": time.time()}
     _save_session(db, phone, "insc_pide_ci", payload)
-    send_whatsapp_text(phone, "Perfecto. Para iniciar tu inscripción, envíame tu *CI* o foto del documento.")
+    await send_whatsapp_text(phone, "Perfecto. Para iniciar tu inscripción, envíame tu *CI* o foto del documento.")
     return
 
 
-def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, payload):
+async def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, payload):
     """
     Se llama desde webhook principal.
     Maneja cada estado paso a paso.
@@ -638,16 +1057,22 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
 
         # Caso: envió foto del CI
         if mtype == "image":
-            payload["insc"]["ci_image_url"] = "(foto recibida)"
+            image = msg.get("image", {})
+            if image.get("id"):
+                # Se descarga en segundo plano; hasta entonces queda el marcador
+                await media.submit(image["id"], from_wa, image.get("mime_type"))
+                payload["insc"]["ci_image_url"] = media_marker(image["id"])
+            else:
+                payload["insc"]["ci_image_url"] = "(foto recibida)"
             _save_session(db, from_wa, "insc_pide_nombre", payload)
-            send_whatsapp_text(from_wa, "Recibido 👍 Ahora envíame tu *nombre completo*.")
+            await send_whatsapp_text(from_wa, "Recibido 👍 Ahora envíame tu *nombre completo*.")
             return True
 
         # Caso: CI escrito válido
         if is_valid_ci(text):
             payload["insc"]["ci"] = text.strip()
             _save_session(db, from_wa, "insc_pide_nombre", payload)
-            send_whatsapp_text(from_wa, "Gracias. Ahora envíame tu *nombre completo*.")
+            await send_whatsapp_text(from_wa, "Gracias. Ahora envíame tu *nombre completo*.")
             return True
 
         # Si no es CI → interpretar como nueva intención
@@ -657,14 +1082,16 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
         _save_session(db, from_wa, "idle", payload)
 
         if new_int == "inscripciones":
-            iniciar_inscripcion(db, from_wa, payload)
+            await iniciar_inscripcion(db, from_wa, payload)
             return True
 
-        resp = answer_for_intent(new_int, payload) if new_int != "general" else generate_ai_answer(text)
-        send_whatsapp_text(from_wa, resp)
+        if new_int != "general":
+            plan = plan_for_intent(new_int, payload)
+        else:
+            plan = ReplyPlan().text(await generate_ai_answer(text))
+        await send_reply_plan(from_wa, plan)
 
-        lead = Lead(wa_from=from_wa, name=name, intent=new_int, last_message=text)
-        db.add(lead); db.commit()
+        lead_writer.add(from_wa, name, new_int, text)
         return True
 
     # -----------------------------
@@ -672,11 +1099,11 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
     # -----------------------------
     if sess.state == "insc_pide_nombre":
         if not is_valid_name(text):
-            send_whatsapp_text(from_wa, "Por favor, envíame tu *nombre y apellido* (solo letras).")
+            await send_whatsapp_text(from_wa, "Por favor, envíame tu *nombre y apellido* (solo letras).")
             return True
         payload["insc"]["name"] = text.strip()
         _save_session(db, from_wa, "insc_pide_curso", payload)
-        send_whatsapp_list(from_wa, "Elige el *idioma* que quieres estudiar:", "Idiomas", [(c, c) for c in COURSES])
+        await send_whatsapp_list(from_wa, "Elige el *idioma* que quieres estudiar:", "Idiomas", [(c, c) for c in COURSES])
         return True
 
     # -----------------------------
@@ -688,12 +1115,12 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
             chosen = msg["interactive"]["list_reply"]["title"]
 
         if not chosen or chosen not in COURSES:
-            send_whatsapp_list(from_wa, "Selecciona un *idioma* válido:", "Idiomas", [(c, c) for c in COURSES])
+            await send_whatsapp_list(from_wa, "Selecciona un *idioma* válido:", "Idiomas", [(c, c) for c in COURSES])
             return True
 
         payload["insc"]["course"] = chosen
         _save_session(db, from_wa, "insc_pide_nivel", payload)
-        send_whatsapp_list(from_wa, "Selecciona tu *nivel*:", "Niveles", [(l, l) for l in LEVELS])
+        await send_whatsapp_list(from_wa, "Selecciona tu *nivel*:", "Niveles", [(l, l) for l in LEVELS])
         return True
 
     # -----------------------------
@@ -705,12 +1132,12 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
             chosen = msg["interactive"]["list_reply"]["title"]
 
         if not chosen or chosen not in LEVELS:
-            send_whatsapp_list(from_wa, "Selecciona un *nivel* válido:", "Niveles", [(l, l) for l in LEVELS])
+            await send_whatsapp_list(from_wa, "Selecciona un *nivel* válido:", "Niveles", [(l, l) for l in LEVELS])
             return True
 
         payload["insc"]["level"] = chosen
         _save_session(db, from_wa, "insc_pide_hora", payload)
-        send_whatsapp_text(from_wa, "¿Qué *horario* prefieres? (Ej: Mañanas / Tardes / Noches)")
+        await send_whatsapp_text(from_wa, "¿Qué *horario* prefieres? (Ej: Mañanas / Tardes / Noches)")
         return True
 
     # -----------------------------
@@ -730,7 +1157,7 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
             f"- Horario: {ins['schedule_pref']}\n\n"
             "¿Confirmas? (sí/no)"
         )
-        send_whatsapp_text(from_wa, resumen)
+        await send_whatsapp_text(from_wa, resumen)
         return True
 
     # -----------------------------
@@ -747,20 +1174,22 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
                 course=ins["course"],
                 level=ins["level"],
                 schedule_pref=ins.get("schedule_pref", ""),
-                ci_image_url=ins.get("ci_image_url")
+                ci_image_url=ci_image_value(ins.get("ci_image_url"))
             )
             db.add(new_reg); db.commit()
+            started = ins.get("started_at")
+            stats.confirmed(time.time() - started if started else None)
 
-            send_whatsapp_text(from_wa, "🎉 ¡Inscripción registrada! Te contactaremos para confirmar aula y fecha.")
+            await send_whatsapp_text(from_wa, "🎉 ¡Inscripción registrada! Te contactaremos para confirmar aula y fecha.")
             _clear_session(db, from_wa)
             return True
 
         if text.lower() in NEGATE:
-            send_whatsapp_text(from_wa, "Inscripción cancelada. Puedes iniciar nuevamente escribiendo *inscripción*.")
+            await send_whatsapp_text(from_wa, "Inscripción cancelada. Puedes iniciar nuevamente escribiendo *inscripción*.")
             _clear_session(db, from_wa)
             return True
 
-        send_whatsapp_text(from_wa, "Por favor, responde *sí* o *no*.")
+        await send_whatsapp_text(from_wa, "Por favor, responde *sí* o *no*.")
         return True
 
     return False  # No pertenece al flujo
@@ -768,125 +1197,122 @@ def continuar_flujo_inscripciones(msg, text, mtype, from_wa, name, db, sess, pay
 #        14) MENSAJES INTERACTIVOS (BOTONES y LISTAS)
 # ============================================================
 
-def send_whatsapp_buttons(to, body, buttons):
+async def send_whatsapp_buttons(to, body, buttons):
     """
     buttons = [("ID1","Texto1"), ("ID2","Texto2")]
     """
-    url = f"https://graph.facebook.com/v20.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}",
-               "Content-Type": "application/json"}
-
-    btn_list = []
-    for bid, text in buttons:
-        btn_list.append({
-            "type": "reply",
-            "reply": {"id": bid, "title": text}
-        })
-
-    data = {
-        "messaging_product":"whatsapp",
-        "to": to,
-        "type":"interactive",
-        "interactive":{
-            "type":"button",
-            "body":{"text": body},
-            "action":{"buttons": btn_list}
-        }
-    }
-    return requests.post(url, headers=headers, json=data).json()
+    return await _send("buttons", to, buttons_payload(to, body, buttons))
 
 
-def send_whatsapp_list(to, body, title, rows):
+async def send_whatsapp_list(to, body, title, rows):
     """
     rows = [(id, title), (id, title)]
     """
-    url = f"https://graph.facebook.com/v20.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}",
-               "Content-Type": "application/json"}
-
-    list_rows = []
-    for rid, text in rows:
-        list_rows.append({"id": rid, "title": text})
-
-    data = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "interactive",
-        "interactive": {
-            "type": "list",
-            "body": {"text": body},
-            "action": {
-                "button": title,
-                "sections": [
-                    {"title": title, "rows": list_rows}
-                ]
-            }
-        }
-    }
-    return requests.post(url, headers=headers, json=data).json()
-
-
-def send_whatsapp_location(to, lat, lng, name, address):
-    url = f"https://graph.facebook.com/v20.0/{PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}",
-               "Content-Type":"application/json"}
-
-    data = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "location",
-        "location": {
-            "latitude": float(lat),
-            "longitude": float(lng),
-            "name": name,
-            "address": address
-        }
-    }
+    return await _send("list", to, list_payload(to, body, title, rows))
+
 
-    return requests.post(url, headers=headers, json=data).json()
+async def send_whatsapp_location(to, lat, lng, name, address):
+    return await _send("location", to, location_payload(to, lat, lng, name, address))
 
 # ============================================================
 #             15) EXPORTAR CSV (LEADS / INSCRIPCIONES)
 # ============================================================
 
-@app.get("/export/leads.csv")
-def export_leads():
+EXPORT_PAGE_SIZE = 1000
+
+def _keyset_pages(model, filters=(), before_id=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Recorre la tabla por id descendente en páginas de page_size filas.
+    Cada página es "WHERE id < último_id" sobre el índice (sin OFFSET).
+    """
+    last_id = before_id
+    while True:
+        db = SessionLocal()
+        try:
+            q = db.query(model).filter(*filters)
+            if last_id is not None:
+                q = q.filter(model.id < last_id)
+            rows = q.order_by(model.id.desc()).limit(page_size).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+
+EXPORT_CHUNK_ROWS = 500
+
+def _csv_stream(query, header):
+    """
+    Generador: CSV en bloques de EXPORT_CHUNK_ROWS filas, leyendo con
+    cursor (yield_per) — memoria constante sin importar el tamaño.
+    """
+    buf = StringIO()
+    w = csv.writer(buf)
+    w.writerow(header)
     db = SessionLocal()
-    rows = db.query(Lead).order_by(Lead.id.desc()).all()
-    db.close()
-
-    f = StringIO()
-    w = csv.writer(f)
-    w.writerow(["id","phone","name","intent","last_message"])
-    for r in rows:
-        w.writerow([r.id, r.wa_from, r.name, r.intent, r.last_message])
-    f.seek(0)
-
-    return StreamingResponse(
-        f, media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=leads.csv"}
+    try:
+        for i, row in enumerate(query.with_session(db).yield_per(EXPORT_CHUNK_ROWS), 1):
+            w.writerow(row)
+            if i % EXPORT_CHUNK_ROWS == 0:
+                yield buf.getvalue()
+                buf.seek(0); buf.truncate(0)
+        yield buf.getvalue()
+    finally:
+        db.close()
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → formato gzip
+    for chunk in chunks:
+        data = z.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield z.flush()
+
+def _csv_response(request: Request, chunks, filename: str):
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", "").lower():
+        headers["Content-Encoding"] = "gzip"
+        chunks = _gzip_stream(chunks)
+    return StreamingResponse(chunks, media_type="text/csv", headers=headers)
+
+
+@app.get("/export/leads.csv")
+def export_leads(request: Request, since_id: int = None, since: datetime = None):
+    """
+    since_id / since: solo filas nuevas (sincronización incremental).
+    """
+    q = Query([Lead.id, Lead.wa_from, Lead.name, Lead.intent, Lead.last_message])
+    if since_id is not None:
+        q = q.filter(Lead.id > since_id)
+    if since is not None:
+        q = q.filter(Lead.created_at >= since)
+    q = q.order_by(Lead.id.desc())
+
+    return _csv_response(
+        request, _csv_stream(q, ["id","phone","name","intent","last_message"]), "leads.csv"
     )
 
 
 @app.get("/export/enrollments.csv")
-def export_enrollments():
-    db = SessionLocal()
-    rows = db.query(Enrollment).order_by(Enrollment.id.desc()).all()
-    db.close()
-
-    f = StringIO()
-    w = csv.writer(f)
-    w.writerow(["id","wa_from","name","ci","course","level","schedule_pref","created_at"])
-    for r in rows:
-        w.writerow([
-            r.id, r.wa_from, r.name, r.ci, r.course,
-            r.level, r.schedule_pref, r.created_at
-        ])
-    f.seek(0)
-
-    return StreamingResponse(
-        f, media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=enrollments.csv"}
+def export_enrollments(request: Request, since_id: int = None, since: datetime = None):
+    q = Query([
+        Enrollment.id, Enrollment.wa_from, Enrollment.name, Enrollment.ci, Enrollment.course,
+        Enrollment.level, Enrollment.schedule_pref, Enrollment.created_at
+    ])
+    if since_id is not None:
+        q = q.filter(Enrollment.id > since_id)
+    if since is not None:
+        q = q.filter(Enrollment.created_at >= since)
+    q = q.order_by(Enrollment.id.desc())
+
+    return _csv_response(
+        request,
+        _csv_stream(q, ["id","wa_from","name","ci","course","level","schedule_pref","created_at"]),
+        "enrollments.csv"
     )
 
 # ============================================================
@@ -897,10 +1323,31 @@ def export_enrollments():
 def admin_reload(x_admin_token: str = Header(default="")):
     if x_admin_token != ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="No autorizado")
-    load_content()
+    if not load_content():
+        return JSONResponse(
+            {"ok":False, "msg":"content.json inválido, se mantiene el anterior", "error":CONTENT_ERROR["error"]},
+            status_code=422,
+        )
+    ai_cache.invalidate(SNAPSHOT.version)
     return {"ok":True,"msg":"Contenido recargado"}
 
 
+@app.get("/admin/content")
+def admin_content(x_admin_token: str = Header(default="")):
+    """
+    Versión publicada, revisión compartida y último error de content.json.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    return {
+        "version": SNAPSHOT.version,
+        "revision": CONTENT_REVISION,
+        "error": CONTENT_ERROR,
+        "watcher": {"enabled": CONTENT_WATCH, "mode": content_watcher.mode, "changes": content_watcher.changes},
+    }
+
+
 @app.post("/admin/override")
 async def admin_override(req: Request, x_admin_token: str = Header(default="")):
     if x_admin_token != ADMIN_TOKEN:
@@ -908,13 +1355,249 @@ async def admin_override(req: Request, x_admin_token: str = Header(default="")):
 
     data = await req.json()
 
+    # Copia del contenido actual → cambios → snapshot nuevo (nunca in-place)
+    content = json.loads(SNAPSHOT.raw_json)
     if data.get("faq"):
-        CONTENT.setdefault("faq", {}).update(data["faq"])
+        content.setdefault("faq", {}).update(data["faq"])
     if data.get("rules"):
-        CONTENT.setdefault("rules", {}).update(data["rules"])
+        content.setdefault("rules", {}).update(data["rules"])
+
+    snap = publish_content(content)
+    await asyncio.to_thread(ai_cache.invalidate, snap.version)
 
     return {"ok":True, "msg":"Datos modificados"}
 
+
+@app.get("/admin/ai")
+def admin_ai(x_admin_token: str = Header(default="")):
+    """
+    Estado de la IA: caché, llamadas coalescidas y circuit breaker.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    return {
+        "enabled": ai_gateway is not None,
+        "prompt_version": SNAPSHOT.version,
+        "cache": {"size": len(ai_cache), "hits": ai_cache.hits, "misses": ai_cache.misses},
+        "single_flight": {
+            "in_flight": ai_flights.in_flight,
+            "completions": ai_flights.leaders,
+            "coalesced": ai_flights.coalesced,
+        },
+        "breaker": {
+            "state": ai_gateway.breaker.state,
+            "failures": ai_gateway.breaker.failures,
+            "short_circuited": ai_gateway.breaker.short_circuited,
+        } if ai_gateway else None,
+    }
+
+
+# Gauges: se leen recién al exportar
+metrics.gauge("bot_webhook_queue_depth", "Payloads esperando en la cola del webhook", lambda: webhook_queue.depth)
+metrics.gauge("bot_dispatcher_in_flight", "Mensajes procesándose", lambda: dispatcher.in_flight)
+metrics.gauge("bot_dispatcher_active_lanes", "Remitentes con mensajes en curso", lambda: dispatcher.active_lanes)
+metrics.gauge("bot_outbound_pending", "Envíos encolados", lambda: outbound.pending)
+metrics.gauge("bot_outbound_in_flight", "Envíos en curso", lambda: outbound.in_flight)
+metrics.gauge("bot_ai_in_flight", "Llamadas a OpenAI en curso", lambda: ai_gateway.in_flight if ai_gateway else 0)
+metrics.gauge("bot_lead_writer_pending", "Leads sin escribir", lambda: lead_writer.pending)
+metrics.gauge("bot_stats_pending", "Contadores de /admin/stats sin bajar a SQLite", lambda: stats.pending)
+metrics.gauge("bot_media_pending", "Fotos en cola o descargándose", lambda: media.pending)
+metrics.gauge("bot_media_failed", "Fotos que no se pudieron descargar", lambda: media.failed)
+metrics.gauge("bot_sessions_cached", "Sesiones en memoria", lambda: len(session_store))
+metrics.gauge("bot_content_revision", "Revisión de content_state publicada en este worker", lambda: CONTENT_REVISION)
+metrics.gauge("bot_session_lock_waits", "Esperas por una conversación tomada por otro worker",
+              lambda: session_locks.contended if session_locks else 0)
+metrics.gauge("bot_content_error", "1 si el último content.json era inválido", lambda: int(CONTENT_ERROR is not None))
+metrics.gauge("bot_log_dropped", "Logs descartados por cola llena", lambda: log_handler.dropped)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(x_admin_token: str = Header(default="")):
+    """
+    Métricas en formato de texto de Prometheus.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/admin/campaigns")
+async def admin_create_campaign(req: Request, x_admin_token: str = Header(default="")):
+    """
+    {"name": "...", "text": "..."} o {"name": "...", "template": {"name", "language", "components"}}
+    Filtros opcionales: "intents": [...], "since"/"until": "AAAA-MM-DD". "start": false la deja creada.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    data = await req.json()
+    kind = "template" if data.get("template") else "text"
+    try:
+        cid = create_campaign(
+            data.get("name") or f"campaña {datetime.utcnow():%Y-%m-%d %H:%M}",
+            kind,
+            data.get("template") or data.get("text"),
+            intents=data.get("intents"),
+            since=data.get("since"),
+            until=data.get("until"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if data.get("start", True):
+        campaigns.start(cid)
+    return campaigns.status(cid)
+
+
+@app.get("/admin/campaigns")
+def admin_list_campaigns(x_admin_token: str = Header(default="")):
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    db = SessionLocal()
+    try:
+        ids = [c.id for c in db.query(Campaign.id).order_by(Campaign.id.desc()).limit(50)]
+    finally:
+        db.close()
+    return {"campaigns": [campaigns.status(cid) for cid in ids]}
+
+
+@app.get("/admin/campaigns/{cid}")
+def admin_campaign_status(cid: int, x_admin_token: str = Header(default="")):
+    """
+    Entregas por estado, throughput (últimos 60 s) y ETA.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    status = campaigns.status(cid)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Campaña inexistente")
+    return status
+
+
+@app.post("/admin/campaigns/{cid}/pause")
+async def admin_pause_campaign(cid: int, x_admin_token: str = Header(default="")):
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+    if campaigns.status(cid) is None:
+        raise HTTPException(status_code=404, detail="Campaña inexistente")
+
+    await campaigns.pause(cid)
+    return campaigns.status(cid)
+
+
+@app.post("/admin/campaigns/{cid}/resume")
+async def admin_resume_campaign(cid: int, x_admin_token: str = Header(default="")):
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+    if campaigns.status(cid) is None:
+        raise HTTPException(status_code=404, detail="Campaña inexistente")
+
+    campaigns.start(cid)
+    return campaigns.status(cid)
+
+
+@app.get("/admin/stats")
+def admin_stats(since: str = None, until: str = None, x_admin_token: str = Header(default="")):
+    """
+    Intenciones por día, embudo de inscripción, fallback de IA y mediana
+    hasta confirmar, de los agregados diarios (por defecto, últimos 7 días).
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+    try:
+        start, end = date_range(since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if (end - start).days > 366:
+        raise HTTPException(status_code=422, detail="Rango máximo: 366 días")
+
+    return stats.report(start, end)
+
+
+@app.get("/admin/maintenance")
+def admin_maintenance(x_admin_token: str = Header(default="")):
+    """
+    Estado de los jobs: último resultado, error y próxima corrida.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    return {"enabled": MAINTENANCE_ENABLED, "jobs": maintenance.status()}
+
+
+@app.post("/admin/maintenance/{job}")
+async def admin_run_maintenance(job: str, x_admin_token: str = Header(default="")):
+    """
+    Corre un job ahora: sessions, leads, prune o vacuum.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+    if job not in maintenance.jobs:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+
+    result = await maintenance.run(job)
+    return {"job": job, "result": result, "error": maintenance.jobs[job].last_error}
+
+
+@app.get("/admin/leads")
+def admin_leads(phone: str = "", intent: str = "", before_id: int = None, limit: int = 100,
+                x_admin_token: str = Header(default="")):
+    """
+    Leads por id descendente. Paginar con before_id = next_before_id.
+    Usa los índices leads(wa_from, id) y leads(intent, id).
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    filters = []
+    if phone:
+        filters.append(Lead.wa_from == phone)
+    if intent:
+        filters.append(Lead.intent == intent)
+
+    limit = max(1, min(limit, EXPORT_PAGE_SIZE))
+    rows = next(_keyset_pages(Lead, filters, before_id, page_size=limit), [])
+    return {
+        "items": [
+            {"id": r.id, "phone": r.wa_from, "name": r.name, "intent": r.intent,
+             "last_message": r.last_message, "created_at": r.created_at}
+            for r in rows
+        ],
+        "next_before_id": rows[-1].id if len(rows) == limit else None,
+    }
+
+
+@app.get("/admin/enrollments")
+def admin_enrollments(since: datetime = None, until: datetime = None, before_id: int = None,
+                      limit: int = 100, x_admin_token: str = Header(default="")):
+    """
+    Inscripciones por id descendente, filtrables por rango de created_at.
+    """
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="No autorizado")
+
+    filters = []
+    if since:
+        filters.append(Enrollment.created_at >= since)
+    if until:
+        filters.append(Enrollment.created_at < until)
+
+    limit = max(1, min(limit, EXPORT_PAGE_SIZE))
+    rows = next(_keyset_pages(Enrollment, filters, before_id, page_size=limit), [])
+    return {
+        "items": [
+            {"id": r.id, "wa_from": r.wa_from, "name": r.name, "ci": r.ci, "course": r.course,
+             "level": r.level, "schedule_pref": r.schedule_pref, "confirmed": r.confirmed,
+             "created_at": r.created_at}
+            for r in rows
+        ],
+        "next_before_id": rows[-1].id if len(rows) == limit else None,
+    }
+
 # ============================================================
 #                        17) ROOT
 # ============================================================
@@ -930,6 +1613,14 @@ def root():
             "/test",
             "/admin/reload",
             "/admin/override",
+            "/admin/ai",
+            "/admin/content",
+            "/admin/campaigns",
+            "/admin/stats",
+            "/admin/maintenance",
+            "/metrics",
+            "/admin/leads",
+            "/admin/enrollments",
             "/export/leads.csv",
             "/export/enrollments.csv",
         ]
@@ -0,0 +1,100 @@
+# ============================================================
+#   MICRO-BENCHMARK – detect_intent_rules
+#   Implementación anterior (any(p in t ...)) vs autómata compilado
+#
+#   Uso:  python bench/bench_intent_matcher.py [intents] [palabras_por_intent]
+# ============================================================
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from intent_matcher import KeywordAutomaton, LINEAR_MAX_KEYWORDS, compile_intent_rules
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def legacy_match(t, rule_sets):
+    for rules in rule_sets:
+        for intent, palabras in rules.items():
+            if any(p in t for p in palabras):
+                return intent
+    return None
+
+
+def build_rules(n_intents, per_intent, seed=7):
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzáéíóúñ"
+    rules = {}
+    for i in range(n_intents):
+        rules[f"intent_{i:04d}"] = [
+            "".join(rnd.choice(alphabet) for _ in range(rnd.randint(4, 10)))
+            for _ in range(per_intent)
+        ]
+    return rules
+
+
+def build_texts(rules, n=2000, seed=11):
+    rnd = random.Random(seed)
+    words = ["hola", "quisiera", "saber", "el", "de", "para", "mi", "hijo", "por", "favor",
+             "gracias", "cuánto", "cuesta", "curso", "dónde", "queda", "horario", "tarde"]
+    keywords = [p for ps in rules.values() for p in ps]
+    texts = []
+    for _ in range(n):
+        parts = [rnd.choice(words) for _ in range(rnd.randint(3, 15))]
+        if rnd.random() < 0.6:
+            parts.insert(rnd.randrange(len(parts)), rnd.choice(keywords))
+        texts.append(" ".join(parts))
+    return texts
+
+
+def bench(fn, texts, min_time=1.0):
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        for t in texts:
+            fn(t)
+        n += len(texts)
+        dt = time.perf_counter() - t0
+        if dt >= min_time:
+            return n / dt
+
+
+def main():
+    n_intents  = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_intent = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+
+    with open(os.path.join(ROOT, "content.json"), encoding="utf-8") as f:
+        base_rules = json.load(f).get("rules", {})
+
+    scenarios = [
+        ("content.json", [base_rules]),
+        (f"{n_intents}x{per_intent} reglas", [base_rules, build_rules(n_intents, per_intent)]),
+    ]
+
+    for label, rule_sets in scenarios:
+        compiled  = compile_intent_rules(*rule_sets)
+        automaton = KeywordAutomaton(
+            [(i, p) for rules in rule_sets for i, p in rules.items()], linear_max=0
+        )
+        texts = build_texts(rule_sets[-1])
+
+        # Mismo resultado que la versión anterior
+        for t in texts:
+            expected = legacy_match(t, rule_sets)
+            assert compiled.match(t) == expected == automaton.match(t), t
+
+        legacy = bench(lambda t: legacy_match(t, rule_sets), texts)
+        fast   = bench(compiled.match, texts)
+        aho    = bench(automaton.match, texts)
+        mode   = "lineal" if compiled.keywords <= LINEAR_MAX_KEYWORDS else "autómata"
+        print(f"{label:<22} {compiled.keywords:>6} palabras | "
+              f"anterior {legacy:>10,.0f} msg/s | compilado ({mode}) {fast:>10,.0f} msg/s x{fast / legacy:.1f} | "
+              f"aho-corasick {aho:>10,.0f} msg/s")
+
+if __name__ == "__main__":
+    main()
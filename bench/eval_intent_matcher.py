@@ -0,0 +1,228 @@
+# ============================================================
+#   EVALUACIÓN OFFLINE – detección de intenciones
+#   Reglas exactas (anteriores) vs sin tildes + fuzzy sobre
+#   bench/intent_eval.tsv, barrido de umbrales y replay de
+#   mensajes reales: cuántas llamadas a la IA se evitarían
+#
+#   Uso:  python bench/eval_intent_matcher.py [--min-score 0.8] [--min-len 5]
+#                                             [--max-edits 2] [--sweep]
+#                                             [--replay db.sqlite3] [--messages msgs.txt]
+#                                             [--json]
+# ============================================================
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from collections import Counter
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from intent_matcher import compile_intent_matcher
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    p = argparse.ArgumentParser()
+    p.add_argument("--eval", default=os.path.join(ROOT, "intent_eval.tsv"))
+    p.add_argument("--min-score", type=float, default=None, help="por defecto INTENT_FUZZY_MIN_SCORE")
+    p.add_argument("--min-len", type=int, default=None, help="por defecto INTENT_FUZZY_MIN_LEN")
+    p.add_argument("--max-edits", type=int, default=None, help="por defecto INTENT_FUZZY_MAX_EDITS")
+    p.add_argument("--sweep", action="store_true", help="probar varios min_score")
+    p.add_argument("--replay", help="SQLite con la tabla leads (mensajes reales)")
+    p.add_argument("--messages", help="archivo con un mensaje por línea")
+    p.add_argument("--json", action="store_true")
+    return p.parse_args()
+
+
+def load_bot():
+    # La configuración se lee al importar: base temporal, sin credenciales reales
+    tmp = tempfile.mkdtemp(prefix="bot-eval-")
+    os.environ.update({
+        "WHATSAPP_TOKEN": "eval",
+        "WHATSAPP_PHONE_NUMBER_ID": "eval",
+        "VERIFY_TOKEN": "eval",
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'eval.sqlite3')}",
+        "CONTENT_PATH": os.path.join(ROOT, "..", "content.json"),
+        "CONTENT_WATCH": "0",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import app as bot
+    return bot
+
+
+def load_eval(path):
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            expected, text = line.split("\t", 1)
+            cases.append((expected, text))
+    return cases
+
+
+def detector(bot, matcher):
+    """
+    Igual que _detect_intent, con el matcher que se quiera probar.
+    """
+    def detect(text):
+        if not text:
+            return "general", None
+        t = text.lower()
+        intent, stage, _ = matcher.classify(t)
+        if intent:
+            return intent, stage
+        return bot.SHORTCUTS.get(t, "general"), None
+    return detect
+
+
+def build(bot, **options):
+    return compile_intent_matcher(bot.SNAPSHOT.content.get("rules", {}), bot.REGLAS_AUTO, **options)
+
+
+def evaluate(cases, detect):
+    ok, stages, errors = 0, Counter(), []
+    false_pos = missed = 0
+    for expected, text in cases:
+        got, stage = detect(text)
+        stages[stage or "none"] += 1
+        if got == expected:
+            ok += 1
+            continue
+        errors.append({"text": text, "expected": expected, "got": got, "stage": stage})
+        if expected == "general":
+            false_pos += 1      # habría respondido con reglas algo que era para la IA
+        elif got == "general":
+            missed += 1         # habría llamado a la IA sin necesidad
+    return {
+        "cases": len(cases),
+        "accuracy": round(ok / len(cases), 3) if cases else None,
+        "false_positives": false_pos,
+        "missed": missed,
+        "wrong_intent": len(errors) - false_pos - missed,
+        "stages": dict(stages),
+        "errors": errors,
+    }
+
+
+def replay_messages(args):
+    texts = []
+    if args.replay:
+        conn = sqlite3.connect(f"file:{args.replay}?mode=ro", uri=True)
+        try:
+            texts += [r[0] for r in conn.execute("SELECT last_message FROM leads WHERE last_message IS NOT NULL")]
+        finally:
+            conn.close()
+    if args.messages:
+        with open(args.messages, encoding="utf-8") as f:
+            texts += [line.strip() for line in f if line.strip()]
+    return texts
+
+
+def replay(texts, before_fn, current):
+    """
+    Mensajes que con las reglas anteriores iban a la IA ("general")
+    y ahora tienen intención: llamadas a la IA evitadas (cota superior,
+    algunas habrían salido de la caché de respuestas).
+    """
+    ai_before = ai_after = 0
+    avoided, by_intent = [], Counter()
+    for text in texts:
+        before, _ = before_fn(text)
+        after, stage = current(text)
+        ai_before += before == "general"
+        ai_after += after == "general"
+        if before == "general" and after != "general":
+            avoided.append({"text": text, "intent": after, "stage": stage})
+            by_intent[after] += 1
+    return {
+        "messages": len(texts),
+        "ai_calls_before": ai_before,
+        "ai_calls_after": ai_after,
+        "ai_calls_avoided": len(avoided),
+        "avoided_pct": round(100 * len(avoided) / ai_before, 1) if ai_before else None,
+        "by_intent": dict(by_intent),
+        "avoided": avoided,
+    }
+
+
+def main():
+    args = parse_args()
+    bot = load_bot()
+    options = {
+        "min_score": args.min_score if args.min_score is not None else bot.INTENT_FUZZY_MIN_SCORE,
+        "min_len": args.min_len if args.min_len is not None else bot.INTENT_FUZZY_MIN_LEN,
+        "max_edits": args.max_edits if args.max_edits is not None else bot.INTENT_FUZZY_MAX_EDITS,
+    }
+
+    cases   = load_eval(args.eval)
+    exact   = partial(_exact_only, bot)
+    folded  = detector(bot, build(bot, **options, fuzzy=False))
+    current = detector(bot, build(bot, **options))
+
+    report = {
+        "options": options,
+        "exact_only": evaluate(cases, exact),
+        "folded_only": evaluate(cases, folded),
+        "fuzzy": evaluate(cases, current),
+    }
+    if args.sweep:
+        report["sweep"] = []
+        for score in (0.7, 0.75, 0.8, 0.85, 0.9):
+            r = evaluate(cases, detector(bot, build(bot, **{**options, "min_score": score})))
+            report["sweep"].append({"min_score": score, **{k: r[k] for k in
+                                    ("accuracy", "false_positives", "missed", "wrong_intent")}})
+
+    texts = replay_messages(args)
+    if texts:
+        report["replay"] = replay(texts, exact, current)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print_report(report)
+
+
+def _exact_only(bot, text):
+    # Reglas como estaban: subcadena exacta en minúsculas, luego atajos
+    if not text:
+        return "general", None
+    t = text.lower()
+    intent = bot.SNAPSHOT.matcher.exact.match(t)
+    if intent:
+        return intent, "exact"
+    return bot.SHORTCUTS.get(t, "general"), None
+
+
+def print_report(report):
+    o = report["options"]
+    print(f"min_score={o['min_score']} min_len={o['min_len']} max_edits={o['max_edits']}\n")
+    print(f"{'':<14}{'acierto':>9}{'falsos +':>10}{'a la IA':>9}{'otra int.':>11}")
+    for name in ("exact_only", "folded_only", "fuzzy"):
+        r = report[name]
+        print(f"{name:<14}{r['accuracy']:>9.1%}{r['false_positives']:>10}{r['missed']:>9}{r['wrong_intent']:>11}")
+    print(f"\n{report['fuzzy']['cases']} casos; etapas con fuzzy: {report['fuzzy']['stages']}")
+    for e in report["fuzzy"]["errors"]:
+        print(f"  ✗ {e['text']!r}: esperado {e['expected']}, sale {e['got']} ({e['stage']})")
+
+    for s in report.get("sweep", []):
+        print(f"  min_score {s['min_score']:<5} acierto {s['accuracy']:.1%}  falsos+ {s['false_positives']}"
+              f"  a la IA {s['missed']}  otra int. {s['wrong_intent']}")
+
+    r = report.get("replay")
+    if r:
+        print(f"\nReplay: {r['messages']} mensajes; a la IA antes {r['ai_calls_before']}, "
+              f"ahora {r['ai_calls_after']} → {r['ai_calls_avoided']} llamadas evitadas"
+              f" ({r['avoided_pct']}%)")
+        for a in r["avoided"]:
+            print(f"  {a['text']!r} → {a['intent']} ({a['stage']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# ============================================================
+#   SERVIDORES FALSOS – Graph API y OpenAI
+#   http.server en hilos, sin dependencias; latencia y tasa de
+#   error configurables para correr el bot totalmente offline
+# ============================================================
+
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGES_PATH = re.compile(r"^/v[\d.]+/[^/]+/messages$")
+MEDIA_PATH    = re.compile(r"^/v[\d.]+/([^/]+)$")
+DOWNLOAD_PATH = re.compile(r"^/media/([^/]+)$")
+
+
+class FakeBackend:
+    """
+    latency    – segundos promedio por pedido (±50 % de jitter)
+    error_rate – fracción de pedidos que fallan
+    error_code – HTTP devuelto al fallar (429 / 500 / 503...)
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, error_code: int = 500, seed: int = 1):
+        self.latency    = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.rnd        = random.Random(seed)
+        self.lock       = threading.Lock()
+        self.requests   = 0
+        self.errors     = 0
+        self._ids       = itertools.count(1)
+        self._server    = None
+        self.url        = None
+
+    # ---------------- ciclo de vida ----------------
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    body = {}
+                status, payload = backend.handle(self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                if status == 429:
+                    self.send_header("retry-after", "0")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                status, ctype, data = backend.handle_get(self.path)
+                self.send_response(status)
+                self.send_header("content-type", ctype)
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    # ---------------- pedidos ----------------
+    def _roll(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency * self.rnd.uniform(0.5, 1.5) if self.latency else 0
+            fail  = self.rnd.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def handle(self, path: str, body: dict):
+        if self._roll():
+            return self.error_code, {"error": {"message": "fake error", "code": self.error_code}}
+        return self.respond(path, body)
+
+    def handle_get(self, path: str):
+        """
+        (status, content-type, bytes)
+        """
+        if self._roll():
+            return self.error_code, "application/json", json.dumps(
+                {"error": {"message": "fake error", "code": self.error_code}}).encode("utf-8")
+        return self.respond_get(path)
+
+    def respond(self, path: str, body: dict):
+        return 404, {"error": {"message": f"ruta desconocida {path}"}}
+
+    def respond_get(self, path: str):
+        data = json.dumps({"error": {"message": f"ruta desconocida {path}"}}).encode("utf-8")
+        return 404, "application/json", data
+
+
+class FakeGraph(FakeBackend):
+    """
+    POST /vXX.X/{PHONE_NUMBER_ID}/messages
+    on_message(to, payload, t) se llama con cada envío aceptado.
+    GET  /vXX.X/{MEDIA_ID} y /media/{MEDIA_ID} para archivos de add_media().
+    """
+
+    def __init__(self, on_message=None, **kw):
+        super().__init__(**kw)
+        self.on_message = on_message
+        self.sent = 0
+        self.media = {}
+        self.downloads = 0
+
+    def add_media(self, media_id: str, data: bytes, mime_type: str = "image/jpeg"):
+        self.media[media_id] = (data, mime_type)
+
+    def respond_get(self, path: str):
+        m = MEDIA_PATH.match(path)
+        if m and m.group(1) in self.media:
+            data, mime_type = self.media[m.group(1)]
+            info = {
+                "messaging_product": "whatsapp",
+                "id": m.group(1),
+                "url": f"{self.url}/media/{m.group(1)}",
+                "mime_type": mime_type,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "file_size": len(data),
+            }
+            return 200, "application/json", json.dumps(info).encode("utf-8")
+        m = DOWNLOAD_PATH.match(path)
+        if m and m.group(1) in self.media:
+            with self.lock:
+                self.downloads += 1
+            data, mime_type = self.media[m.group(1)]
+            return 200, mime_type, data
+        return super().respond_get(path)
+
+    def respond(self, path: str, body: dict):
+        if not MESSAGES_PATH.match(path):
+            return super().respond(path, body)
+        to = body.get("to", "")
+        with self.lock:
+            self.sent += 1
+        if self.on_message:
+            self.on_message(to, body, time.perf_counter())
+        return 200, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": to, "wa_id": to}],
+            "messages": [{"id": f"wamid.fake.{next(self._ids)}"}],
+        }
+
+
+class FakeOpenAI(FakeBackend):
+    """
+    POST /v1/chat/completions con una respuesta fija.
+    """
+
+    def respond(self, path: str, body: dict):
+        if not path.rstrip("/").endswith("/chat/completions"):
+            return super().respond(path, body)
+        question = (body.get("messages") or [{}])[-1].get("content", "")
+        return 200, {
+            "id": f"chatcmpl-fake-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": f"Respuesta de prueba a: {question[:80]}"},
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
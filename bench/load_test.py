@@ -0,0 +1,173 @@
+# ============================================================
+#   PRUEBA DE CARGA – webhook de punta a punta, sin internet
+#   Graph API y OpenAI falsos locales; mide throughput y
+#   latencia p50/p95/p99 desde el POST hasta la respuesta en Graph
+#
+#   Uso:  python bench/load_test.py [--payloads 2000] [--concurrency 50]
+#                                   [--graph-latency 0.05] [--ai-latency 0.4]
+#                                   [--graph-errors 0.01] [--ai-errors 0.02]
+#                                   [--ack-first] [--json]
+# ============================================================
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_servers import FakeGraph, FakeOpenAI
+from payloads import PHONE_NUMBER_ID, PayloadGenerator
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Prueba de carga offline del webhook")
+    p.add_argument("--payloads", type=int, default=2000, help="payloads de webhook a enviar")
+    p.add_argument("--concurrency", type=int, default=50, help="POSTs simultáneos")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--variety", type=int, default=50,
+                   help="variantes por pregunta libre (0 = todas iguales, máximo uso de la caché)")
+    p.add_argument("--graph-latency", type=float, default=0.05)
+    p.add_argument("--graph-errors", type=float, default=0.0)
+    p.add_argument("--graph-error-code", type=int, default=500)
+    p.add_argument("--graph-rate", type=float, default=1000,
+                   help="GRAPH_MSGS_PER_SEC del bot (producción: 80)")
+    p.add_argument("--ai-latency", type=float, default=0.4)
+    p.add_argument("--ai-errors", type=float, default=0.0)
+    p.add_argument("--ai-error-code", type=int, default=500)
+    p.add_argument("--ack-first", action="store_true", help="WEBHOOK_ACK_FIRST=1")
+    p.add_argument("--drain-timeout", type=float, default=60.0,
+                   help="segundos a esperar respuestas pendientes al final")
+    p.add_argument("--json", action="store_true", help="reporte en JSON (para comparar en CI)")
+    return p.parse_args()
+
+
+async def run(args) -> dict:
+    replies = {}   # wa_from -> momento de la primera respuesta en Graph
+
+    def on_message(to, payload, t):
+        replies.setdefault(to, t)
+
+    graph = FakeGraph(on_message=on_message, latency=args.graph_latency,
+                      error_rate=args.graph_errors, error_code=args.graph_error_code, seed=args.seed)
+    ai = FakeOpenAI(latency=args.ai_latency, error_rate=args.ai_errors,
+                    error_code=args.ai_error_code, seed=args.seed + 1)
+    graph_url, ai_url = graph.start(), ai.start()
+
+    # Todo antes de importar app: la configuración se lee al importar
+    tmp = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "WHATSAPP_TOKEN": "bench",
+        "WHATSAPP_PHONE_NUMBER_ID": PHONE_NUMBER_ID,
+        "VERIFY_TOKEN": "bench",
+        "GRAPH_BASE_URL": graph_url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": ai_url + "/v1",
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}",
+        "CONTENT_PATH": os.path.join(ROOT, "content.json"),
+        "GRAPH_MSGS_PER_SEC": str(args.graph_rate),
+        "WEBHOOK_ACK_FIRST": "1" if args.ack_first else "0",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import app as bot
+
+    gen = PayloadGenerator(seed=args.seed, free_text_variety=args.variety)
+    batch = [gen.next() for _ in range(args.payloads)]
+    expected = sum(len(e) for _, e in batch)
+
+    sent_at, post_latency, statuses = {}, [], Counter()
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async with bot.app.router.lifespan_context(bot.app):
+        transport = httpx.ASGITransport(app=bot.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def post(payload, msgs):
+                async with sem:
+                    t0 = time.perf_counter()
+                    for phone, _ in msgs:
+                        sent_at[phone] = t0
+                    r = await client.post("/webhook", json=payload)
+                    post_latency.append(time.perf_counter() - t0)
+                    statuses[r.status_code] += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(post(p, m) for p, m in batch))
+            posted = time.perf_counter() - start
+
+            # ack-first / envíos en cola: esperar las respuestas que faltan
+            deadline = time.perf_counter() + args.drain_timeout
+            while len(replies) < expected and time.perf_counter() < deadline:
+                await asyncio.sleep(0.02)
+            elapsed = time.perf_counter() - start
+
+        snapshot = {
+            "outbound": {"sent": bot.outbound.sent, "failed": bot.outbound.failed,
+                         "retried": bot.outbound.retried, "throttled": bot.outbound.throttled},
+            "ai_cache": {"hits": bot.ai_cache.hits, "misses": bot.ai_cache.misses},
+            "ai_coalesced": bot.ai_flights.coalesced,
+        }
+
+    graph.stop()
+    ai.stop()
+
+    e2e = [replies[p] - t for p, t in sent_at.items() if p in replies]
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        "payloads": args.payloads,
+        "messages": expected,
+        "replied": len(e2e),
+        "concurrency": args.concurrency,
+        "ack_first": args.ack_first,
+        "seconds": round(elapsed, 3),
+        "post_seconds": round(posted, 3),
+        "throughput_msgs_per_s": round(len(e2e) / elapsed, 1) if elapsed else 0,
+        "http_status": dict(statuses),
+        "post_ms": {"p50": ms(percentile(post_latency, 50)), "p95": ms(percentile(post_latency, 95)),
+                    "p99": ms(percentile(post_latency, 99))},
+        "e2e_ms": {"p50": ms(percentile(e2e, 50)), "p95": ms(percentile(e2e, 95)),
+                   "p99": ms(percentile(e2e, 99)), "max": ms(max(e2e)) if e2e else None},
+        "graph": {"requests": graph.requests, "errors": graph.errors},
+        "openai": {"requests": ai.requests, "errors": ai.errors},
+        **snapshot,
+    }
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Payloads: {report['payloads']}  mensajes: {report['messages']}  "
+          f"con respuesta: {report['replied']}  concurrencia: {report['concurrency']}"
+          f"{'  (ack-first)' if report['ack_first'] else ''}")
+    print(f"Duración: {report['seconds']} s  →  {report['throughput_msgs_per_s']} msg/s")
+    print(f"HTTP: {report['http_status']}")
+    print(f"{'':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for label, key in (("POST ms", "post_ms"), ("E2E ms", "e2e_ms")):
+        v = report[key]
+        print(f"{label:<12}{v['p50']:>10}{v['p95']:>10}{v['p99']:>10}")
+    print(f"Graph: {report['graph']}  envíos: {report['outbound']}")
+    print(f"OpenAI: {report['openai']}  caché: {report['ai_cache']}  coalescidas: {report['ai_coalesced']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# ============================================================
+#   GENERADOR DE PAYLOADS DEL WEBHOOK (WhatsApp Cloud API)
+#   Texto, botones, listas, imágenes, solo-estados y lotes
+#   con varios mensajes; reproducible con una semilla
+# ============================================================
+
+import itertools
+import random
+import time
+
+PHONE_NUMBER_ID = "bench"
+
+# Preguntas que caen en reglas y preguntas libres (→ IA)
+RULE_TEXTS = [
+    "hola", "cuál es el horario?", "qué cursos tienen", "cuánto cuesta la mensualidad",
+    "requisitos para inscribirme", "dónde están ubicados", "teléfono de contacto",
+    "aceptan pago con qr?", "menu", "1", "2",
+]
+FREE_TEXTS = [
+    "tienen clases los sábados?", "puedo cambiar de turno a mitad de mes",
+    "el certificado tiene validez internacional", "hay descuento para militares",
+    "cuántos alumnos hay por aula", "se puede rendir examen de suficiencia",
+]
+BUTTONS = [("btn_horarios", "Horarios"), ("btn_precios", "Precios"), ("btn_inscribirme", "Inscribirme")]
+LIST_ROWS = [("curso_ingles", "Inglés"), ("curso_chino", "Chino"), ("curso_frances", "Francés")]
+
+# Proporción de cada tipo de payload
+DEFAULT_MIX = {
+    "text": 0.55,
+    "free_text": 0.15,
+    "button_reply": 0.08,
+    "list_reply": 0.07,
+    "image": 0.05,
+    "status": 0.05,
+    "batch": 0.05,
+}
+
+
+class PayloadGenerator:
+    """
+    next() → (payload, [(wa_from, message_id), ...]) con los mensajes
+    que deberían recibir respuesta. Cada mensaje usa un wa_from propio
+    para poder medir la latencia hasta la respuesta en Graph.
+    """
+
+    def __init__(self, seed: int = 1, mix: dict = None, free_text_variety: int = 0):
+        self.rnd   = random.Random(seed)
+        self.mix   = mix or DEFAULT_MIX
+        self.kinds = list(self.mix)
+        self.weights = [self.mix[k] for k in self.kinds]
+        self.free_text_variety = free_text_variety
+        self._seq  = itertools.count(1)
+
+    def _phone(self, seq: int) -> str:
+        return f"5917{seq:07d}"
+
+    def _message(self, kind: str):
+        seq = next(self._seq)
+        phone, mid = self._phone(seq), f"wamid.bench.{seq}"
+        msg = {"from": phone, "id": mid, "timestamp": str(int(time.time()))}
+
+        if kind == "text":
+            msg.update(type="text", text={"body": self.rnd.choice(RULE_TEXTS)})
+        elif kind == "free_text":
+            body = self.rnd.choice(FREE_TEXTS)
+            if self.free_text_variety:
+                # Variantes distintas → la caché de IA no las absorbe
+                body += f" ({self.rnd.randrange(self.free_text_variety)})"
+            msg.update(type="text", text={"body": body})
+        elif kind == "button_reply":
+            bid, title = self.rnd.choice(BUTTONS)
+            msg.update(type="interactive", interactive={
+                "type": "button_reply", "button_reply": {"id": bid, "title": title}})
+        elif kind == "list_reply":
+            rid, title = self.rnd.choice(LIST_ROWS)
+            msg.update(type="interactive", interactive={
+                "type": "list_reply", "list_reply": {"id": rid, "title": title, "description": ""}})
+        elif kind == "image":
+            msg.update(type="image", image={
+                "id": f"media.{seq}", "mime_type": "image/jpeg", "sha256": "0" * 64, "caption": "mi CI"})
+        return phone, mid, msg
+
+    def _value(self, messages):
+        return {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "59170000000", "phone_number_id": PHONE_NUMBER_ID},
+            "contacts": [{"profile": {"name": "Bench"}, "wa_id": m["from"]} for m in messages],
+            "messages": messages,
+        }
+
+    def _wrap(self, value):
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [{"id": "bench-waba", "changes": [{"field": "messages", "value": value}]}],
+        }
+
+    def next(self):
+        kind = self.rnd.choices(self.kinds, self.weights)[0]
+
+        if kind == "status":
+            seq = next(self._seq)
+            value = {
+                "messaging_product": "whatsapp",
+                "metadata": {"display_phone_number": "59170000000", "phone_number_id": PHONE_NUMBER_ID},
+                "statuses": [{
+                    "id": f"wamid.out.{seq}", "status": self.rnd.choice(["sent", "delivered", "read"]),
+                    "timestamp": str(int(time.time())), "recipient_id": self._phone(seq),
+                }],
+            }
+            return self._wrap(value), []
+
+        if kind == "batch":
+            kinds = self.rnd.choices(["text", "free_text", "button_reply"], k=self.rnd.randint(2, 4))
+        else:
+            kinds = [kind]
+
+        expected, messages = [], []
+        for k in kinds:
+            phone, mid, msg = self._message(k)
+            expected.append((phone, mid))
+            messages.append(msg)
+        return self._wrap(self._value(messages)), expected
@@ -0,0 +1,361 @@
+# ============================================================
+#   CAMPAÑAS MASIVAS (promociones a leads anteriores)
+#   Destinatarios únicos por wa_from, checkpoint por entrega en
+#   campaign_deliveries y envío con prioridad "masivo" y tope
+#   propio de mensajes/segundo: el tráfico en vivo va primero
+# ============================================================
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select, text, update
+
+from database import engine, Lead, LeadContact, Campaign, CampaignDelivery
+from outbound import PRIORITY_BULK, TokenBucket
+from reply_plan import template_payload, text_payload
+from shared_state import worker_id
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value))
+
+
+def create_campaign(name: str, kind: str, body, intents=None, since=None, until=None,
+                    bind=engine) -> int:
+    """
+    Crea la campaña (devuelve su id) y materializa sus destinatarios con
+    INSERT ... SELECT (un wa_from una vez, aunque tenga varios leads):
+    de leads y de lead_contacts (los leads que el mantenimiento ya resumió;
+    since/until se comparan con su último y primer lead).
+    body: texto, o {"name", "language", "components"} si kind == "template".
+    """
+    if kind not in {"text", "template"}:
+        raise ValueError("kind debe ser 'text' o 'template'")
+    if kind == "template" and not (isinstance(body, dict) and body.get("name")):
+        raise ValueError("template requiere al menos 'name'")
+    if kind == "text" and not (isinstance(body, str) and body.strip()):
+        raise ValueError("text no puede estar vacío")
+
+    since, until = _parse_date(since), _parse_date(until)
+    filters = {"intents": list(intents or []), "since": since and since.isoformat(),
+               "until": until and until.isoformat()}
+
+    with bind.begin() as conn:
+        cid = conn.execute(insert(Campaign).values(
+            name=name, kind=kind, status="pending",
+            body=json.dumps(body, ensure_ascii=False) if kind == "template" else body,
+            filters=json.dumps(filters),
+        )).inserted_primary_key[0]
+
+        recipients = (
+            select(literal(cid), Lead.wa_from, literal("pending"), literal(0))
+            .where(Lead.wa_from.is_not(None), Lead.wa_from != "")
+            .group_by(Lead.wa_from)
+        )
+        if intents:
+            recipients = recipients.where(Lead.intent.in_(list(intents)))
+        if since:
+            recipients = recipients.where(Lead.created_at >= since)
+        if until:
+            recipients = recipients.where(Lead.created_at < until)
+
+        contacts = (
+            select(literal(cid), LeadContact.wa_from, literal("pending"), literal(0))
+            .group_by(LeadContact.wa_from)
+        )
+        if intents:
+            contacts = contacts.where(LeadContact.intent.in_(list(intents)))
+        if since:
+            contacts = contacts.where(LeadContact.last_at >= since)
+        if until:
+            contacts = contacts.where(LeadContact.first_at < until)
+
+        for source in (recipients, contacts):
+            conn.execute(
+                insert(CampaignDelivery)
+                .from_select(["campaign_id", "wa_from", "status", "attempts"], source)
+                .prefix_with("OR IGNORE")
+            )
+        total = conn.execute(
+            select(func.count()).select_from(CampaignDelivery).where(CampaignDelivery.campaign_id == cid)
+        ).scalar()
+        conn.execute(update(Campaign).where(Campaign.id == cid).values(total=total))
+    return cid
+
+
+class CampaignRunner:
+    """
+    Un task por campaña activa: toma lotes de entregas pendientes
+    (UPDATE ... status='sending' con un claim propio, seguro entre
+    workers), los reparte en `workers` envíos simultáneos y guarda el
+    resultado de a `checkpoint_every` filas. Las entregas que quedaron en
+    'sending' más de `lease` segundos (worker caído) vuelven a pending;
+    si solo quedan esas, la campaña espera a que venzan y las retoma.
+
+    rate: tope de mensajes/segundo de la campaña, por debajo del límite
+    del número: el resto de la capacidad queda para las respuestas en vivo.
+    """
+
+    def __init__(self, outbound, rate: float = 20, workers: int = 8, batch_size: int = 100,
+                 checkpoint_every: int = 25, lease: float = 300, bind=engine):
+        self.outbound   = outbound
+        self.rate       = rate
+        self.workers    = workers
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.lease      = lease
+        self.bind       = bind
+        self.owner      = worker_id()
+        self._tasks     = {}       # campaign_id -> asyncio.Task
+        self._recent    = {}       # campaign_id -> deque[time.monotonic()] de envíos
+        self._batches   = 0
+        self._halting   = set()    # campañas pausándose: no tomar más envíos
+
+    # ---------------- control ----------------
+    def running(self, cid: int) -> bool:
+        task = self._tasks.get(cid)
+        return task is not None and not task.done()
+
+    def _status_of(self, cid: int):
+        with self.bind.connect() as conn:
+            return conn.execute(select(Campaign.status).where(Campaign.id == cid)).scalar()
+
+    def start(self, cid: int):
+        if self.running(cid) or self._status_of(cid) in (None, "done"):
+            return
+        self._set_status(cid, "running", started=True)
+        self._tasks[cid] = asyncio.create_task(self._run(cid), name=f"campaign-{cid}")
+
+    async def pause(self, cid: int):
+        if self._status_of(cid) in ("pending", "running"):
+            self._set_status(cid, "paused")
+        await self._halt([cid])
+
+    async def _halt(self, cids, timeout: float = 30.0):
+        """
+        No se toman más destinatarios; los envíos ya en el planificador
+        terminan y se guardan (cancelarlos no los saca de la fila de
+        Graph: se mandarían dos veces al retomar). Lo no enviado vuelve
+        a pending.
+        """
+        tasks = [t for t in (self._tasks.pop(cid, None) for cid in cids) if t]
+        self._halting.update(cids)
+        try:
+            if tasks:
+                _, late = await asyncio.wait(tasks, timeout=timeout)
+                for t in late:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self._halting.difference_update(cids)
+        for cid in cids:
+            self._release_claims(cid)
+
+    async def resume_all(self):
+        """
+        Al iniciar: retoma las campañas que estaban corriendo.
+        """
+        with self.bind.connect() as conn:
+            ids = conn.execute(select(Campaign.id).where(Campaign.status == "running")).scalars().all()
+        for cid in ids:
+            log.info("Retomando campaña %d", cid)
+            self.start(cid)
+
+    async def stop(self):
+        await self._halt(list(self._tasks))
+
+    # ---------------- estado ----------------
+    def status(self, cid: int) -> dict:
+        with self.bind.connect() as conn:
+            camp = conn.execute(select(Campaign.__table__).where(Campaign.id == cid)).mappings().first()
+            if camp is None:
+                return None
+            counts = dict(conn.execute(
+                select(CampaignDelivery.status, func.count())
+                .where(CampaignDelivery.campaign_id == cid)
+                .group_by(CampaignDelivery.status)
+            ).all())
+
+        remaining = counts.get("pending", 0) + counts.get("sending", 0)
+        rate = self._throughput(cid)
+        if rate is None and camp["started_at"] and counts.get("sent"):
+            # Sin envíos recientes en este worker: promedio desde el inicio
+            end = camp["finished_at"] or datetime.utcnow()
+            elapsed = (end - camp["started_at"]).total_seconds()
+            rate = counts["sent"] / elapsed if elapsed > 0 else None
+        return {
+            "id": cid,
+            "name": camp["name"],
+            "status": camp["status"],
+            "running_here": self.running(cid),
+            "total": camp["total"],
+            "deliveries": counts,
+            "remaining": remaining,
+            "throughput_per_s": round(rate, 2) if rate else 0,
+            "eta_seconds": round(remaining / rate) if rate and remaining else (0 if not remaining else None),
+            "started_at": camp["started_at"],
+            "finished_at": camp["finished_at"],
+        }
+
+    def _throughput(self, cid: int, window: float = 60.0):
+        recent = self._recent.get(cid)
+        if not recent:
+            return None
+        now = time.monotonic()
+        while recent and now - recent[0] > window:
+            recent.popleft()
+        if len(recent) < 2:
+            return None
+        span = max(now - recent[0], 1.0)
+        return len(recent) / span
+
+    # ---------------- internos ----------------
+    def _set_status(self, cid: int, status: str, started: bool = False, finished: bool = False):
+        values = {"status": status}
+        if started:
+            values["started_at"] = func.coalesce(Campaign.started_at, func.now())
+        if finished:
+            values["finished_at"] = func.now()
+        with self.bind.begin() as conn:
+            conn.execute(update(Campaign).where(Campaign.id == cid).values(**values))
+
+    def _release_claims(self, cid: int):
+        with self.bind.begin() as conn:
+            conn.execute(text(
+                "UPDATE campaign_deliveries SET status = 'pending', claim = NULL"
+                " WHERE campaign_id = :c AND status = 'sending' AND claim LIKE :me"
+            ), {"c": cid, "me": self.owner + ":%"})
+
+    def _claim(self, cid: int):
+        self._batches += 1
+        claim, now = f"{self.owner}:{self._batches}", time.time()
+        with self.bind.begin() as conn:
+            # Claims vencidos (worker caído a mitad de lote) vuelven a la fila
+            conn.execute(text(
+                "UPDATE campaign_deliveries SET status = 'pending', claim = NULL"
+                " WHERE campaign_id = :c AND status = 'sending' AND claimed_at < :old"
+            ), {"c": cid, "old": now - self.lease})
+            conn.execute(text(
+                "UPDATE campaign_deliveries SET status = 'sending', claim = :claim, claimed_at = :now"
+                " WHERE rowid IN (SELECT rowid FROM campaign_deliveries"
+                "   WHERE campaign_id = :c AND status = 'pending' LIMIT :n)"
+            ), {"c": cid, "claim": claim, "now": now, "n": self.batch_size})
+            return conn.execute(text(
+                "SELECT wa_from FROM campaign_deliveries WHERE campaign_id = :c AND claim = :claim"
+            ), {"c": cid, "claim": claim}).scalars().all()
+
+    def _lease_wait(self, cid: int):
+        """
+        Segundos hasta que vence el primer claim ajeno en 'sending';
+        None si no queda ninguno.
+        """
+        with self.bind.connect() as conn:
+            first = conn.execute(text(
+                "SELECT MIN(claimed_at) FROM campaign_deliveries"
+                " WHERE campaign_id = :c AND status = 'sending'"
+            ), {"c": cid}).scalar()
+        if first is None:
+            return None
+        return max(0.0, first + self.lease - time.time()) + 0.1
+
+    async def _nap(self, cid: int, seconds: float):
+        # Espera cortable: una pausa no tiene que esperar al lease
+        end = time.monotonic() + seconds
+        while cid not in self._halting and time.monotonic() < end:
+            await asyncio.sleep(min(1.0, end - time.monotonic()))
+
+    def _checkpoint(self, cid: int, results: list):
+        if not results:
+            return
+        with self.bind.begin() as conn:
+            conn.execute(text(
+                "UPDATE campaign_deliveries SET status = :status, message_id = :message_id,"
+                " error = :error, attempts = attempts + 1, claim = NULL,"
+                " sent_at = CASE WHEN :status = 'sent' THEN CURRENT_TIMESTAMP END"
+                " WHERE campaign_id = :c AND wa_from = :wa_from"
+            ), [dict(r, c=cid) for r in results])
+
+    def _payload(self, camp, to: str) -> dict:
+        if camp["kind"] == "template":
+            tpl = json.loads(camp["body"])
+            return template_payload(to, tpl["name"], tpl.get("language", "es"), tpl.get("components"))
+        return text_payload(to, camp["body"])
+
+    async def _deliver(self, camp, to: str, bucket: TokenBucket):
+        await bucket.acquire()
+        if camp["id"] in self._halting:
+            return None
+        try:
+            body = await self.outbound.send(to, self._payload(camp, to), PRIORITY_BULK)
+        except Exception as e:
+            return {"wa_from": to, "status": "failed", "message_id": None, "error": str(e)[:500]}
+        if isinstance(body, dict) and body.get("error"):
+            return {"wa_from": to, "status": "failed", "message_id": None,
+                    "error": json.dumps(body["error"], ensure_ascii=False)[:500]}
+        mid = ((body or {}).get("messages") or [{}])[0].get("id")
+        self._recent.setdefault(camp["id"], deque()).append(time.monotonic())
+        return {"wa_from": to, "status": "sent", "message_id": mid, "error": None}
+
+    async def _run(self, cid: int):
+        with self.bind.connect() as conn:
+            camp = conn.execute(select(Campaign.__table__).where(Campaign.id == cid)).mappings().first()
+        if camp is None:
+            return
+        bucket = TokenBucket(self.rate, burst=self.workers)
+        sem = asyncio.Semaphore(self.workers)
+        results = []
+
+        async def one(to):
+            async with sem:
+                result = await self._deliver(camp, to, bucket)
+            if result is None:
+                return
+            results.append(result)
+            if len(results) >= self.checkpoint_every:
+                batch = results[:]
+                del results[:]
+                self._checkpoint(cid, batch)
+
+        try:
+            while cid not in self._halting:
+                recipients = self._claim(cid)
+                if not recipients:
+                    # Solo quedan entregas tomadas por otro worker: si murió,
+                    # vuelven a pending cuando vence su lease
+                    wait = self._lease_wait(cid)
+                    if wait is None:
+                        break
+                    await self._nap(cid, wait)
+                    continue
+                await asyncio.gather(*(one(to) for to in recipients))
+                self._checkpoint(cid, results[:])
+                del results[:]
+        except asyncio.CancelledError:
+            # Pausa que no terminó a tiempo: guardar lo que ya salió
+            self._checkpoint(cid, results[:])
+            raise
+        except Exception as e:
+            log.exception("Campaña %d detenida: %s", cid, e)
+            self._checkpoint(cid, results[:])
+            self._release_claims(cid)
+            self._set_status(cid, "paused")
+            return
+
+        with self.bind.connect() as conn:
+            left = conn.execute(text(
+                "SELECT COUNT(*) FROM campaign_deliveries WHERE campaign_id = :c AND status IN ('pending', 'sending')"
+            ), {"c": cid}).scalar()
+        if not left:
+            self._set_status(cid, "done", finished=True)
+            log.info("Campaña %d terminada", cid, extra=kv(campaign=cid))
+        if self._tasks.get(cid) is asyncio.current_task():
+            del self._tasks[cid]
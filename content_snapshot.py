@@ -0,0 +1,58 @@
+# ============================================================
+#   SNAPSHOT INMUTABLE DEL CONTENIDO
+#   Respuestas pre-armadas, prompt de IA, reglas compiladas y
+#   versión; se reemplaza entero, nunca se modifica.
+# ============================================================
+
+import hashlib
+from types import MappingProxyType
+
+
+def content_version(*parts) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def freeze(obj):
+    """
+    Copia de solo lectura: dict → MappingProxyType, list → tuple.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+class ContentSnapshot:
+    """
+    Todo lo que el camino caliente necesita del contenido:
+      content        – content.json congelado
+      raw_json       – el mismo contenido serializado (base para el próximo snapshot)
+      matcher        – reglas de intención compiladas
+      menu, welcome  – menú principal y bienvenida
+      intent_answers – respuesta por intención (answer_for_intent)
+      system_prompt  – prompt de la IA
+      version        – hash de prompt + contenido
+    """
+
+    __slots__ = ("version", "content", "raw_json", "matcher", "menu", "welcome",
+                 "intent_answers", "system_prompt")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            value = fields.pop(name)
+            if isinstance(value, dict):
+                value = MappingProxyType(dict(value))
+            object.__setattr__(self, name, value)
+        if fields:
+            raise TypeError(f"Campos desconocidos: {', '.join(fields)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ContentSnapshot es inmutable: publicar uno nuevo")
+
+    def __delattr__(self, name):
+        raise AttributeError("ContentSnapshot es inmutable")
@@ -0,0 +1,165 @@
+# ============================================================
+#   content.json: VALIDACIÓN + RECARGA EN CALIENTE
+#   Esquema mínimo de lo que el bot usa y un watcher del archivo
+#   (inotify vía watchfiles si está instalado; si no, mtime)
+# ============================================================
+
+import asyncio
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+# inotify solo si el paquete "watchfiles" está instalado
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+
+class ContentError(ValueError):
+    """content.json no existe, no es JSON o no cumple el esquema."""
+
+
+def _str_list(value, where: str, errors: list, allow_empty: bool = True):
+    if not isinstance(value, list):
+        errors.append(f"{where}: debe ser una lista")
+        return
+    for i, item in enumerate(value):
+        if not isinstance(item, str) or not (allow_empty or item.strip()):
+            errors.append(f"{where}[{i}]: debe ser un texto no vacío")
+
+
+def validate_content(content) -> list:
+    """
+    Devuelve la lista de errores (vacía si el contenido es válido).
+    Claves desconocidas se permiten; las conocidas deben tener el tipo esperado.
+    """
+    if not isinstance(content, dict):
+        return ["la raíz debe ser un objeto"]
+    errors = []
+
+    org = content.get("org", {})
+    if not isinstance(org, dict):
+        errors.append("org: debe ser un objeto")
+    else:
+        for k, v in org.items():
+            if not isinstance(v, str):
+                errors.append(f"org.{k}: debe ser un texto")
+
+    catalog = content.get("catalog", {})
+    if not isinstance(catalog, dict):
+        errors.append("catalog: debe ser un objeto")
+    else:
+        for k in ("COURSES", "LEVELS", "ENROLL_STEPS"):
+            if k in catalog:
+                _str_list(catalog[k], f"catalog.{k}", errors, allow_empty=False)
+
+    faq = content.get("faq", {})
+    if not isinstance(faq, dict):
+        errors.append("faq: debe ser un objeto")
+    else:
+        for k, v in faq.items():
+            if not isinstance(v, str) or not v.strip():
+                errors.append(f"faq.{k}: debe ser un texto no vacío")
+
+    rules = content.get("rules", {})
+    if not isinstance(rules, dict):
+        errors.append("rules: debe ser un objeto")
+    else:
+        for k, v in rules.items():
+            _str_list(v, f"rules.{k}", errors, allow_empty=False)
+
+    return errors
+
+
+def read_content(path: str):
+    """
+    (content, raw) de un content.json válido; si no, ContentError.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read()
+    except OSError as e:
+        raise ContentError(f"no se pudo leer {path}: {e.strerror or e}") from e
+    try:
+        content = json.loads(raw)
+    except ValueError as e:
+        raise ContentError(f"JSON inválido: {e}") from e
+    errors = validate_content(content)
+    if errors:
+        raise ContentError("; ".join(errors[:10]) + (f" (+{len(errors) - 10})" if len(errors) > 10 else ""))
+    return content, raw
+
+
+class FileWatcher:
+    """
+    Llama a `await on_change()` cuando el archivo cambia.
+    Con watchfiles se vigila el directorio (sirve para editores que
+    guardan con rename); sin él se compara mtime/tamaño/inode cada
+    `interval` segundos. `debounce` espera a que termine la escritura.
+    """
+
+    def __init__(self, path: str, on_change, interval: float = 2.0, debounce: float = 0.2):
+        self.path      = os.path.abspath(path)
+        self.on_change = on_change
+        self.interval  = interval
+        self.debounce  = debounce
+        self.changes   = 0
+        self._task     = None
+        self._stop     = None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if watchfiles is not None else "poll"
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stop = asyncio.Event()
+            loop = self._inotify_loop if watchfiles is not None else self._poll_loop
+            self._task = asyncio.create_task(loop(), name="content-watcher")
+            log.info("Vigilando %s (%s)", self.path, self.mode)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    async def _fire(self):
+        self.changes += 1
+        try:
+            await self.on_change()
+        except Exception as e:
+            log.exception("Error recargando %s: %s", self.path, e)
+
+    async def _poll_loop(self):
+        last = self._stamp()
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._stamp() == last:
+                continue
+            await asyncio.sleep(self.debounce)
+            last = self._stamp()
+            await self._fire()
+
+    def _is_target(self, _change, path: str) -> bool:
+        return os.path.abspath(path) == self.path
+
+    async def _inotify_loop(self):
+        # Solo la carpeta (sin subcarpetas) y solo este archivo: escribir
+        # db.sqlite3-wal o media/ no despierta al watcher
+        folder = os.path.dirname(self.path) or "."
+        async for _ in watchfiles.awatch(folder, watch_filter=self._is_target, recursive=False,
+                                         debounce=int(self.debounce * 1000), stop_event=self._stop):
+            await self._fire()
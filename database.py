@@ -0,0 +1,166 @@
+# ============================================================
+#   BASE DE DATOS – engine, sesiones y modelos SQLAlchemy
+# ============================================================
+
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, func, Boolean, Float
+from sqlalchemy.orm import sessionmaker, declarative_base
+
+from migrations import run_migrations
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./db.sqlite3")
+
+# WAL: los lectores (exports CSV) no bloquean al webhook que escribe
+SQLITE_JOURNAL_MODE    = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS     = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# INCREMENTAL: el job de mantenimiento devuelve al disco las páginas libres.
+# Una base creada antes se convierte a mano: python maintenance.py convert-vacuum
+SQLITE_AUTO_VACUUM     = os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL").upper()
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    # Primero: pasar a WAL toma un lock y otro worker puede estar arrancando
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    # Solo tiene efecto en una base nueva (o tras un VACUUM completo)
+    cur.execute(f"PRAGMA auto_vacuum={SQLITE_AUTO_VACUUM}")
+    cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.close()
+
+SessionLocal = sessionmaker(bind=engine)
+Base = declarative_base()
+
+class Lead(Base):
+    __tablename__ = "leads"
+    id           = Column(Integer, primary_key=True)
+    wa_from      = Column(String(32))
+    name         = Column(String(128))
+    intent       = Column(String(64))
+    last_message = Column(Text)
+    # default además de server_default: en bases migradas la columna
+    # se agregó con ALTER TABLE, sin DEFAULT
+    created_at   = Column(DateTime, default=func.now(), server_default=func.now())
+
+class SessionState(Base):
+    __tablename__ = "sessions"
+    wa_from    = Column(String(32), primary_key=True)
+    state      = Column(String(64))
+    data       = Column(Text)
+    # última escritura: el mantenimiento borra las sesiones inactivas
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now())
+
+# Leads viejos resumidos por día e intención (las filas crudas se borran)
+class LeadDailyStat(Base):
+    __tablename__ = "lead_daily_stats"
+    date          = Column(String(10), primary_key=True)   # YYYY-MM-DD (UTC)
+    intent        = Column(String(64), primary_key=True)
+    count         = Column(Integer, nullable=False, default=0)
+    unique_phones = Column(Integer, nullable=False, default=0)
+
+# Contactos de los leads resumidos: la audiencia de campañas no se achica
+# al borrar leads viejos (un registro por wa_from e intención)
+class LeadContact(Base):
+    __tablename__ = "lead_contacts"
+    wa_from  = Column(String(32), primary_key=True)
+    intent   = Column(String(64), primary_key=True)
+    name     = Column(String(128))
+    first_at = Column(DateTime)     # primer y último lead de esa intención
+    last_at  = Column(DateTime)
+
+# Agregados del panel (/admin/stats): un contador por día, métrica y clave
+class DailyStat(Base):
+    __tablename__ = "daily_stats"
+    date   = Column(String(10), primary_key=True)    # YYYY-MM-DD (UTC)
+    metric = Column(String(32), primary_key=True)    # intent | funnel | ai | confirm_seconds
+    key    = Column(String(64), primary_key=True)
+    value  = Column(Integer, nullable=False, default=0)
+
+class Enrollment(Base):
+    __tablename__ = "enrollments"
+    id            = Column(Integer, primary_key=True)
+    wa_from       = Column(String(32))
+    name          = Column(String(128))
+    ci            = Column(String(32))
+    course        = Column(String(64))
+    level         = Column(String(16))
+    schedule_pref = Column(String(64))
+    ci_image_url  = Column(Text)
+    confirmed     = Column(Boolean, default=False)
+    created_at    = Column(DateTime, server_default=func.now())
+
+class ProcessedMessage(Base):
+    __tablename__ = "processed_messages"
+    message_id   = Column(String(128), primary_key=True)
+    processed_at = Column(DateTime, server_default=func.now(), index=True)
+
+class AiAnswer(Base):
+    __tablename__ = "ai_answers"
+    key        = Column(String(64), primary_key=True)
+    version    = Column(String(64), index=True)
+    answer     = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+
+# Contenido publicado (compartido entre workers): una sola fila, id = 1
+class ContentState(Base):
+    __tablename__ = "content_state"
+    id             = Column(Integer, primary_key=True)
+    revision       = Column(Integer, nullable=False, default=0)
+    content        = Column(Text)
+    source_version = Column(String(32))   # versión del content.json de origen
+    updated_at     = Column(DateTime, server_default=func.now())
+
+# Dueño temporal de cada conversación (uvicorn --workers N)
+class SessionLock(Base):
+    __tablename__ = "session_locks"
+    wa_from    = Column(String(32), primary_key=True)
+    owner      = Column(String(64), default="")   # "" = libre
+    expires_at = Column(Float, default=0)         # time.time()
+    writer     = Column(String(64))               # último worker que la tuvo
+
+# Campañas masivas: una fila por campaña y una por destinatario (checkpoint)
+class Campaign(Base):
+    __tablename__ = "campaigns"
+    id          = Column(Integer, primary_key=True)
+    name        = Column(String(128))
+    kind        = Column(String(16))      # "text" | "template"
+    body        = Column(Text)            # texto o JSON del template
+    filters     = Column(Text)            # JSON con intents / since / until
+    status      = Column(String(16), default="pending")  # pending|running|paused|done
+    total       = Column(Integer, default=0)
+    created_at  = Column(DateTime, server_default=func.now())
+    started_at  = Column(DateTime)
+    finished_at = Column(DateTime)
+
+class CampaignDelivery(Base):
+    __tablename__ = "campaign_deliveries"
+    campaign_id = Column(Integer, primary_key=True)
+    wa_from     = Column(String(32), primary_key=True)
+    status      = Column(String(16), default="pending")   # pending|sending|sent|failed
+    claim       = Column(String(96))      # lote que la tomó (status = sending)
+    claimed_at  = Column(Float)           # time.time(); vence y vuelve a pending
+    attempts    = Column(Integer, default=0)
+    message_id  = Column(String(128))
+    error       = Column(Text)
+    sent_at     = Column(DateTime)
+
+# Fotos recibidas por WhatsApp: se descargan en segundo plano
+class MediaFile(Base):
+    __tablename__ = "media_files"
+    media_id   = Column(String(128), primary_key=True)
+    wa_from    = Column(String(32))
+    mime_type  = Column(String(64))
+    status     = Column(String(16), default="pending")   # pending|stored|failed
+    sha256     = Column(String(64))      # contenido: mismo hash = mismo archivo
+    path       = Column(Text)
+    size       = Column(Integer)
+    attempts   = Column(Integer, default=0)
+    error      = Column(Text)
+    created_at = Column(DateTime, server_default=func.now())
+    stored_at  = Column(DateTime)
+
+# Un solo proceso crea/migra a la vez; el resto espera y no repite pasos
+run_migrations(engine, Base.metadata)
@@ -0,0 +1,141 @@
+# ============================================================
+#   DE-DUPLICACIÓN DE MENSAJES ENTRANTES (idempotencia)
+#   Meta reenvía el webhook si tardamos: cada msg["id"] se
+#   procesa una sola vez.
+# ============================================================
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, ProcessedMessage
+
+log = logging.getLogger(__name__)
+
+
+class TTLSet:
+    """
+    Conjunto acotado en memoria: expulsa por LRU al llenarse
+    y olvida claves más viejas que ttl segundos.
+    """
+
+    def __init__(self, max_size: int = 50000, ttl: float = 86400):
+        self.max_size = max_size
+        self.ttl      = ttl
+        self._items   = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        ts = self._items.get(key)
+        if ts is None:
+            return False
+        if time.monotonic() - ts > self.ttl:
+            del self._items[key]
+            return False
+        self._items.move_to_end(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def add(self, key):
+        self._items[key] = time.monotonic()
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class MessageDeduper:
+    """
+    Caché LRU/TTL en memoria delante de la tabla processed_messages.
+    claim() registra el id y devuelve False si ya se había visto; si el
+    procesamiento falla, release() lo olvida para que el reintento de
+    Meta no se descarte como duplicado. La escritura va en un hilo.
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl: float = 86400,
+                 max_size: int = 50000, prune_every: int = 1000):
+        self.session_factory = session_factory
+        self.ttl             = ttl
+        self.prune_every     = prune_every
+        self.memory          = TTLSet(max_size=max_size, ttl=ttl)
+        self._claims         = 0
+        self.duplicates      = 0
+        self.released        = 0
+
+    async def claim(self, message_id: str) -> bool:
+        if not message_id:
+            return True
+
+        if message_id in self.memory:
+            self.duplicates += 1
+            return False
+        # En memoria antes del await: un reintento simultáneo ya lo ve
+        self.memory.add(message_id)
+
+        self._claims += 1
+        prune = bool(self.prune_every) and self._claims % self.prune_every == 0
+        if not await asyncio.to_thread(self._persist, message_id, prune):
+            self.duplicates += 1
+            return False
+        return True
+
+    async def release(self, message_id: str):
+        if not message_id:
+            return
+        self.memory.discard(message_id)
+        self.released += 1
+        await asyncio.to_thread(self._forget, message_id)
+
+    def _persist(self, message_id: str, prune: bool = False) -> bool:
+        db = self.session_factory()
+        try:
+            db.add(ProcessedMessage(message_id=message_id))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return False
+        except Exception as e:
+            # Si la BD falla, preferimos procesar antes que perder el mensaje
+            db.rollback()
+            log.warning("Dedupe sin persistencia: %s", e)
+        finally:
+            db.close()
+        if prune:
+            self.prune()
+        return True
+
+    def _forget(self, message_id: str):
+        db = self.session_factory()
+        try:
+            (db.query(ProcessedMessage)
+               .filter(ProcessedMessage.message_id == message_id)
+               .delete(synchronize_session=False))
+            db.commit()
+        except Exception as e:
+            # Queda marcado: el reintento se descarta, como antes
+            db.rollback()
+            log.warning("No se pudo liberar el mensaje %s: %s", message_id, e)
+        finally:
+            db.close()
+
+    def prune(self) -> int:
+        """
+        Borra ids más viejos que ttl. Devuelve cuántas filas se eliminaron.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        db = self.session_factory()
+        try:
+            n = (db.query(ProcessedMessage)
+                   .filter(ProcessedMessage.processed_at < cutoff)
+                   .delete(synchronize_session=False))
+            db.commit()
+            return n
+        finally:
+            db.close()
@@ -0,0 +1,86 @@
+# ============================================================
+#   DESPACHADOR POR REMITENTE (lanes por wa_from)
+#   Mismo teléfono → en orden; teléfonos distintos → en paralelo
+# ============================================================
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+
+def iter_messages(payload: dict):
+    """
+    Recorre todos los entry/changes/messages de un payload.
+    Devuelve tuplas (value, msg).
+    """
+    for entry in payload.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            for msg in value.get("messages", []) or []:
+                yield value, msg
+
+
+class LaneDispatcher:
+    """
+    Cada wa_from tiene su propio lock (FIFO), así los mensajes de un
+    mismo teléfono se procesan en orden aunque lleguen en payloads
+    distintos. Un semáforo global limita los mensajes en curso.
+    """
+
+    def __init__(self, max_concurrency: int = 32):
+        self.max_concurrency = max_concurrency
+        self._sem   = None
+        self._lanes = {}   # wa_from -> [lock, usuarios]
+        self.in_flight = 0
+
+    @property
+    def sem(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    @property
+    def active_lanes(self) -> int:
+        return len(self._lanes)
+
+    async def dispatch(self, payload: dict, handler) -> list:
+        """
+        handler(value, msg) es una corrutina. Devuelve la lista de
+        resultados en el orden original de los mensajes (o la excepción).
+        """
+        lanes = OrderedDict()
+        total = 0
+        for value, msg in iter_messages(payload):
+            lanes.setdefault(msg.get("from"), []).append((total, value, msg))
+            total += 1
+
+        results = [None] * total
+        await asyncio.gather(*(
+            self._run_lane(wa_from, items, handler, results)
+            for wa_from, items in lanes.items()
+        ))
+        return results
+
+    async def _run_lane(self, wa_from, items, handler, results):
+        lane = self._lanes.setdefault(wa_from, [asyncio.Lock(), 0])
+        lane[1] += 1
+        try:
+            async with lane[0]:
+                for idx, value, msg in items:
+                    async with self.sem:
+                        self.in_flight += 1
+                        try:
+                            results[idx] = await handler(value, msg)
+                        except Exception as e:
+                            log.exception("Error procesando mensaje: %s", e, extra=kv(wa_from=wa_from))
+                            results[idx] = e
+                        finally:
+                            self.in_flight -= 1
+        finally:
+            lane[1] -= 1
+            if lane[1] == 0:
+                self._lanes.pop(wa_from, None)
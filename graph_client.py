@@ -0,0 +1,84 @@
+# ============================================================
+#   CLIENTE ASÍNCRONO – WhatsApp Graph API
+#   Conexiones keep-alive compartidas, HTTP/2 si está disponible
+# ============================================================
+
+import logging
+import os
+import httpx
+
+log = logging.getLogger(__name__)
+
+GRAPH_BASE_URL        = os.getenv("GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_API_VERSION     = os.getenv("GRAPH_API_VERSION", "v20.0")
+GRAPH_TIMEOUT         = float(os.getenv("GRAPH_TIMEOUT", "10"))
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "50"))
+GRAPH_MAX_KEEPALIVE   = int(os.getenv("GRAPH_MAX_KEEPALIVE", "20"))
+
+# HTTP/2 solo si el paquete "h2" está instalado (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class GraphClient:
+    """
+    Cliente único para la Graph API.
+    URL y headers se arman una sola vez; el pool de conexiones
+    se crea al primer uso dentro del event loop y se reutiliza.
+    """
+
+    def __init__(self, token: str, phone_number_id: str,
+                 base_url: str = GRAPH_BASE_URL, version: str = GRAPH_API_VERSION,
+                 timeout: float = GRAPH_TIMEOUT, http2: bool = HTTP2_AVAILABLE):
+        self.base_url     = f"{base_url.rstrip('/')}/{version}"
+        self.messages_url = f"{self.base_url}/{phone_number_id}/messages"
+        self.headers      = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        self.timeout      = httpx.Timeout(timeout, connect=min(GRAPH_CONNECT_TIMEOUT, timeout))
+        self.http2        = http2
+        self._client      = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=GRAPH_MAX_CONNECTIONS,
+                    max_keepalive_connections=GRAPH_MAX_KEEPALIVE,
+                ),
+            )
+        return self._client
+
+    async def post(self, url: str, payload: dict, timeout: float = None) -> httpx.Response:
+        kwargs = {"json": payload}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return await self.client.post(url, **kwargs)
+
+    async def media_info(self, media_id: str) -> httpx.Response:
+        """
+        GET /{MEDIA_ID}: URL temporal de descarga (vence en minutos),
+        mime_type, sha256 y file_size.
+        """
+        return await self.client.get(f"{self.base_url}/{media_id}")
+
+    def stream(self, url: str, timeout: float = None):
+        """
+        GET en streaming (async with): el cuerpo se lee por partes.
+        La URL de descarga de Meta también pide el token.
+        """
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return self.client.stream("GET", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,323 @@
+# ============================================================
+#   AUTÓMATA DE PALABRAS CLAVE (Aho-Corasick) PARA INTENCIONES
+#   Una sola pasada por el texto, sin importar cuántas reglas haya;
+#   después, sin tildes y con tolerancia a errores de tipeo
+#   (índice de n-gramas + distancia de edición)
+# ============================================================
+
+import re
+import unicodedata
+from collections import deque
+
+_NONE = float("inf")
+
+# Con pocas palabras, "p in t" (en C) le gana al recorrido en Python
+# del autómata; por debajo de este umbral se usa un escaneo lineal
+# sobre tuplas precompiladas.
+LINEAR_MAX_KEYWORDS = 192
+
+
+class KeywordAutomaton:
+    """
+    groups = [(intent, [palabras...]), ...] en orden de prioridad.
+    match(texto) devuelve la primera intención (en ese orden) que tenga
+    alguna palabra contenida en el texto — igual que
+    any(p in t for p in palabras) recorriendo las reglas en orden.
+    """
+
+    __slots__ = ("labels", "keywords", "_linear", "_goto", "_fail", "_best")
+
+    def __init__(self, groups, linear_max: int = LINEAR_MAX_KEYWORDS):
+        groups = [(label, tuple(palabras)) for label, palabras in groups]
+        self.labels   = [label for label, _ in groups]
+        self.keywords = sum(len(palabras) for _, palabras in groups)
+        self._linear  = tuple(groups) if self.keywords <= linear_max else None
+        self._goto    = self._fail = self._best = None
+        if self._linear is None:
+            self._build(groups)
+
+    def _build(self, groups):
+        goto = [{}]
+        best = [_NONE]
+
+        for prio, (label, palabras) in enumerate(groups):
+            for p in palabras:
+                s = 0
+                for ch in p:
+                    nxt = goto[s].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[s][ch] = nxt
+                        goto.append({})
+                        best.append(_NONE)
+                    s = nxt
+                if prio < best[s]:
+                    best[s] = prio
+
+        # Enlaces de fallo por BFS; cada estado hereda la mejor prioridad
+        # de su sufijo, así no hace falta recorrer la cadena al buscar.
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, t in goto[s].items():
+                queue.append(t)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[t] = goto[f].get(ch, 0)
+                if best[fail[t]] < best[t]:
+                    best[t] = best[fail[t]]
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def match(self, text: str):
+        if self._linear is not None:
+            for label, palabras in self._linear:
+                for p in palabras:
+                    if p in text:
+                        return label
+            return None
+
+        goto, fail, best = self._goto, self._fail, self._best
+        b = best[0]
+        if b == 0:
+            return self.labels[0]
+
+        s = 0
+        for ch in text:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if best[s] < b:
+                b = best[s]
+                if b == 0:
+                    break
+
+        return self.labels[b] if b != _NONE else None
+
+
+def compile_intent_rules(*rule_sets) -> KeywordAutomaton:
+    """
+    Une varios dicts {intent: [palabras]} respetando el orden:
+    primero todas las reglas del primer dict, luego las del segundo, etc.
+    """
+    groups = []
+    for rules in rule_sets:
+        for intent, palabras in (rules or {}).items():
+            groups.append((intent, list(palabras or [])))
+    return KeywordAutomaton(groups)
+
+
+# ---------------- sin tildes / con errores de tipeo ----------------
+_WORD = re.compile(r"[^\W\d_]+")
+
+
+def fold(text: str) -> str:
+    """
+    "Dirección ÚNICA" → "direccion unica": minúsculas y sin tildes (ñ → n).
+    """
+    t = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in t if not unicodedata.combining(ch))
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein (transposición de vecinas = 1 edición).
+    Corta apenas se pasa de `limit` y devuelve limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, prev2[j - 2] + 1)
+            cur[j] = d
+        # la transposición mira dos filas atrás: cortar solo si ninguna baja
+        if min(cur) > limit and min(prev) >= limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+# Palabras comunes a una edición de alguna clave ("blanco" ~ banco,
+# "cuento" ~ cuenta, "llevar" ~ llegar): nunca entran por fuzzy.
+# Van sin tildes, como quedan después de fold().
+COMMON_WORDS = frozenset("""
+    blanco blanca blancos barco bando clave claves corre correr correa
+    contado cuento cuentos cuente dando idiota idiotas llevar
+    llenar materia materias metido premio premios puesta sedes cuenca
+""".split())
+
+# Claves de hasta este largo: en fuzzy, la primera letra tiene que coincidir
+SHORT_KEYWORD = 6
+
+_VOWELS = frozenset("aeiou")
+_ENDING = _VOWELS | {"s"}
+
+
+def inflected(token: str, word: str) -> bool:
+    """
+    True si token y word solo difieren en la terminación de género/número
+    (hasta tres letras entre vocales y s: "cuesto"/"cuesta",
+    "precisos"/"precios", "contacte"/"contacto") o en una sola vocal
+    ("cuanta"/"cuenta"): en castellano eso es otra palabra u otra forma,
+    no un error de tipeo ("efectibo", "telefonno" sí lo son).
+    """
+    p = 0
+    while p < len(token) and p < len(word) and token[p] == word[p]:
+        p += 1
+    rest_t, rest_w = token[p:], word[p:]
+    if (rest_t and rest_w and len(rest_t) <= 3 and len(rest_w) <= 3
+            and _ENDING.issuperset(rest_t + rest_w)):
+        return True
+    return (len(token) == len(word) and rest_t[:1] in _VOWELS and rest_w[:1] in _VOWELS
+            and rest_t[1:] == rest_w[1:])
+
+
+def _grams(word: str, n: int):
+    w = f"#{word}#"
+    return {w[i:i + n] for i in range(max(1, len(w) - n + 1))}
+
+
+class FuzzyIndex:
+    """
+    Palabras clave (sin tildes) indexadas por n-gramas de caracteres:
+    una palabra del mensaje solo se compara, con distancia de edición,
+    contra las claves que comparten algún n-grama y tienen un largo
+    parecido. Las claves de varias palabras no entran (solo exactas).
+    """
+
+    __slots__ = ("n", "words", "grams")
+
+    def __init__(self, groups, n: int = 3):
+        self.n     = n
+        self.words = []    # (palabra, intent, prioridad)
+        self.grams = {}    # n-grama -> [índices en words]
+        seen = set()
+        for prio, (label, palabras) in enumerate(groups):
+            for p in palabras:
+                w = fold(p).strip()
+                if not w or w in seen or not _WORD.fullmatch(w):
+                    continue
+                seen.add(w)
+                for g in _grams(w, n):
+                    self.grams.setdefault(g, []).append(len(self.words))
+                self.words.append((w, label, prio))
+
+    def lookup(self, token: str, min_score: float, max_edits: int):
+        """
+        (intent, prioridad, score) de la clave más parecida, o None.
+        score = 1 - ediciones / largo de la más larga.
+        """
+        candidates = set()
+        for g in _grams(token, self.n):
+            candidates.update(self.grams.get(g, ()))
+        best = None
+        for i in candidates:
+            word, label, prio = self.words[i]
+            if len(word) <= SHORT_KEYWORD and word[0] != token[0]:
+                continue
+            longest = max(len(word), len(token))
+            limit = min(max_edits, int(longest * (1 - min_score)))
+            if limit < 1:
+                continue
+            d = edit_distance(token, word, limit)
+            if d > limit or inflected(token, word):
+                continue
+            score = 1 - d / longest
+            if best is None or (score, -prio) > (best[2], -best[1]):
+                best = (label, prio, score)
+        return best
+
+
+class IntentMatcher:
+    """
+    Etapas en orden; la primera que encuentra gana:
+      exact  – clave contenida en el texto en minúsculas (como siempre)
+      folded – lo mismo sin tildes: "direccion" = "dirección"
+      fuzzy  – palabra del mensaje parecida a una clave: "presio", "orario"
+               (salvo las de stop_words, palabras comunes que se parecen,
+               y las que solo cambian terminación o una vocal: inflected)
+    El texto se pliega y se separa en palabras una sola vez; el
+    resultado fuzzy por palabra queda en una caché chica.
+    """
+
+    __slots__ = ("exact", "folded", "index", "fuzzy", "min_score", "min_len",
+                 "max_edits", "stop_words", "cache_size", "_cache")
+
+    def __init__(self, groups, fuzzy: bool = True, min_score: float = 0.8,
+                 min_len: int = 5, max_edits: int = 2, stop_words=COMMON_WORDS,
+                 cache_size: int = 4096):
+        groups = [(label, tuple(palabras)) for label, palabras in groups]
+        self.exact      = KeywordAutomaton(groups)
+        self.folded     = KeywordAutomaton([(label, tuple(fold(p) for p in palabras))
+                                            for label, palabras in groups])
+        self.index      = FuzzyIndex(groups) if fuzzy else None
+        self.fuzzy      = fuzzy
+        self.min_score  = min_score
+        self.min_len    = min_len
+        self.max_edits  = max_edits
+        self.stop_words = frozenset(fold(w) for w in stop_words)
+        self.cache_size = cache_size
+        self._cache     = {}
+
+    @property
+    def labels(self):
+        return self.exact.labels
+
+    @property
+    def keywords(self) -> int:
+        return self.exact.keywords
+
+    def match(self, text: str):
+        return self.classify(text)[0]
+
+    def classify(self, text: str):
+        """
+        (intent, etapa, score) — (None, None, 0.0) si nada coincide.
+        `text` ya en minúsculas, como lo usa _detect_intent.
+        """
+        label = self.exact.match(text)
+        if label is not None:
+            return label, "exact", 1.0
+
+        folded = fold(text)
+        label = self.folded.match(folded)
+        if label is not None:
+            return label, "folded", 1.0
+
+        if self.index is None:
+            return None, None, 0.0
+        best = None
+        for token in _WORD.findall(folded):
+            if len(token) < self.min_len or token in self.stop_words:
+                continue
+            hit = self._cache.get(token, False)
+            if hit is False:
+                hit = self.index.lookup(token, self.min_score, self.max_edits)
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+                self._cache[token] = hit
+            if hit is not None and (best is None or (hit[2], -hit[1]) > (best[2], -best[1])):
+                best = hit
+        if best is None:
+            return None, None, 0.0
+        return best[0], "fuzzy", round(best[2], 3)
+
+
+def compile_intent_matcher(*rule_sets, **options) -> IntentMatcher:
+    """
+    Como compile_intent_rules, con las etapas sin tildes y fuzzy.
+    options: fuzzy, min_score, min_len, max_edits, stop_words (ver IntentMatcher).
+    """
+    groups = []
+    for rules in rule_sets:
+        for intent, palabras in (rules or {}).items():
+            groups.append((intent, list(palabras or [])))
+    return IntentMatcher(groups, **options)
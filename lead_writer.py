@@ -0,0 +1,88 @@
+# ============================================================
+#   ESCRITURA AGRUPADA DE LEADS (group commit)
+#   Un INSERT executemany cada N filas o cada M milisegundos
+# ============================================================
+
+import asyncio
+import logging
+import threading
+
+from database import engine, Lead
+
+log = logging.getLogger(__name__)
+
+
+class LeadWriter:
+    """
+    add() solo agrega al buffer. Un task de fondo escribe el lote
+    cuando llega a batch_size filas o pasan flush_ms milisegundos.
+    stop() hace el último flush (apagado limpio).
+    """
+
+    def __init__(self, batch_size: int = 100, flush_ms: int = 200, bind=engine):
+        self.batch_size = batch_size
+        self.flush_ms   = flush_ms
+        self.bind       = bind
+        self._buffer    = []
+        self._lock      = threading.Lock()
+        self._wakeup    = None
+        self._task      = None
+        self.written    = 0
+        self.batches    = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def add(self, wa_from: str, name: str, intent: str, last_message: str):
+        with self._lock:
+            self._buffer.append({
+                "wa_from": wa_from, "name": name,
+                "intent": intent, "last_message": last_message,
+            })
+            full = len(self._buffer) >= self.batch_size
+        if self._task is None:
+            # Sin task de fondo (scripts, tests): escritura directa
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(Lead.__table__.insert(), rows)
+        except Exception:
+            with self._lock:
+                self._buffer[:0] = rows
+            raise
+        self.written += len(rows)
+        self.batches += 1
+        return len(rows)
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="lead-writer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                log.error("Error guardando leads: %s", e)
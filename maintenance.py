@@ -0,0 +1,247 @@
+# ============================================================
+#   MANTENIMIENTO DE LA BASE (jobs periódicos en segundo plano)
+#   Sesiones inactivas, resumen diario de leads viejos, borrado
+#   de filas vencidas y VACUUM incremental: la base queda chica
+#   y las tablas calientes entran en la caché de páginas
+# ============================================================
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from database import engine
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+
+def _ts(dt: datetime) -> str:
+    # Mismo formato que CURRENT_TIMESTAMP (func.now() en SQLite)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def expire_sessions(idle_seconds: float, bind=engine) -> dict:
+    """
+    Borra las sesiones sin escrituras hace más de idle_seconds (incluye
+    inscripciones abandonadas a mitad: vuelven a "idle" al escribir).
+    También los session_locks libres o vencidos de esas conversaciones;
+    idle_seconds debe ser mayor que SESSION_CACHE_TTL para que una copia
+    en memoria nunca sobreviva a su fila.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=idle_seconds)
+    with bind.begin() as conn:
+        sessions = conn.execute(
+            text("DELETE FROM sessions WHERE updated_at < :cutoff"), {"cutoff": _ts(cutoff)}
+        ).rowcount
+        locks = conn.execute(
+            text("DELETE FROM session_locks WHERE expires_at < :cutoff"),
+            {"cutoff": time.time() - idle_seconds},
+        ).rowcount
+    return {"sessions": sessions, "session_locks": locks}
+
+
+def rollup_leads(retention_days: int, bind=engine) -> dict:
+    """
+    Pasa a lead_daily_stats los leads de días completos más viejos que
+    retention_days y borra esas filas; antes guarda cada wa_from/intención
+    en lead_contacts (las campañas siguen llegando a esos contactos).
+    Un día por transacción: el lock de escritura se suelta entre días y
+    un corte no deja nada a medias.
+    Leads sin created_at (anteriores a la migración 2) se dejan.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).date()
+    days = rows = 0
+    while True:
+        with bind.begin() as conn:
+            first = conn.execute(
+                text("SELECT MIN(created_at) FROM leads WHERE created_at IS NOT NULL")
+            ).scalar()
+            if first is None:
+                break
+            day = date.fromisoformat(str(first)[:10])
+            if day >= cutoff:
+                break
+            params = {"d": day.isoformat(), "d0": day.isoformat(),
+                      "d1": (day + timedelta(days=1)).isoformat()}
+            # Un día ya resumido solo recibe filas nuevas si el reloj retrocedió:
+            # se suman (unique_phones queda como cota superior)
+            conn.execute(text(
+                "INSERT INTO lead_daily_stats (date, intent, count, unique_phones)"
+                " SELECT :d, COALESCE(intent, ''), COUNT(*), COUNT(DISTINCT wa_from)"
+                " FROM leads WHERE created_at >= :d0 AND created_at < :d1"
+                " GROUP BY COALESCE(intent, '')"
+                " ON CONFLICT (date, intent) DO UPDATE SET"
+                " count = count + excluded.count,"
+                " unique_phones = unique_phones + excluded.unique_phones"
+            ), params)
+            conn.execute(text(
+                "INSERT INTO lead_contacts (wa_from, intent, name, first_at, last_at)"
+                " SELECT wa_from, COALESCE(intent, ''), MAX(name), MIN(created_at), MAX(created_at)"
+                " FROM leads WHERE created_at >= :d0 AND created_at < :d1"
+                " AND wa_from IS NOT NULL AND wa_from != ''"
+                " GROUP BY wa_from, COALESCE(intent, '')"
+                " ON CONFLICT (wa_from, intent) DO UPDATE SET"
+                " name = COALESCE(NULLIF(excluded.name, ''), lead_contacts.name),"
+                " first_at = MIN(lead_contacts.first_at, excluded.first_at),"
+                " last_at = MAX(lead_contacts.last_at, excluded.last_at)"
+            ), params)
+            rows += conn.execute(
+                text("DELETE FROM leads WHERE created_at >= :d0 AND created_at < :d1"), params
+            ).rowcount
+            days += 1
+    return {"days": days, "leads": rows}
+
+
+def incremental_vacuum(max_pages: int = 0, bind=engine) -> dict:
+    """
+    Devuelve al disco hasta max_pages páginas libres (0 = todas) con
+    PRAGMA incremental_vacuum: solo toca las páginas del final del
+    archivo, no reescribe la base. Sin auto_vacuum=INCREMENTAL no hace
+    nada: la conversión es aparte (convert_auto_vacuum, con el bot parado).
+    """
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        def pragma(sql):
+            return conn.exec_driver_sql(sql).scalar()
+
+        if pragma("PRAGMA auto_vacuum") != 2:
+            return {"auto_vacuum": "none", "freed_pages": 0,
+                    "hint": "python maintenance.py convert-vacuum (con el bot parado)"}
+        free = pragma("PRAGMA freelist_count")
+        conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        return {
+            "auto_vacuum": "incremental",
+            "freed_pages": free - pragma("PRAGMA freelist_count"),
+            "pages": pragma("PRAGMA page_count"),
+            "page_size": pragma("PRAGMA page_size"),
+        }
+
+
+def convert_auto_vacuum(bind=engine) -> dict:
+    """
+    Pasa una base existente a auto_vacuum=INCREMENTAL. Necesita un VACUUM
+    completo: reescribe el archivo con el lock de escritura tomado todo
+    el tiempo, así que es un paso manual (ver __main__), no un job.
+    """
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        def pragma(sql):
+            return conn.exec_driver_sql(sql).scalar()
+
+        before = pragma("PRAGMA page_count")
+        if pragma("PRAGMA auto_vacuum") == 2:
+            return {"converted": False, "pages": before}
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        return {"converted": pragma("PRAGMA auto_vacuum") == 2,
+                "pages_before": before, "pages": pragma("PRAGMA page_count")}
+
+
+class MaintenanceJob:
+    __slots__ = ("name", "fn", "interval", "next_run", "runs", "last_run",
+                 "last_seconds", "last_result", "last_error")
+
+    def __init__(self, name: str, fn, interval: float):
+        self.name         = name
+        self.fn           = fn
+        self.interval     = interval
+        self.next_run     = 0.0
+        self.runs         = 0
+        self.last_run     = None
+        self.last_seconds = None
+        self.last_result  = None
+        self.last_error   = None
+
+    def status(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "last_seconds": self.last_seconds,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "next_in": max(0, round(self.next_run - time.monotonic())),
+        }
+
+
+class MaintenanceScheduler:
+    """
+    add(nombre, fn, intervalo): fn es síncrona y corre en un hilo.
+    Los jobs van de a uno (no compiten por el lock de escritura); el
+    primer turno se sortea dentro de `tick` para que varios workers
+    no arranquen juntos. Todos los jobs son idempotentes.
+    """
+
+    def __init__(self, tick: float = 60):
+        self.tick  = tick
+        self.jobs  = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def add(self, name: str, fn, interval: float):
+        self.jobs[name] = MaintenanceJob(name, fn, interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            now = time.monotonic()
+            for job in self.jobs.values():
+                job.next_run = now + random.uniform(0, self.tick)
+            self._task = asyncio.create_task(self._loop(), name="maintenance")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> dict:
+        return {name: job.status() for name, job in self.jobs.items()}
+
+    async def run(self, name: str):
+        """
+        Corre un job ahora (KeyError si no existe). Devuelve su resultado.
+        """
+        job = self.jobs[name]
+        async with self._lock:
+            start = time.perf_counter()
+            job.last_run = datetime.utcnow().isoformat(timespec="seconds")
+            try:
+                job.last_result = await asyncio.to_thread(job.fn)
+                job.last_error = None
+            except Exception as e:
+                job.last_error = str(e) or type(e).__name__
+                log.exception("Mantenimiento %s falló: %s", name, e, extra=kv(job=name))
+            finally:
+                job.runs += 1
+                job.last_seconds = round(time.perf_counter() - start, 3)
+                job.next_run = time.monotonic() + job.interval
+        if job.last_error is None:
+            log.info("Mantenimiento %s: %s", name, job.last_result,
+                     extra=kv(job=name, seconds=job.last_seconds))
+        return job.last_result
+
+    async def _loop(self):
+        while True:
+            now = time.monotonic()
+            due = [j for j in self.jobs.values() if j.next_run <= now]
+            for job in due:
+                await self.run(job.name)
+            wake = min((j.next_run for j in self.jobs.values()), default=now + self.tick)
+            await asyncio.sleep(max(1.0, min(self.tick, wake - time.monotonic())))
+
+
+if __name__ == "__main__":
+    # Conversión única de una base vieja, con el bot detenido:
+    #   python maintenance.py convert-vacuum
+    parser = argparse.ArgumentParser(description="Mantenimiento manual de la base")
+    parser.add_argument("action", choices=["convert-vacuum", "vacuum"])
+    args = parser.parse_args()
+    if args.action == "convert-vacuum":
+        result = convert_auto_vacuum()
+    else:
+        result = incremental_vacuum()
+    print(json.dumps(result, ensure_ascii=False))
@@ -0,0 +1,313 @@
+# ============================================================
+#   FOTOS DEL CI – descarga fuera del camino del webhook
+#   media id → URL temporal (Graph) → descarga en streaming con
+#   tope de tamaño → archivo por SHA-256 (un reenvío idéntico se
+#   escribe una sola vez) → ruta en enrollments.ci_image_url
+# ============================================================
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import random
+import uuid
+
+import httpx
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import engine, Enrollment, MediaFile
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+# ci_image_url mientras la descarga no terminó
+MARKER_PREFIX = "media:"
+
+
+class MediaError(Exception):
+    """Descarga fallida. retryable=False: no tiene sentido reintentar."""
+    retryable = False
+
+
+class MediaRetry(MediaError):
+    """429 / 5xx / archivo incompleto: se reintenta con backoff."""
+    retryable = True
+
+
+class MediaTooLarge(MediaError):
+    """El archivo supera max_bytes."""
+
+
+def media_marker(media_id: str) -> str:
+    return MARKER_PREFIX + media_id
+
+
+def ci_image_value(value):
+    """
+    Valor para Enrollment.ci_image_url. Con un marcador "media:<id>" va
+    una subconsulta: la ruta si el archivo ya está guardado, si no el
+    marcador (que la descarga reemplaza al terminar). Al resolverse en
+    el mismo INSERT no hay carrera con la descarga.
+    """
+    if not (isinstance(value, str) and value.startswith(MARKER_PREFIX)):
+        return value
+    stored = (
+        select(MediaFile.path)
+        .where(MediaFile.media_id == value[len(MARKER_PREFIX):], MediaFile.status == "stored")
+        .scalar_subquery()
+    )
+    return func.coalesce(stored, value)
+
+
+def _check(r: httpx.Response, what: str):
+    if r.is_success:
+        return
+    if r.status_code == 429 or r.status_code >= 500:
+        raise MediaRetry(f"{what}: HTTP {r.status_code}")
+    raise MediaError(f"{what}: HTTP {r.status_code}")
+
+
+def _close(f, sync: bool):
+    if sync:
+        f.flush()
+        os.fsync(f.fileno())
+    f.close()
+
+
+class MediaStore:
+    """
+    Archivos en root/ab/abcdef...ext (ab = inicio del SHA-256).
+    Se escribe en root/tmp y se renombra al final: nunca queda un
+    archivo a medias con el nombre definitivo.
+    """
+
+    def __init__(self, root: str = "media", max_bytes: int = 10 * 1024 * 1024,
+                 chunk_size: int = 64 * 1024):
+        self.root       = root
+        self.max_bytes  = max_bytes
+        self.chunk_size = chunk_size
+
+    def path_for(self, sha256: str, ext: str = "") -> str:
+        return os.path.join(self.root, sha256[:2], sha256 + ext)
+
+    async def save(self, chunks, ext: str = "", expected_sha256: str = None):
+        """
+        Consume `chunks` (async iterator de bytes) sin juntarlo en memoria.
+        Devuelve (sha256, path, size, created); created=False si el archivo
+        ya existía (mismo contenido enviado otra vez).
+        """
+        tmp_dir = os.path.join(self.root, "tmp")
+        await asyncio.to_thread(os.makedirs, tmp_dir, exist_ok=True)
+        tmp = os.path.join(tmp_dir, uuid.uuid4().hex + ".part")
+
+        digest, size = hashlib.sha256(), 0
+        f = await asyncio.to_thread(open, tmp, "wb")
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise MediaTooLarge(f"supera {self.max_bytes} bytes")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(_close, f, True)
+            sha256 = digest.hexdigest()
+            if expected_sha256 and expected_sha256.lower() != sha256:
+                raise MediaRetry("sha256 no coincide con el informado por Graph")
+        except BaseException:
+            f.close()
+            await asyncio.to_thread(_remove, tmp)
+            raise
+
+        path = self.path_for(sha256, ext)
+        created = await asyncio.to_thread(self._commit, tmp, path)
+        return sha256, path, size, created
+
+    def _commit(self, tmp: str, path: str) -> bool:
+        if os.path.exists(path):
+            _remove(tmp)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        return True
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class MediaPipeline:
+    """
+    submit() solo encola; workers de fondo resuelven la URL en Graph,
+    descargan y guardan, y la fila de media_files queda stored/failed.
+    Sin workers (scripts) submit() descarga en el momento.
+    Lo que quedó pending (cola llena, apagado) se retoma en start();
+    si dos workers toman el mismo archivo, el SHA-256 evita duplicarlo.
+    """
+
+    def __init__(self, graph, store: MediaStore, workers: int = 2, queue_size: int = 100,
+                 max_retries: int = 3, timeout: float = 60, backoff_base: float = 1.0,
+                 bind=engine):
+        self.graph        = graph
+        self.store        = store
+        self.workers      = workers
+        self.queue_size   = queue_size
+        self.max_retries  = max_retries
+        self.timeout      = timeout
+        self.backoff_base = backoff_base
+        self.bind         = bind
+        self.in_flight    = 0
+        self.stored       = 0
+        self.deduped      = 0
+        self.failed       = 0
+        self._queue       = None
+        self._tasks       = []
+
+    @property
+    def pending(self) -> int:
+        return (self._queue.qsize() if self._queue else 0) + self.in_flight
+
+    # ---------------- ciclo de vida ----------------
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"media-{i}")
+                       for i in range(self.workers)]
+        for media_id, wa_from, mime_type in await asyncio.to_thread(self._unfinished):
+            await self.submit(media_id, wa_from, mime_type)
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, media_id: str, wa_from: str = None, mime_type: str = None) -> bool:
+        """
+        True si quedó en cola (o descargado, sin workers). Siempre queda
+        registrado como pending: con la cola llena, o si se apaga antes de
+        descargarlo, lo retoma el próximo start().
+        """
+        if not self._tasks:
+            try:
+                await self.fetch(media_id, wa_from, mime_type)
+            except MediaError:
+                return False
+            return True
+        # pending antes de encolar: lo que siga en la cola al apagar se retoma en start()
+        await asyncio.to_thread(self._register, media_id, wa_from, mime_type)
+        try:
+            self._queue.put_nowait((media_id, wa_from, mime_type))
+            return True
+        except asyncio.QueueFull:
+            log.warning("Cola de descargas llena; %s queda pendiente", media_id, extra=kv(media=media_id))
+            return False
+
+    async def _worker(self):
+        while True:
+            media_id, wa_from, mime_type = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self.fetch(media_id, wa_from, mime_type)
+            except MediaError:
+                pass
+            except Exception as e:
+                log.exception("Error descargando %s: %s", media_id, e, extra=kv(media=media_id))
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    # ---------------- descarga ----------------
+    async def fetch(self, media_id: str, wa_from: str = None, mime_type: str = None) -> str:
+        """
+        Descarga y guarda un archivo; devuelve su ruta o MediaError.
+        La URL se vuelve a pedir en cada intento (vence en minutos).
+        """
+        await asyncio.to_thread(self._register, media_id, wa_from, mime_type)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                sha256, path, size, created = await self._download(media_id)
+                break
+            except (MediaError, httpx.HTTPError) as e:
+                retry = not isinstance(e, MediaError) or e.retryable
+                if not retry or attempt > self.max_retries:
+                    self.failed += 1
+                    await asyncio.to_thread(self._finish, media_id, attempt, error=str(e) or type(e).__name__)
+                    log.warning("No se pudo descargar %s: %s", media_id, e, extra=kv(media=media_id))
+                    if isinstance(e, MediaError):
+                        raise
+                    raise MediaError(str(e)) from e
+                await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+
+        await asyncio.to_thread(self._finish, media_id, attempt, sha256=sha256, path=path, size=size)
+        if created:
+            self.stored += 1
+        else:
+            self.deduped += 1
+        log.info("Archivo %s guardado en %s (%d bytes)", media_id, path, size,
+                 extra=kv(media=media_id, created=created))
+        return path
+
+    async def _download(self, media_id: str):
+        r = await self.graph.media_info(media_id)
+        _check(r, "media")
+        try:
+            info = r.json()
+        except ValueError:
+            raise MediaRetry("respuesta de Graph no es JSON")
+        url = info.get("url")
+        if not url:
+            raise MediaError("Graph no devolvió url")
+        if int(info.get("file_size") or 0) > self.store.max_bytes:
+            raise MediaTooLarge(f"file_size {info['file_size']} supera {self.store.max_bytes} bytes")
+
+        ext = mimetypes.guess_extension((info.get("mime_type") or "").split(";")[0].strip()) or ""
+        async with self.graph.stream(url, timeout=self.timeout) as resp:
+            _check(resp, "descarga")
+            if int(resp.headers.get("content-length") or 0) > self.store.max_bytes:
+                raise MediaTooLarge(f"content-length supera {self.store.max_bytes} bytes")
+            return await self.store.save(resp.aiter_bytes(self.store.chunk_size), ext,
+                                         expected_sha256=info.get("sha256"))
+
+    # ---------------- base de datos ----------------
+    def _register(self, media_id: str, wa_from: str, mime_type: str):
+        stmt = sqlite_insert(MediaFile).values(
+            media_id=media_id, wa_from=wa_from, mime_type=mime_type, status="pending",
+        ).on_conflict_do_nothing(index_elements=[MediaFile.media_id])
+        with self.bind.begin() as conn:
+            conn.execute(stmt)
+
+    def _finish(self, media_id: str, attempts: int, sha256: str = None, path: str = None,
+                size: int = None, error: str = None):
+        """
+        Estado final del archivo y, si se guardó, la ruta en las
+        inscripciones que todavía tienen el marcador: misma transacción.
+        """
+        values = {
+            "status": "stored" if path else "failed", "sha256": sha256, "path": path,
+            "size": size, "error": error, "attempts": MediaFile.attempts + attempts,
+            "stored_at": func.now() if path else None,
+        }
+        with self.bind.begin() as conn:
+            conn.execute(update(MediaFile).where(MediaFile.media_id == media_id).values(**values))
+            if path:
+                conn.execute(
+                    update(Enrollment)
+                    .where(Enrollment.ci_image_url == media_marker(media_id))
+                    .values(ci_image_url=path)
+                )
+
+    def _unfinished(self):
+        with self.bind.connect() as conn:
+            return conn.execute(
+                select(MediaFile.media_id, MediaFile.wa_from, MediaFile.mime_type)
+                .where(MediaFile.status == "pending")
+                .order_by(MediaFile.created_at)
+            ).all()
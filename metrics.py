@@ -0,0 +1,128 @@
+# ============================================================
+#   MÉTRICAS (formato de texto de Prometheus)
+#   Contadores e histogramas en memoria, gauges leídos al
+#   exportar; un registro cuesta un dict lookup y un bisect
+# ============================================================
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Segundos: de 1 ms a 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name   = name
+        self.help   = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, v in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_num(v)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name    = name
+        self.help    = help
+        self.labels  = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}    # labels -> [conteo por bucket..., +Inf, suma]
+
+    def observe(self, value: float, *label_values):
+        s = self._series.get(label_values)
+        if s is None:
+            s = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = self.buckets + (float("inf"),)
+        for key, s in sorted(self._series.items()):
+            acc = 0
+            for le, n in zip(bounds, s):
+                acc += n
+                le_label = 'le="' + _num(le) + '"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le_label)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_num(s[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {acc}"
+
+
+class Gauge:
+    """
+    Valor leído en el momento de exportar (profundidad de colas,
+    pedidos en vuelo): no cuesta nada en el camino caliente.
+    """
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn   = fn
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_num(self.fn())}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn) -> Gauge:
+        return self._add(Gauge(name, help, fn))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            try:
+                lines.extend(m.render())
+            except Exception:
+                # Un gauge roto no debe tirar toda la exportación
+                continue
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,120 @@
+# ============================================================
+#   MIGRACIONES DE ESQUEMA
+#   Tabla schema_version + pasos ordenados; se corren al iniciar
+#   (bajo un lock exclusivo: varios workers arrancan a la vez)
+# ============================================================
+
+import logging
+
+from sqlalchemy import text
+
+log = logging.getLogger(__name__)
+
+
+def _add_column(table: str, column: str, ddl: str):
+    """
+    ALTER TABLE ... ADD COLUMN solo si la columna no existe
+    (create_all ya la crea en bases nuevas).
+    """
+    def step(conn):
+        cols = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+        if column not in cols:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+
+# (versión, descripción, [pasos]) — un paso es SQL o una función(conn).
+# Nunca editar una migración ya publicada: agregar una nueva al final.
+MIGRATIONS = [
+    (1, "índices de leads por teléfono e intención", [
+        "CREATE INDEX IF NOT EXISTS ix_leads_wa_from_id ON leads (wa_from, id)",
+        "CREATE INDEX IF NOT EXISTS ix_leads_intent ON leads (intent, id)",
+    ]),
+    (2, "fecha en leads", [
+        _add_column("leads", "created_at", "DATETIME"),
+        "CREATE INDEX IF NOT EXISTS ix_leads_created_at ON leads (created_at)",
+    ]),
+    (3, "índice de inscripciones por fecha", [
+        "CREATE INDEX IF NOT EXISTS ix_enrollments_created_at ON enrollments (created_at, id)",
+    ]),
+    (4, "índice de entregas de campaña por estado", [
+        "CREATE INDEX IF NOT EXISTS ix_campaign_deliveries_status"
+        " ON campaign_deliveries (campaign_id, status)",
+    ]),
+    (5, "índice de archivos multimedia por estado", [
+        "CREATE INDEX IF NOT EXISTS ix_media_files_status ON media_files (status, created_at)",
+    ]),
+    (6, "fecha de última escritura en sessions", [
+        _add_column("sessions", "updated_at", "DATETIME"),
+        # las sesiones existentes cuentan como activas desde hoy
+        "UPDATE sessions SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_sessions_updated_at ON sessions (updated_at)",
+    ]),
+    (7, "historial de intenciones en daily_stats", [
+        # una sola vez: lo que ya está en leads y en lead_daily_stats
+        "INSERT OR IGNORE INTO daily_stats (date, metric, key, value)"
+        " SELECT date, 'intent', intent, SUM(count) FROM ("
+        "  SELECT date, intent, count FROM lead_daily_stats"
+        "  UNION ALL"
+        "  SELECT substr(created_at, 1, 10), COALESCE(intent, ''), COUNT(*) FROM leads"
+        "  WHERE created_at IS NOT NULL GROUP BY 1, 2"
+        " ) GROUP BY date, intent",
+    ]),
+]
+
+
+def current_version(conn) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " description TEXT,"
+        " applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def _apply(conn, migrations) -> int:
+    version = current_version(conn)
+    for num, description, steps in sorted(migrations, key=lambda m: m[0]):
+        if num <= version:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(text(step))
+        conn.execute(
+            text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+            {"v": num, "d": description},
+        )
+        log.info("Migración %d aplicada: %s", num, description)
+        version = num
+    return version
+
+
+def run_migrations(engine, metadata=None, migrations=MIGRATIONS, lock_timeout_ms=60000) -> int:
+    """
+    create_all (si se pasa metadata) + migraciones pendientes, todo en una
+    transacción BEGIN EXCLUSIVE: con varios workers arrancando a la vez,
+    uno crea/migra y los demás esperan el lock (hasta lock_timeout_ms)
+    y después leen schema_version ya al día, sin repetir ningún paso.
+    Devuelve la versión final del esquema.
+    """
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            busy = conn.exec_driver_sql("PRAGMA busy_timeout").scalar()
+            conn.exec_driver_sql(f"PRAGMA busy_timeout={int(lock_timeout_ms)}")
+            conn.exec_driver_sql("BEGIN EXCLUSIVE")
+        try:
+            if metadata is not None:
+                metadata.create_all(bind=conn)
+            version = _apply(conn, migrations)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if sqlite:
+                conn.exec_driver_sql(f"PRAGMA busy_timeout={int(busy)}")
+    return version
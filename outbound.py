@@ -0,0 +1,265 @@
+# ============================================================
+#   PLANIFICADOR DE ENVÍOS SALIENTES (Graph API)
+#   Token bucket por PHONE_NUMBER_ID, prioridad "en vivo" sobre
+#   masivos, reintentos con backoff + jitter y Retry-After,
+#   orden garantizado por destinatario
+# ============================================================
+
+import asyncio
+import itertools
+import logging
+import random
+import time
+from collections import deque
+
+import httpx
+
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+PRIORITY_LIVE = 0   # respuestas a conversaciones
+PRIORITY_BULK = 1   # campañas / envíos masivos
+
+# Códigos de error de Graph que significan "límite de envío"
+THROTTLE_CODES = {4, 80007, 130429, 131048, 131056}
+
+
+class TokenBucket:
+    """
+    rate mensajes/segundo con ráfagas de hasta `burst`.
+    pause() congela el bucket (ej. Retry-After de un 429).
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate         = rate
+        self.capacity     = burst or max(1, int(rate))
+        self.tokens       = float(self.capacity)
+        self.updated      = time.monotonic()
+        self.paused_until = 0.0
+        self._lock        = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _Job:
+    __slots__ = ("to", "payload", "priority", "future", "attempts", "deadline")
+
+    def __init__(self, to, payload, priority, future):
+        self.to       = to
+        self.payload  = payload
+        self.priority = priority
+        self.future   = future
+        self.attempts = 0
+        self.deadline = None
+
+
+class _Stage:
+    """
+    Mensajes a un mismo destinatario que pueden salir en paralelo.
+    """
+    __slots__ = ("jobs", "priority", "remaining")
+
+    def __init__(self, jobs, priority):
+        self.jobs      = jobs
+        self.priority  = priority
+        self.remaining = len(jobs)
+
+
+class OutboundScheduler:
+    """
+    send() encola y espera el resultado del envío.
+    Cada destinatario tiene su fila de etapas: solo la primera está
+    "lista"; la siguiente se libera cuando terminaron todos los
+    mensajes de la anterior. Un send() es una etapa de un mensaje;
+    submit() encola una etapa de varios (salen en paralelo).
+    Los destinatarios listos salen por prioridad (en vivo primero)
+    y cada envío consume un token del bucket.
+
+    live_retry_budget: segundos totales (intentos + esperas) para un envío
+    en vivo desde su primer intento; con el webhook síncrono Meta está
+    esperando la respuesta HTTP. None = solo max_retries.
+    """
+
+    def __init__(self, graph, rate: float = 20, burst: int = None, concurrency: int = 16,
+                 max_retries: int = 6, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 live_retry_budget: float = None):
+        self.graph        = graph
+        self.bucket       = TokenBucket(rate, burst)
+        self.concurrency  = concurrency
+        self.max_retries  = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max  = backoff_max
+        self.live_retry_budget = live_retry_budget
+        self._fifo        = {}      # to -> deque[_Stage]
+        self._ready       = None    # PriorityQueue[(prioridad, seq, to)]
+        self._seq         = itertools.count()
+        self._sem         = None
+        self._task        = None
+        self._jobs        = set()   # tasks de envío en curso (referencia fuerte)
+        self.sent         = 0
+        self.failed       = 0
+        self.retried      = 0
+        self.throttled    = 0
+        self.in_flight    = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(stage.remaining for q in self._fifo.values() for stage in q)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._fifo  = {}
+            self.bucket._lock = None
+            self._ready = asyncio.PriorityQueue()
+            self._sem   = asyncio.Semaphore(self.concurrency)
+            self._task  = asyncio.create_task(self._dispatch_loop(), name="outbound-scheduler")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        if self._task is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self._fifo and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._fifo:
+            log.warning("Envíos: %d mensajes sin enviar al cerrar", self.pending)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def send(self, to: str, payload: dict, priority: int = PRIORITY_LIVE) -> dict:
+        return await self.submit(to, [payload], priority)[0]
+
+    def submit(self, to: str, payloads, priority: int = PRIORITY_LIVE) -> list:
+        """
+        Encola una etapa sin esperar: devuelve un future por payload.
+        Varias llamadas seguidas encolan etapas en orden, así un plan
+        de respuesta completo queda en la fila de una sola vez.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        stage = _Stage([_Job(to, p, priority, loop.create_future()) for p in payloads], priority)
+        if not stage.jobs:
+            return []
+        fifo = self._fifo.get(to)
+        if fifo is None:
+            fifo = self._fifo[to] = deque()
+        fifo.append(stage)
+        if len(fifo) == 1:
+            self._ready.put_nowait((priority, next(self._seq), to))
+        return [job.future for job in stage.jobs]
+
+    # ---------------- internos ----------------
+    async def _dispatch_loop(self):
+        while True:
+            _, _, to = await self._ready.get()
+            stage = self._fifo[to][0]
+            for job in stage.jobs:
+                await self._sem.acquire()
+                task = asyncio.create_task(self._run_job(to, stage, job))
+                self._jobs.add(task)
+                task.add_done_callback(self._jobs.discard)
+
+    async def _run_job(self, to, stage: _Stage, job: _Job):
+        self.in_flight += 1
+        try:
+            result = await self._deliver(job)
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self.failed += 1
+            log.error("Envío descartado tras %d intentos: %s", job.attempts, e, extra=kv(to=to))
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+            stage.remaining -= 1
+            if not stage.remaining:
+                self._next_stage(to)
+
+    def _next_stage(self, to):
+        fifo = self._fifo[to]
+        fifo.popleft()
+        if fifo:
+            self._ready.put_nowait((fifo[0].priority, next(self._seq), to))
+        else:
+            del self._fifo[to]
+
+    async def _deliver(self, job: _Job) -> dict:
+        if self.live_retry_budget and job.priority == PRIORITY_LIVE:
+            job.deadline = time.monotonic() + self.live_retry_budget
+        while True:
+            await self.bucket.acquire()
+            job.attempts += 1
+            retry_after = None
+            timeout = None
+            if job.deadline is not None:
+                timeout = max(0.5, job.deadline - time.monotonic())
+            try:
+                r = await self.graph.post(self.graph.messages_url, job.payload, timeout=timeout)
+            except httpx.TransportError as e:
+                error = e
+            else:
+                try:
+                    body = r.json()
+                except ValueError:
+                    body = {"error": {"status": r.status_code, "body": r.text}}
+
+                if r.is_success:
+                    self.sent += 1
+                    return body
+
+                code = (body.get("error") or {}).get("code") if isinstance(body, dict) else None
+                throttled = r.status_code == 429 or code in THROTTLE_CODES
+                if not (throttled or r.status_code >= 500):
+                    # 4xx definitivo: no tiene sentido reintentar
+                    log.warning("Error al enviar mensaje: %s", r.text, extra=kv(to=job.to))
+                    self.failed += 1
+                    return body
+
+                error = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+                retry_after = _retry_after(r)
+                if throttled:
+                    self.throttled += 1
+                    # El límite es del número emisor: frena todo el bucket
+                    self.bucket.pause(retry_after or self._backoff(job.attempts))
+
+            delay = retry_after if retry_after is not None else self._backoff(job.attempts)
+            if job.attempts > self.max_retries:
+                raise error
+            if job.deadline is not None and time.monotonic() + delay >= job.deadline:
+                # Sin tiempo para otro intento dentro del webhook
+                raise error
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+def _retry_after(r: httpx.Response):
+    value = r.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
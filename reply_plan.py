@@ -0,0 +1,144 @@
+# ============================================================
+#   PLAN DE RESPUESTA (varios mensajes para una misma respuesta)
+#   Partes en orden + regla explícita de orden entre ellas;
+#   el envío lo hace OutboundScheduler por etapas
+# ============================================================
+
+
+def text_payload(to: str, body: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "text",
+        "text": {"body": body}
+    }
+
+
+def buttons_payload(to: str, body: str, buttons) -> dict:
+    """
+    buttons = [("ID1","Texto1"), ("ID2","Texto2")]
+    """
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "interactive",
+        "interactive": {
+            "type": "button",
+            "body": {"text": body},
+            "action": {"buttons": [{"type": "reply", "reply": {"id": bid, "title": text}}
+                                   for bid, text in buttons]}
+        }
+    }
+
+
+def list_payload(to: str, body: str, title: str, rows) -> dict:
+    """
+    rows = [(id, title), (id, title)]
+    """
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "interactive",
+        "interactive": {
+            "type": "list",
+            "body": {"text": body},
+            "action": {
+                "button": title,
+                "sections": [
+                    {"title": title, "rows": [{"id": rid, "title": text} for rid, text in rows]}
+                ]
+            }
+        }
+    }
+
+
+def location_payload(to: str, lat, lng, name: str, address: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "location",
+        "location": {
+            "latitude": float(lat),
+            "longitude": float(lng),
+            "name": name,
+            "address": address
+        }
+    }
+
+
+def template_payload(to: str, name: str, language: str = "es", components=None) -> dict:
+    """
+    Template aprobado en Meta: lo único que se puede enviar fuera
+    de la ventana de 24 h desde el último mensaje del usuario.
+    """
+    template = {"name": name, "language": {"code": language}}
+    if components:
+        template["components"] = components
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "template",
+        "template": template
+    }
+
+
+class Part:
+    __slots__ = ("kind", "build", "args", "with_previous")
+
+    def __init__(self, kind: str, build, args: tuple, with_previous: bool):
+        self.kind          = kind
+        self.build         = build
+        self.args          = args
+        self.with_previous = with_previous
+
+    def payload(self, to: str) -> dict:
+        return self.build(to, *self.args)
+
+
+class ReplyPlan:
+    """
+    Partes de una respuesta, en el orden en que el usuario debe leerlas.
+
+    Regla de orden: por defecto una parte sale recién cuando WhatsApp
+    aceptó la anterior (Graph no garantiza el orden de mensajes enviados
+    a la vez). Con with_previous=True la parte sale junto con la anterior,
+    en paralelo: solo para partes cuyo orden relativo no importa
+    (ej. el pin de ubicación que acompaña a la dirección).
+
+        plan = ReplyPlan().text("📍 Dirección...").location(lat, lng, nombre, dir, with_previous=True)
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def __len__(self) -> int:
+        return len(self.parts)
+
+    def _add(self, kind, build, args, with_previous):
+        self.parts.append(Part(kind, build, args, with_previous and bool(self.parts)))
+        return self
+
+    def text(self, body: str, with_previous: bool = False):
+        return self._add("text", text_payload, (body,), with_previous)
+
+    def buttons(self, body: str, buttons, with_previous: bool = False):
+        return self._add("buttons", buttons_payload, (body, buttons), with_previous)
+
+    def list(self, body: str, title: str, rows, with_previous: bool = False):
+        return self._add("list", list_payload, (body, title, rows), with_previous)
+
+    def location(self, lat, lng, name: str, address: str, with_previous: bool = False):
+        return self._add("location", location_payload, (lat, lng, name, address), with_previous)
+
+    def stages(self):
+        """
+        Etapas en orden: las partes de una etapa salen en paralelo y
+        cada etapa espera a que la anterior termine.
+        """
+        stages = []
+        for part in self.parts:
+            if part.with_previous:
+                stages[-1].append(part)
+            else:
+                stages.append([part])
+        return stages
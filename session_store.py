@@ -0,0 +1,182 @@
+# ============================================================
+#   CACHÉ DE SESIONES (write-back)
+#   Conversaciones activas en memoria; a SQLite se escribe
+#   solo lo modificado, en una transacción por mensaje o por lote.
+# ============================================================
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SessionLocal, SessionState
+
+
+class SessionRecord:
+    """
+    Estado de una conversación. Tiene .state como el modelo SessionState,
+    así los flujos pueden usarlo igual.
+    """
+    __slots__ = ("wa_from", "state", "data", "dirty", "touched")
+
+    def __init__(self, wa_from: str, state: str = "idle", data: dict = None, dirty: bool = False):
+        self.wa_from = wa_from
+        self.state   = state
+        self.data    = data if data is not None else {}
+        self.dirty   = dirty
+        self.touched = time.monotonic()
+
+
+class SessionStore:
+    """
+    LRU con TTL de SessionRecord por wa_from.
+    Lecturas: SQLite solo si la sesión no está en memoria.
+    Escrituras: se marcan "dirty" y se bajan con flush().
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl: float = 1800, max_size: int = 10000):
+        self.session_factory = session_factory
+        self.ttl             = ttl
+        self.max_size        = max_size
+        self._records        = OrderedDict()
+        self._lock           = threading.RLock()
+        self.hits            = 0
+        self.misses          = 0
+        self.flushes         = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    # ---------------- lectura ----------------
+    def get(self, phone: str, db=None) -> SessionRecord:
+        with self._lock:
+            rec = self._records.get(phone)
+            if rec is not None and (rec.dirty or time.monotonic() - rec.touched <= self.ttl):
+                self._records.move_to_end(phone)
+                rec.touched = time.monotonic()
+                self.hits += 1
+                return rec
+
+        self.misses += 1
+        rec = self._load(phone, db)
+        with self._lock:
+            self._records[phone] = rec
+            self._records.move_to_end(phone)
+        self._evict()
+        return rec
+
+    def _load(self, phone: str, db=None) -> SessionRecord:
+        own = db is None
+        db = db or self.session_factory()
+        try:
+            row = db.get(SessionState, phone)
+        finally:
+            if own:
+                db.close()
+        if row is None:
+            # Igual que antes: una sesión nueva queda persistida como "idle"
+            return SessionRecord(phone, "idle", {}, dirty=True)
+        try:
+            data = json.loads(row.data or "{}")
+        except ValueError:
+            data = {}
+        return SessionRecord(phone, row.state or "idle", data)
+
+    # ---------------- escritura ----------------
+    def save(self, phone: str, state: str, payload: dict) -> str:
+        """
+        Devuelve el estado anterior (para contar transiciones).
+        """
+        with self._lock:
+            rec = self._records.get(phone)
+            if rec is None:
+                rec = self._records[phone] = SessionRecord(phone)
+            previous    = rec.state
+            rec.state   = state
+            rec.data    = payload
+            rec.dirty   = True
+            rec.touched = time.monotonic()
+            self._records.move_to_end(phone)
+        return previous
+
+    def clear(self, phone: str):
+        self.save(phone, "idle", {})
+
+    def forget(self, phone: str):
+        """
+        Descarta la copia en memoria: otro proceso modificó la sesión.
+        """
+        with self._lock:
+            self._records.pop(phone, None)
+
+    def flush(self, db=None, phones=None, commit: bool = True) -> int:
+        """
+        Escribe las sesiones modificadas (todas o solo `phones`) con un
+        único INSERT ... ON CONFLICT. Si se pasa `db`, usa esa transacción
+        (el llamador puede sumar otras filas antes del commit).
+        """
+        with self._lock:
+            if phones is None:
+                dirty = [r for r in self._records.values() if r.dirty]
+            else:
+                dirty = [r for r in (self._records.get(p) for p in phones) if r is not None and r.dirty]
+            rows = [{"wa_from": r.wa_from, "state": r.state, "data": json.dumps(r.data)} for r in dirty]
+            for r in dirty:
+                r.dirty = False
+
+        if not rows and (db is None or not commit):
+            return 0
+
+        own = db is None
+        db = db or self.session_factory()
+        try:
+            if rows:
+                stmt = sqlite_insert(SessionState)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[SessionState.wa_from],
+                    set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                          "updated_at": func.now()},
+                )
+                db.execute(stmt, rows)
+            if commit:
+                db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for r in dirty:
+                    r.dirty = True
+            raise
+        finally:
+            if own:
+                db.close()
+
+        self.flushes += 1
+        return len(rows)
+
+    # ---------------- expiración ----------------
+    def _evict(self):
+        """
+        Saca de memoria las sesiones vencidas por TTL o sobrantes por LRU.
+        Las que tienen cambios pendientes se escriben antes.
+        """
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            for phone, rec in self._records.items():
+                if len(self._records) - len(victims) <= self.max_size and now - rec.touched <= self.ttl:
+                    break
+                victims.append(phone)
+            pending = [p for p in victims if self._records[p].dirty]
+        if pending:
+            self.flush(phones=pending)
+        with self._lock:
+            for p in victims:
+                rec = self._records.get(p)
+                if rec is not None and not rec.dirty:
+                    del self._records[p]
+
+    def sweep(self):
+        self._evict()
@@ -0,0 +1,154 @@
+# ============================================================
+#   ESTADO COMPARTIDO ENTRE WORKERS (uvicorn --workers N)
+#   Revisión del contenido en SQLite y dueño por conversación
+#   para que las transiciones de SessionState no se pisen
+# ============================================================
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from database import engine
+from structured_log import kv
+
+log = logging.getLogger(__name__)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class SharedContent:
+    """
+    Fila única content_state: el contenido publicado y una revisión
+    que sube en cada publicación. Los workers comparan su revisión
+    local con revision() (un SELECT por clave primaria) y recargan.
+    """
+
+    def __init__(self, bind=engine):
+        self.bind = bind
+
+    def revision(self) -> int:
+        with self.bind.connect() as conn:
+            rev = conn.execute(text("SELECT revision FROM content_state WHERE id = 1")).scalar()
+        return rev or 0
+
+    def read(self):
+        """
+        (revision, content_json, source_version) o None si nunca se publicó.
+        """
+        with self.bind.connect() as conn:
+            row = conn.execute(text(
+                "SELECT revision, content, source_version FROM content_state WHERE id = 1"
+            )).first()
+        return tuple(row) if row else None
+
+    def publish(self, content_json: str, source_version: str) -> int:
+        with self.bind.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO content_state (id, revision, content, source_version, updated_at)"
+                " VALUES (1, 1, :c, :s, CURRENT_TIMESTAMP)"
+                " ON CONFLICT(id) DO UPDATE SET revision = content_state.revision + 1,"
+                " content = excluded.content, source_version = excluded.source_version,"
+                " updated_at = excluded.updated_at"
+            ), {"c": content_json, "s": source_version})
+            return conn.execute(text("SELECT revision FROM content_state WHERE id = 1")).scalar()
+
+
+class SessionLocks:
+    """
+    Lease por wa_from en session_locks. Solo el dueño procesa mensajes
+    de esa conversación; si el worker muere, el lease vence solo.
+    acquire() devuelve True si otro worker tuvo la sesión desde la
+    última vez (la copia en memoria quedó vieja y hay que recargarla).
+    """
+
+    def __init__(self, bind=engine, lease: float = 30.0, poll: float = 0.02, owner: str = None):
+        self.bind      = bind
+        self.lease     = lease
+        self.poll      = poll
+        self.owner     = owner or worker_id()
+        self.acquired  = 0
+        self.contended = 0
+
+    def try_acquire(self, phone: str):
+        """
+        None si otro worker la tiene; si no, True/False como acquire().
+        """
+        now = time.time()
+        try:
+            with self.bind.begin() as conn:
+                got = conn.execute(text(
+                    "INSERT INTO session_locks (wa_from, owner, expires_at) VALUES (:p, :me, :exp)"
+                    " ON CONFLICT(wa_from) DO UPDATE SET owner = :me, expires_at = :exp"
+                    " WHERE session_locks.owner IN ('', :me) OR session_locks.owner IS NULL"
+                    " OR session_locks.expires_at < :now"
+                ), {"p": phone, "me": self.owner, "exp": now + self.lease, "now": now}).rowcount
+                if not got:
+                    return None
+                writer = conn.execute(
+                    text("SELECT writer FROM session_locks WHERE wa_from = :p"), {"p": phone}
+                ).scalar()
+                if writer != self.owner:
+                    conn.execute(text("UPDATE session_locks SET writer = :me WHERE wa_from = :p"),
+                                 {"p": phone, "me": self.owner})
+        except OperationalError as e:
+            # "database is locked": se reintenta como si estuviera tomada
+            log.debug("session_locks ocupada: %s", e)
+            return None
+        self.acquired += 1
+        return writer is not None and writer != self.owner
+
+    async def acquire(self, phone: str) -> bool:
+        delay = self.poll
+        while True:
+            # Escritura en SQLite (hasta busy_timeout): fuera del event loop
+            stale = await asyncio.to_thread(self.try_acquire, phone)
+            if stale is not None:
+                return stale
+            self.contended += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def renew(self, phone: str) -> bool:
+        """
+        Extiende el lease si todavía es nuestro. False si ya no lo es.
+        """
+        try:
+            with self.bind.begin() as conn:
+                return bool(conn.execute(text(
+                    "UPDATE session_locks SET expires_at = :exp WHERE wa_from = :p AND owner = :me"
+                ), {"p": phone, "me": self.owner, "exp": time.time() + self.lease}).rowcount)
+        except OperationalError as e:
+            log.debug("No se pudo renovar la sesión: %s", e)
+            return True
+
+    async def keep_alive(self, phone: str):
+        """
+        Task mientras se procesa: renueva cada lease/3 hasta que se cancela.
+        """
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await asyncio.to_thread(self.renew, phone):
+                log.warning("Sesión tomada por otro worker (lease vencido)", extra=kv(phone=phone))
+                return
+
+    async def release(self, phone: str):
+        await asyncio.to_thread(self._release, phone)
+
+    def _release(self, phone: str):
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(text(
+                    "UPDATE session_locks SET owner = '', expires_at = 0"
+                    " WHERE wa_from = :p AND owner = :me"
+                ), {"p": phone, "me": self.owner})
+        except OperationalError as e:
+            # El lease vence solo; el próximo dueño recarga la sesión
+            log.warning("No se pudo liberar la sesión: %s", e)
@@ -0,0 +1,205 @@
+# ============================================================
+#   ESTADÍSTICAS DEL PANEL (/admin/stats)
+#   Contadores por día que se actualizan con cada mensaje y cada
+#   paso de inscripción: deltas en memoria, a SQLite cada N s con
+#   un upsert que suma. Leer un rango cuesta O(días), no O(filas)
+# ============================================================
+
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import engine, DailyStat
+
+log = logging.getLogger(__name__)
+
+# Pasos del embudo de inscripción, en orden; "confirmado" = Enrollment guardado
+FUNNEL = ("insc_pide_ci", "insc_pide_nombre", "insc_pide_curso", "insc_pide_nivel",
+          "insc_pide_hora", "insc_confirmar", "confirmado")
+
+# Segundos hasta confirmar: la mediana sale de estos buckets (interpolada)
+CONFIRM_BUCKETS = (30, 60, 120, 180, 300, 450, 600, 900, 1200, 1800, 3600,
+                   7200, 14400, 43200, 86400, 259200, 604800)
+
+AI_OUTCOMES = ("answered", "cache_hit", "fallback")
+
+
+def _today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+
+def _bucket_key(seconds: float) -> str:
+    i = bisect_left(CONFIRM_BUCKETS, seconds)
+    return str(CONFIRM_BUCKETS[i]) if i < len(CONFIRM_BUCKETS) else "inf"
+
+
+def median_from_buckets(counts: dict):
+    """
+    Mediana aproximada de {"<límite superior>"|"inf": n}, interpolando
+    dentro del bucket. None si no hay datos.
+    """
+    total = sum(counts.values())
+    if not total:
+        return None
+    half, acc, lower = total / 2, 0, 0
+    for upper in CONFIRM_BUCKETS + (None,):
+        n = counts.get(str(upper) if upper else "inf", 0)
+        if n and acc + n >= half:
+            if upper is None:
+                return float(lower)
+            return round(lower + (upper - lower) * (half - acc) / n, 1)
+        acc += n
+        lower = upper or lower
+    return float(lower)
+
+
+class StatsAggregator:
+    """
+    inc() suma en memoria (un dict, sin I/O); flush() baja los deltas
+    con INSERT ... ON CONFLICT DO UPDATE SET value = value + delta, así
+    varios workers suman sobre las mismas filas sin pisarse.
+    report() lee las filas del rango más lo que todavía no se bajó.
+    """
+
+    def __init__(self, flush_interval: float = 10, bind=engine):
+        self.flush_interval = flush_interval
+        self.bind           = bind
+        self._pending       = {}    # (date, metric, key) -> delta
+        self._lock          = threading.Lock()
+        self._task          = None
+        self.flushes        = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ---------------- registro ----------------
+    def inc(self, metric: str, key: str, amount: int = 1, day: str = None):
+        k = (day or _today(), metric, key or "")
+        with self._lock:
+            self._pending[k] = self._pending.get(k, 0) + amount
+
+    def intent(self, intent: str):
+        self.inc("intent", intent)
+
+    def step(self, state: str):
+        if state in FUNNEL:
+            self.inc("funnel", state)
+
+    def ai(self, outcome: str):
+        self.inc("ai", outcome)
+
+    def confirmed(self, seconds: float = None):
+        self.inc("funnel", "confirmado")
+        if seconds is not None and seconds >= 0:
+            self.inc("confirm_seconds", _bucket_key(seconds))
+
+    # ---------------- persistencia ----------------
+    def flush(self) -> int:
+        with self._lock:
+            deltas, self._pending = self._pending, {}
+        if not deltas:
+            return 0
+        rows = [{"date": d, "metric": m, "key": k, "value": v} for (d, m, k), v in deltas.items()]
+        stmt = sqlite_insert(DailyStat)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailyStat.date, DailyStat.metric, DailyStat.key],
+            set_={"value": DailyStat.value + stmt.excluded.value},
+        )
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(stmt, rows)
+        except Exception:
+            with self._lock:
+                for k, v in deltas.items():
+                    self._pending[k] = self._pending.get(k, 0) + v
+            raise
+        self.flushes += 1
+        return len(rows)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="stats-flusher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                log.error("Error guardando estadísticas: %s", e)
+
+    # ---------------- lectura ----------------
+    def counts(self, since: str, until: str) -> dict:
+        """
+        {(date, metric, key): value} del rango (fechas incluidas).
+        """
+        with self.bind.connect() as conn:
+            rows = conn.execute(
+                select(DailyStat.date, DailyStat.metric, DailyStat.key, DailyStat.value)
+                .where(DailyStat.date >= since, DailyStat.date <= until)
+            ).all()
+        out = {(d, m, k): v for d, m, k, v in rows}
+        with self._lock:
+            for (d, m, k), v in self._pending.items():
+                if since <= d <= until:
+                    out[(d, m, k)] = out.get((d, m, k), 0) + v
+        return out
+
+    def report(self, since: date, until: date) -> dict:
+        counts = self.counts(since.isoformat(), until.isoformat())
+
+        by_day, intents, funnel, ai, confirm = {}, {}, dict.fromkeys(FUNNEL, 0), {}, {}
+        for (d, metric, key), v in counts.items():
+            if metric == "intent":
+                day = by_day.setdefault(d, {})
+                day[key] = day.get(key, 0) + v
+                intents[key] = intents.get(key, 0) + v
+            elif metric == "funnel" and key in funnel:
+                funnel[key] += v
+            elif metric == "ai":
+                ai[key] = ai.get(key, 0) + v
+            elif metric == "confirm_seconds":
+                confirm[key] = confirm.get(key, 0) + v
+
+        started = funnel[FUNNEL[0]]
+        ai_total = sum(ai.get(k, 0) for k in AI_OUTCOMES)
+        return {
+            "since": since.isoformat(),
+            "until": until.isoformat(),
+            "intents": dict(sorted(intents.items(), key=lambda kv: -kv[1])),
+            "intents_by_day": {d: by_day[d] for d in sorted(by_day)},
+            "funnel": [
+                {"step": step, "count": n, "pct": round(100 * n / started, 1) if started else None}
+                for step, n in funnel.items()
+            ],
+            "ai": {
+                **{k: ai.get(k, 0) for k in AI_OUTCOMES},
+                "fallback_rate": round(ai.get("fallback", 0) / ai_total, 4) if ai_total else None,
+            },
+            "median_seconds_to_confirm": median_from_buckets(confirm),
+            "confirmations_timed": sum(confirm.values()),
+        }
+
+
+def date_range(since=None, until=None, default_days: int = 7):
+    """
+    (since, until) como date; por defecto los últimos default_days días.
+    """
+    until = date.fromisoformat(str(until)[:10]) if until else datetime.utcnow().date()
+    since = date.fromisoformat(str(since)[:10]) if since else until - timedelta(days=default_days - 1)
+    if since > until:
+        raise ValueError("since debe ser anterior a until")
+    return since, until
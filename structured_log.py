@@ -0,0 +1,131 @@
+# ============================================================
+#   LOGS ESTRUCTURADOS (JSON lines)
+#   El request solo encola el LogRecord; el formato, el redactado
+#   y la escritura ocurren en un hilo aparte (QueueListener).
+# ============================================================
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Claves cuyo valor es un teléfono o un CI
+PHONE_KEYS = {"from", "to", "wa_id", "wa_from", "phone", "recipient_id", "display_phone_number"}
+SECRET_KEYS = {"ci"}
+
+# 5 o más dígitos seguidos (con espacios o guiones): teléfonos, CI
+_DIGITS = re.compile(r"\+?\d(?:[ \-]?\d){4,}")
+
+
+def _mask_digits(m) -> str:
+    s = m.group(0)
+    return "*" * max(0, len(s) - 2) + s[-2:]
+
+
+def redact_text(text: str) -> str:
+    return _DIGITS.sub(_mask_digits, text)
+
+
+def redact(obj, key: str = None):
+    """
+    Copia redactada de un payload: teléfonos enmascarados (quedan los
+    2 últimos dígitos), CI ocultos y números largos en textos tapados.
+    """
+    if key in SECRET_KEYS and obj not in (None, ""):
+        return "[redactado]"
+    if isinstance(obj, dict):
+        return {k: redact(v, k) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [redact(v) for v in obj]
+    if isinstance(obj, str):
+        if key in PHONE_KEYS:
+            return "*" * max(0, len(obj) - 2) + obj[-2:]
+        return redact_text(obj)
+    return obj
+
+
+def kv(**fields) -> dict:
+    """
+    log.info("mensaje", extra=kv(phone=..., intent=...))
+    """
+    return {"fields": fields}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact_text(record.getMessage()),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(redact(fields))
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Cola acotada: si se llena, el log se descarta (y se cuenta)
+    en lugar de frenar al request.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Sin formatear acá: el formatter corre en el hilo del listener
+        return copy.copy(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler  = None
+
+
+def setup_logging(level: str = "INFO", queue_size: int = 10000, stream=None) -> DroppingQueueHandler:
+    global _listener, _handler
+    if _handler is not None:
+        return _handler
+
+    out = logging.StreamHandler(stream or sys.stdout)
+    out.setFormatter(JsonFormatter())
+
+    q = queue.Queue(maxsize=queue_size)
+    _handler  = DroppingQueueHandler(q)
+    _listener = QueueListener(q, out, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(_handler)
+    # Una línea por request a Graph/OpenAI es demasiado ruido
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    atexit.register(shutdown_logging)
+    return _handler
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def should_sample(rate: float) -> bool:
+    return rate >= 1 or (rate > 0 and random.random() < rate)
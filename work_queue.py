@@ -0,0 +1,88 @@
+# ============================================================
+#   COLA DE PROCESAMIENTO EN SEGUNDO PLANO
+#   El webhook solo encola; un pool de workers asyncio procesa
+# ============================================================
+
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    Cola acotada + N workers asyncio.
+    submit() aplica backpressure: espera hasta put_timeout segundos
+    a que haya lugar y devuelve False si la cola sigue llena.
+    """
+
+    def __init__(self, handler, maxsize: int = 1000, workers: int = 4,
+                 put_timeout: float = 0.5, name: str = "webhook"):
+        self.handler     = handler
+        self.maxsize     = maxsize
+        self.workers     = workers
+        self.put_timeout = put_timeout
+        self.name        = name
+        self._queue      = None
+        self._tasks      = []
+        self.processed   = 0
+        self.failed      = 0
+        self.rejected    = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+        log.info("Cola '%s' iniciada: %d workers, capacidad %d", self.name, self.workers, self.maxsize)
+
+    async def submit(self, item) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._queue.put(item), timeout=self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Espera a que se vacíe la cola (hasta drain_timeout) y detiene los workers.
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning("Cola '%s': %d elementos sin procesar al cerrar", self.name, self.depth)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, idx: int):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                log.exception("Error en worker %s-%d: %s", self.name, idx, e)
+            finally:
+                self._queue.task_done()